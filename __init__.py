@@ -17,8 +17,9 @@ bl_info = {
 }
 
 
-modulesNames = ['addon_updater', 'addon_updater_ops', 'quicksnap_utils', 'quicksnap_snapdata', 'quicksnap_render',
-                'quicksnap']
+modulesNames = ['addon_updater', 'addon_updater_ops', 'quicksnap_profiling', 'quicksnap_recorder', 'quicksnap_utils',
+                'quicksnap_engine', 'quicksnap_geometry', 'quicksnap_meshdata', 'quicksnap_snapdata', 'quicksnap_render',
+                'quicksnap_session', 'quicksnap']
 
 modulesFullNames = {}
 for currentModuleName in modulesNames:
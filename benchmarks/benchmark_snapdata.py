@@ -0,0 +1,362 @@
+"""
+Headless SnapData benchmarks on synthetic scenes.
+
+Usage:
+    blender --background --factory-startup --python benchmarks/benchmark_snapdata.py -- [options]
+
+Options:
+    --scenes huge_mesh,many_objects,...   Scenes to run (default: all)
+    --scale 1.0                           Multiplier applied to the scene sizes
+    --snap-type POINTS                    POINTS, MIDPOINTS, FACES or ORIGINS
+    --mouse-samples 500                   find_closest calls per mouse path
+    --output results.json                 Write the results to a JSON file (printed to stdout otherwise)
+
+For each scene, measures the SnapData construction, process_iteration until all the points are ingested (throughput
+and per-iteration latency), find_closest along scripted mouse paths (latency percentiles) and the peak memory
+allocated during the run. The peak memory is measured with tracemalloc in a second, untimed run, tracemalloc slows
+down every allocation.
+"""
+import argparse
+import importlib
+import json
+import math
+import sys
+import time
+import tracemalloc
+import types
+from pathlib import Path
+
+import bpy
+import numpy as np
+from mathutils import Matrix, Vector
+
+REGION_WIDTH = 1920
+REGION_HEIGHT = 1080
+
+
+def import_addon_module(module_name):
+    """
+    Import an addon module without running the addon __init__ (registration, GPU shaders are not available in
+    background mode).
+    """
+    package_dir = Path(__file__).resolve().parents[1]
+    package_name = package_dir.name
+    if package_name not in sys.modules:
+        package = types.ModuleType(package_name)
+        package.__path__ = [str(package_dir)]
+        sys.modules[package_name] = package
+    return importlib.import_module(f"{package_name}.{module_name}")
+
+
+class BenchmarkSettings:
+    """
+    Stand-in for the addon preferences used by SnapData.
+    """
+
+    def __init__(self, snap_type, progressive_modifiers=False):
+        self.snap_source_type = snap_type
+        self.snap_target_type = snap_type
+        self.ignore_modifiers = False
+        self.snap_objects_origin = 'ALWAYS'
+        self.progressive_modifiers = progressive_modifiers
+        self.evaluated_vertex_limit = 0
+
+
+class BenchmarkRegion:
+    def __init__(self, region_3d, width=REGION_WIDTH, height=REGION_HEIGHT):
+        self.type = 'WINDOW'
+        self.width = width
+        self.height = height
+        self.data = region_3d
+
+
+class BenchmarkRegion3D:
+    """
+    Perspective view looking at {target} from {location}, with the attributes of RegionView3D used by SnapData.
+    """
+
+    def __init__(self, location, target, fov=math.radians(50), near=0.01, far=10000):
+        rotation = (target - location).to_track_quat('-Z', 'Y')
+        camera_matrix = Matrix.Translation(location) @ rotation.to_matrix().to_4x4()
+        aspect = REGION_WIDTH / REGION_HEIGHT
+        focal = 1 / math.tan(fov / 2)
+        projection = Matrix((
+            (focal / aspect, 0, 0, 0),
+            (0, focal, 0, 0),
+            (0, 0, (far + near) / (near - far), 2 * far * near / (near - far)),
+            (0, 0, -1, 0),
+        ))
+        self.set_view(camera_matrix.inverted(), projection)
+
+    def set_view(self, view_matrix, window_matrix, view_perspective='PERSP', is_perspective=True):
+        self.view_perspective = view_perspective
+        self.is_perspective = is_perspective
+        self.view_matrix = view_matrix
+        self.view_rotation = view_matrix.inverted().to_quaternion()
+        self.window_matrix = window_matrix
+        self.perspective_matrix = window_matrix @ view_matrix
+        self.view_location = view_matrix.inverted().translation
+        self.view_distance = 0
+        self.view_camera_zoom = 0
+
+
+class BenchmarkSpaceView3D:
+    def __init__(self, region_3d):
+        self.region_3d = region_3d
+        self.camera = None
+        self.local_view = None
+
+
+class BenchmarkContext:
+    """
+    Stand-in for the 3D View context the operator gives to SnapData, built on the real scene/depsgraph.
+    """
+
+    def __init__(self, region_3d, width=REGION_WIDTH, height=REGION_HEIGHT):
+        self.space_data = BenchmarkSpaceView3D(region_3d)
+        self.region_data = region_3d
+        self.region = BenchmarkRegion(region_3d, width, height)
+        self.active_object = None
+        self.scene = bpy.context.scene
+        self.view_layer = bpy.context.view_layer
+
+    def evaluated_depsgraph_get(self):
+        return bpy.context.evaluated_depsgraph_get()
+
+
+def clear_scene():
+    bpy.ops.wm.read_factory_settings(use_empty=True)
+
+
+def grid_mesh(name, subdivisions, size=10.0):
+    """
+    Returns a flat grid mesh of (subdivisions + 1)^2 vertices, built from arrays.
+    """
+    coords = np.linspace(-size / 2, size / 2, subdivisions + 1)
+    grid_x, grid_y = np.meshgrid(coords, coords)
+    vertices = np.column_stack((grid_x.ravel(), grid_y.ravel(), np.zeros(grid_x.size)))
+    row = np.arange(subdivisions)
+    corner = (row[:, np.newaxis] * (subdivisions + 1) + row[np.newaxis, :]).ravel()
+    faces = np.column_stack((corner, corner + 1, corner + subdivisions + 2, corner + subdivisions + 1))
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(vertices))
+    mesh.vertices.foreach_set('co', vertices.ravel())
+    mesh.loops.add(faces.size)
+    mesh.loops.foreach_set('vertex_index', faces.ravel())
+    mesh.polygons.add(len(faces))
+    mesh.polygons.foreach_set('loop_start', np.arange(0, faces.size, 4))
+    mesh.polygons.foreach_set('loop_total', np.full(len(faces), 4))
+    mesh.update(calc_edges=True)
+    return mesh
+
+
+def link_object(name, data, location=(0, 0, 0)):
+    obj = bpy.data.objects.new(name, data)
+    obj.location = location
+    bpy.context.scene.collection.objects.link(obj)
+    return obj
+
+
+def object_grid_locations(count, spacing):
+    side = math.ceil(math.sqrt(count))
+    return [((index % side - side / 2) * spacing, (index // side - side / 2) * spacing, 0) for index in range(count)]
+
+
+def build_huge_mesh(scale):
+    subdivisions = int(1000 * math.sqrt(scale))
+    link_object("huge_mesh", grid_mesh("huge_mesh", subdivisions, size=100))
+    return 100
+
+
+def build_many_objects(scale):
+    count = int(10000 * scale)
+    base_mesh = grid_mesh("small_mesh", 2, size=0.5)
+    for index, location in enumerate(object_grid_locations(count, 1)):
+        link_object(f"small_{index}", base_mesh.copy(), location)
+    return math.sqrt(count)
+
+
+def build_linked_duplicates(scale):
+    count = int(10000 * scale)
+    base_mesh = grid_mesh("linked_mesh", 10, size=0.5)
+    for index, location in enumerate(object_grid_locations(count, 1)):
+        link_object(f"linked_{index}", base_mesh, location)
+    return math.sqrt(count)
+
+
+def build_dense_curves(scale):
+    curve_count = max(1, int(100 * scale))
+    points_per_curve = 5000
+    for curve_index in range(curve_count):
+        curve = bpy.data.curves.new(f"curve_{curve_index}", type='CURVE')
+        curve.dimensions = '3D'
+        spline = curve.splines.new('POLY')
+        spline.points.add(points_per_curve - 1)
+        angles = np.linspace(0, 20 * math.pi, points_per_curve)
+        points = np.column_stack((np.cos(angles) * 5, np.sin(angles) * 5, np.linspace(0, 10, points_per_curve),
+                                  np.ones(points_per_curve)))
+        spline.points.foreach_set('co', points.ravel())
+        link_object(f"curve_{curve_index}", curve, ((curve_index % 10) * 12 - 60, (curve_index // 10) * 12 - 60, 0))
+    return 120
+
+
+def build_modifier_stack(scale):
+    count = max(1, int(10 * scale))
+    for index, location in enumerate(object_grid_locations(count, 6)):
+        obj = link_object(f"modified_{index}", grid_mesh(f"modified_{index}", 10, size=4), location)
+        subdivision = obj.modifiers.new("Subdivision", 'SUBSURF')
+        subdivision.levels = 3
+        array = obj.modifiers.new("Array", 'ARRAY')
+        array.count = 3
+        obj.modifiers.new("Bevel", 'BEVEL')
+    return math.sqrt(count) * 6 * 3
+
+
+scenes = {
+    'huge_mesh': build_huge_mesh,
+    'many_objects': build_many_objects,
+    'linked_duplicates': build_linked_duplicates,
+    'dense_curves': build_dense_curves,
+    'modifier_stack': build_modifier_stack,
+}
+
+
+def mouse_paths(sample_count):
+    """
+    Scripted mouse paths in region coordinates: a horizontal sweep, a diagonal and a lissajous curve.
+    """
+    t = np.linspace(0, 1, sample_count)
+    return {
+        'horizontal': np.column_stack((t * REGION_WIDTH, np.full(sample_count, REGION_HEIGHT / 2))),
+        'diagonal': np.column_stack((t * REGION_WIDTH, t * REGION_HEIGHT)),
+        'lissajous': np.column_stack(((np.sin(t * 6 * math.pi) * 0.45 + 0.5) * REGION_WIDTH,
+                                      (np.sin(t * 4 * math.pi) * 0.45 + 0.5) * REGION_HEIGHT)),
+    }
+
+
+def percentiles(durations):
+    durations_ms = np.array(durations) * 1000
+    if len(durations_ms) == 0:
+        return {}
+    return {
+        'count': len(durations_ms),
+        'mean_ms': float(durations_ms.mean()),
+        'p50_ms': float(np.percentile(durations_ms, 50)),
+        'p90_ms': float(np.percentile(durations_ms, 90)),
+        'p99_ms': float(np.percentile(durations_ms, 99)),
+        'max_ms': float(durations_ms.max()),
+    }
+
+
+def create_snapdata(quicksnap_snapdata, context, object_names, snap_type, progressive_modifiers):
+    snapdata = quicksnap_snapdata.SnapData(context, context.region,
+                                           BenchmarkSettings(snap_type, progressive_modifiers), [], object_names)
+    if snap_type != 'ORIGINS':
+        depsgraph = context.evaluated_depsgraph_get()
+        for object_name in object_names:
+            snapdata.add_object_data(object_name, depsgraph=depsgraph)
+    return snapdata
+
+
+def measure_peak_memory(quicksnap_snapdata, context, object_names, snap_type, mouse_samples, progressive_modifiers):
+    """
+    Returns the peak memory allocated by the snapdata construction, processing and find_closest calls.
+    """
+    tracemalloc.start()
+    snapdata = create_snapdata(quicksnap_snapdata, context, object_names, snap_type, progressive_modifiers)
+    while snapdata.keep_processing:
+        snapdata.process_iteration(context)
+    for path in mouse_paths(mouse_samples).values():
+        for mouse_x, mouse_y in path:
+            snapdata.find_closest(Vector((mouse_x, mouse_y, 0)))
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak_memory
+
+
+def run_scene(quicksnap_snapdata, scene_name, scale, snap_type, mouse_samples, progressive_modifiers=False):
+    clear_scene()
+    build_start = time.perf_counter()
+    scene_size = scenes[scene_name](scale)
+    build_duration = time.perf_counter() - build_start
+    bpy.context.view_layer.update()
+
+    region_3d = BenchmarkRegion3D(Vector((0, -scene_size * 0.8, scene_size * 0.8)), Vector((0, 0, 0)))
+    context = BenchmarkContext(region_3d)
+    object_names = [obj.name for obj in bpy.data.objects]
+
+    init_start = time.perf_counter()
+    snapdata = create_snapdata(quicksnap_snapdata, context, object_names, snap_type, progressive_modifiers)
+    init_duration = time.perf_counter() - init_start
+
+    iteration_durations = []
+    process_start = time.perf_counter()
+    while snapdata.keep_processing:
+        iteration_start = time.perf_counter()
+        snapdata.process_iteration(context)
+        iteration_durations.append(time.perf_counter() - iteration_start)
+    process_duration = time.perf_counter() - process_start
+
+    find_closest_results = {}
+    for path_name, path in mouse_paths(mouse_samples).items():
+        durations = []
+        for mouse_x, mouse_y in path:
+            mouse_coord = Vector((mouse_x, mouse_y, 0))
+            call_start = time.perf_counter()
+            snapdata.find_closest(mouse_coord)
+            durations.append(time.perf_counter() - call_start)
+        find_closest_results[path_name] = percentiles(durations)
+    point_count = snapdata.added_points_np
+    snapdata = None
+
+    peak_memory = measure_peak_memory(quicksnap_snapdata, context, object_names, snap_type, mouse_samples,
+                                      progressive_modifiers)
+
+    return {
+        'scene': scene_name,
+        'snap_type': snap_type,
+        'progressive_modifiers': progressive_modifiers,
+        'objects': len(object_names),
+        'points': point_count,
+        'scene_build_s': build_duration,
+        'snapdata_init_s': init_duration,
+        'process_s': process_duration,
+        'process_points_per_s': point_count / process_duration if process_duration > 0 else None,
+        'process_iteration': percentiles(iteration_durations),
+        'find_closest': find_closest_results,
+        'peak_memory_mb': peak_memory / 2 ** 20,
+    }
+
+
+def parse_args():
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    parser = argparse.ArgumentParser(description="QuickSnap SnapData benchmarks")
+    parser.add_argument('--scenes', default=','.join(scenes))
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--snap-type', default='POINTS', choices=('POINTS', 'MIDPOINTS', 'FACES', 'ORIGINS'))
+    parser.add_argument('--mouse-samples', type=int, default=500)
+    parser.add_argument('--progressive', action='store_true',
+                        help="snap to the base meshes first and swap the evaluated meshes in while processing")
+    parser.add_argument('--output', default=None)
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    quicksnap_snapdata = import_addon_module('quicksnap_snapdata')
+    results = {
+        'blender_version': bpy.app.version_string,
+        'scale': args.scale,
+        'results': [run_scene(quicksnap_snapdata, scene_name, args.scale, args.snap_type, args.mouse_samples,
+                              args.progressive)
+                    for scene_name in args.scenes.split(',')],
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""
+Replay a QuickSnap session recorded with the "Record sessions to" preference.
+
+Usage:
+    blender scene.blend --background --python benchmarks/replay_session.py -- session.jsonl.gz [--output result.json]
+
+The scene must be the one the session was recorded in. The recorded events drive the snapping session of the operator
+(quicksnap_session.SnapSession): view refresh and projection, frame budget and points processing on TIMER events,
+coalesced mouse moves (closest points search, ray casts, apply with its memo), the snap type/constraint/wireframe/
+modifiers hotkeys and the source pick. Settings changed from the pie menu are not recorded. Events are replayed at their
+recorded time so the mouse coalescing and the frame budget behave as in the recorded session (--as-fast-as-possible
+disables it). The latency of each event is reported per event type, to compare builds on the same session.
+The selection is moved with the live preview path: the transform operator needs a 3D View, it is not available in
+background mode.
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import bpy
+from mathutils import Matrix, Vector
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from benchmark_snapdata import BenchmarkContext, BenchmarkRegion3D, import_addon_module, percentiles
+
+quicksnap_recorder = import_addon_module('quicksnap_recorder')
+quicksnap_session = import_addon_module('quicksnap_session')
+quicksnap_utils = import_addon_module('quicksnap_utils')
+
+NAVIGATION_EVENTS = {'MIDDLEMOUSE', 'WHEELUPMOUSE', 'WHEELDOWNMOUSE'}
+
+
+class ReplaySettings:
+    """
+    Stand-in for the addon preferences, with the values recorded in the session header.
+    """
+
+    def __init__(self, settings):
+        self.snap_source_type = settings['snap_source_type']
+        self.snap_target_type = settings['snap_target_type']
+        self.ignore_modifiers = settings['ignore_modifiers']
+        self.snap_objects_origin = settings['snap_objects_origin']
+        # Not recorded by older sessions
+        self.progressive_modifiers = settings.get('progressive_modifiers', False)
+        self.evaluated_vertex_limit = settings.get('evaluated_vertex_limit', 0)
+        self.display_target_wireframe = settings.get('display_target_wireframe', True)
+        self.cache_memory_limit = settings.get('cache_memory_limit', 256)
+        self.use_direct_preview = True
+        self.use_auto_merge = False
+
+
+def matrix_from_list(values):
+    return Matrix([values[row * 4:row * 4 + 4] for row in range(4)])
+
+
+class SessionReplay(quicksnap_session.SnapSession):
+    def __init__(self, header, realtime=True):
+        super().__init__()
+        self.header = header
+        self.realtime = realtime
+        self.settings = ReplaySettings(header['settings'])
+        self.selection_objects = [name for name in header['selection_objects'] if name in bpy.data.objects]
+        self.no_selection = header['no_selection']
+        self.object_mode = header['object_mode']
+        self.mouse_position = tuple(header['mouse_position'])
+        width, height = header['region_size']
+        self.region_3d = BenchmarkRegion3D(Vector((0, -10, 10)), Vector((0, 0, 0)))
+        self.context = BenchmarkContext(self.region_3d, width, height)
+        self.region = self.context.region
+        self.durations = {}
+
+        for obj in bpy.data.objects:
+            obj.select_set(obj.name in self.selection_objects)
+        if not self.object_mode and len(self.selection_objects) > 0:
+            bpy.context.view_layer.objects.active = bpy.data.objects[self.selection_objects[0]]
+            bpy.ops.object.mode_set(mode='EDIT')
+            self.context.active_object = bpy.context.view_layer.objects.active
+
+    def add_duration(self, name, duration):
+        self.durations.setdefault(name, []).append(duration)
+
+    def on_view(self, view_matrix, window_matrix, view_perspective='PERSP', is_perspective=True):
+        self.region_3d.set_view(matrix_from_list(view_matrix), matrix_from_list(window_matrix), view_perspective,
+                                is_perspective)
+        if self.snapdata_source is None:  # The first view is recorded when the operator starts.
+            start_time = time.perf_counter()
+            self.init_session(self.context, self.region)
+            self.add_duration('init', time.perf_counter() - start_time)
+
+    def on_event(self, event_type, event_value, mouse_position, modifiers):
+        """
+        Same steps as QuickVertexSnapOperator.modal for the events that do not depend on the UI.
+        """
+        if event_type not in NAVIGATION_EVENTS | {'TIMER'}:
+            self.refresh_vertex_data(self.context, self.region)
+        if event_type == 'TIMER':
+            self.frame_budget.tick()
+        snapdata_updated = self.process_snapdata(self.context)
+        if event_value == 'PRESS' and not modifiers & 8:  # See QuickVertexSnapOperator.handle_hotkeys
+            self.handle_session_hotkey(self.context, self.region, event_type, shift=bool(modifiers & 1))
+        if event_type == 'LEFTMOUSE':
+            if self.mouse_coalescer.has_pending:
+                self.process_mouse_move(self.context, self.region, force=True)
+        elif event_type == 'MOUSEMOVE' or snapdata_updated or self.mouse_coalescer.has_pending:
+            if event_type == 'MOUSEMOVE':
+                self.mouse_coalescer.push(mouse_position)
+            self.process_mouse_move(self.context, self.region, force=snapdata_updated)
+        self.trim_object_caches()
+        if event_type in NAVIGATION_EVENTS:
+            self.mouse_position = mouse_position
+
+    def on_state(self, state_value):
+        if state_value != quicksnap_utils.State.SOURCE_PICKED.value or \
+                self.current_state == quicksnap_utils.State.SOURCE_PICKED:
+            return
+        start_time = time.perf_counter()
+        if self.closest_source_id < 0 or not self.pick_source(self.context, self.region):
+            print("Replay: the source point picked in the session was not found, the results will differ")
+            self.current_state = quicksnap_utils.State.SOURCE_PICKED
+        self.add_duration('pick_source', time.perf_counter() - start_time)
+
+    def replay(self, records):
+        replay_start = time.perf_counter()
+        for record in records:
+            if self.realtime:
+                time.sleep(max(0, record[1] - (time.perf_counter() - replay_start)))
+            if record[0] == 'V':
+                self.on_view(*record[2:])
+            elif record[0] == 'S':
+                self.on_state(record[2])
+            elif record[0] == 'E' and self.snapdata_source is not None:
+                start_time = time.perf_counter()
+                self.on_event(record[2], record[3], (record[4], record[5]), record[6])
+                self.add_duration(record[2], time.perf_counter() - start_time)
+        if self.snapdata_source is not None:
+            self.set_object_display("", "")
+            self.revert_data(self.context, apply=True)
+
+    def report(self):
+        return {name: percentiles(durations) for name, durations in self.durations.items()}
+
+
+def parse_args():
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    parser = argparse.ArgumentParser(description="Replay a recorded QuickSnap session")
+    parser.add_argument('session')
+    parser.add_argument('--as-fast-as-possible', action='store_true',
+                        help="do not wait for the recorded time of the events")
+    parser.add_argument('--output', default=None)
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    header, records = quicksnap_recorder.load_session(args.session)
+    session_replay = SessionReplay(header, realtime=not args.as_fast_as_possible)
+    session_replay.replay(records)
+    results = {
+        'session': args.session,
+        'blend_file': bpy.data.filepath,
+        'recorded_blender_version': header.get('blender_version'),
+        'blender_version': bpy.app.version_string,
+        'event_count': sum(1 for record in records if record[0] == 'E'),
+        'latency': session_replay.report(),
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,13 @@
 ﻿import time
-import bmesh
 import bpy
 import logging
-from mathutils import Vector
 
+from . import quicksnap_geometry
+from . import quicksnap_profiling
+from . import quicksnap_recorder
 from . import quicksnap_render
 from . import quicksnap_utils
-from .quicksnap_snapdata import SnapData
-from bpy_extras import view3d_utils
+from .quicksnap_session import SnapSession, snap_type_hotkeys
 from .quicksnap_utils import State
 from . import addon_updater_ops
 
@@ -17,7 +17,7 @@ addon_keymaps = []
 
 
 
-class QuickVertexSnapOperator(bpy.types.Operator):
+class QuickVertexSnapOperator(SnapSession, bpy.types.Operator):
     bl_idname = "object.quicksnap"
     bl_label = "QuickSnap Tool"
     bl_options = { 'REGISTER', 'UNDO'}
@@ -50,8 +50,13 @@ class QuickVertexSnapOperator(bpy.types.Operator):
             self.report({'INFO'},
                         f"QuickSnap: Setting logger level to: DEBUG. Use Ctrl+Shift+TAB to change debug level.")
 
+        # The performance HUD displays the last durations of the profiling timers.
+        quicksnap_profiling.enable(self.settings.enable_profiling or self.settings.display_performance_hud)
+        quicksnap_profiling.reset()
+
         #icons time
         self.icon_display_time = time.time()
+        quicksnap_render.icon_atlas.build()  # Fallback if the atlas could not be built after registration
 
         # Get selection, if false cancel operation
         self.selection_objects = [obj.name for obj in quicksnap_utils.get_selection_objects(context)]
@@ -66,44 +71,33 @@ class QuickVertexSnapOperator(bpy.types.Operator):
         # Hide objects to ignore if we are in local view.
         if context.space_data.local_view is not None:
             all_scene_objects = [obj for obj in context.view_layer.objects if not obj.hide_get()]
-            ignored_objs = set([obj for obj in all_scene_objects if obj not in context.visible_objects])
+            visible_objects = set(context.visible_objects)
+            ignored_objs = set([obj for obj in all_scene_objects if obj not in visible_objects])
             self.ignored_obj_names = set([obj.name for obj in ignored_objs])
             for obj in ignored_objs:
                 obj.hide_set(True)
 
-        # Create SnapData objects that will store all the vertex/point info (World space, view space, and kdtree to
-        # search the closest point)
-        self.snapdata_source = SnapData(context, region, self.settings, self.selection_objects,
-                                        quicksnap_utils.get_scene_objects(False),
-                                        is_origin=True,
-                                        no_selection=self.no_selection)
-        if self.no_selection:
-            self.snapdata_target = SnapData(context, region, self.settings, [],
-                                            [])
-        else:
-            self.snapdata_target = SnapData(context, region, self.settings, self.selection_objects,
-                                            quicksnap_utils.get_scene_objects(True))
-
-        # Store 3DView camera information.
-        region3d = context.space_data.region_3d
-        self.camera_position = region3d.view_matrix.inverted().translation
-        self.mouse_vector = view3d_utils.region_2d_to_vector_3d(region, context.space_data.region_3d,
-                                                                self.mouse_position)
-        self.perspective_matrix = context.space_data.region_3d.perspective_matrix
-        self.perspective_matrix_inverse = self.perspective_matrix.inverted()
-        self.target_bounds = {}
-        self.target_npdata = {}
-        self.no_selection_target = None
-        self.ignore_modifiers = self.settings.ignore_modifiers
-        self.target_face_index = -1
-        self.target_object_display_backup = {}
-        self.source_highlight_data = {}
-        self.target_highlight_data = {}
-        self.source_allowed_indices = {}
-        self.target_allowed_indices = {}
-        self.source_npdata = {}
-        self.backup_data(context)
-        self.update(context, region)
+        self.recorder = None
+        if self.settings.record_session_path:
+            self.recorder = quicksnap_recorder.SessionRecorder(
+                bpy.path.abspath(self.settings.record_session_path),
+                header={
+                    'blend_file': bpy.data.filepath,
+                    'blender_version': bpy.app.version_string,
+                    'region_size': (region.width, region.height),
+                    'object_mode': self.object_mode,
+                    'no_selection': self.no_selection,
+                    'selection_objects': self.selection_objects,
+                    'mouse_position': self.mouse_position,
+                    'settings': {name: getattr(self.settings, name) for name in
+                                 ('snap_source_type', 'snap_target_type', 'ignore_modifiers', 'snap_objects_origin',
+                                  'progressive_modifiers', 'evaluated_vertex_limit', 'use_direct_preview',
+                                  'display_target_wireframe', 'cache_memory_limit')},
+                })
+            self.recorder.record_view(context.space_data.region_3d)
+        self.redraw_tracker = quicksnap_utils.RedrawTracker()
+        self.candidate_points = quicksnap_geometry.PointSegments()
+        self.init_session(context, region)
         self.clickdrag = True
         self.last_event = None
         self.clicktime = 0
@@ -111,353 +105,30 @@ class QuickVertexSnapOperator(bpy.types.Operator):
         self.detect_hotkey()
         return True
 
-    def backup_data(self, context):
-        """
-        Backup points positions if in Object mode, otherwise backup object positions. used for cancelling operator
-        """
-        self.backup_object_positions = {}
-        if self.object_mode:
-            selection = quicksnap_utils.keep_only_parents(
-                [bpy.data.objects[obj_name] for obj_name in self.selection_objects])
-            for obj in selection:
-                self.backup_object_positions[obj.name] = obj.matrix_world.copy()
-        else:
-            self.backup_curve_points = {}
-            self.bmeshs = {}
-            for object_name in self.snapdata_source.selected_ids:
-                obj = bpy.data.objects[object_name]
-                if obj.type == "MESH":
-                    self.bmeshs[object_name] = bmesh.new()
-                    self.bmeshs[object_name].from_mesh(obj.data)
-
-                elif obj.type == "CURVE":
-                    self.backup_curve_points[object_name] = quicksnap_utils.flatten([[
-                        (spline_index, index, point.co.copy(), 1, point.handle_left.copy(), point.handle_right.copy())
-                        for index, point in enumerate(spline.bezier_points) if point.select_control_point]
-                        for spline_index, spline in enumerate(obj.data.splines)])
-
-                    self.backup_curve_points[object_name].extend(quicksnap_utils.flatten([[(
-                        spline_index, index, point.co.copy(), 0, 0, 0)
-                        for index, point in enumerate(spline.points) if point.select]
-                        for spline_index, spline in enumerate(obj.data.splines)]))
-
-    def store_object_display(self, object_name):
-        if object_name not in self.target_object_display_backup:
-            self.target_object_display_backup[object_name] = (bpy.data.objects[object_name].show_wire,
-                                                              bpy.data.objects[object_name].show_name,
-                                                              bpy.data.objects[object_name].show_bounds,
-                                                              bpy.data.objects[object_name].display_bounds_type)
-
-    def revert_object_display(self, object_name):
-        if object_name in self.target_object_display_backup:
-            (bpy.data.objects[object_name].show_wire,
-             bpy.data.objects[object_name].show_name,
-             bpy.data.objects[object_name].show_bounds,
-             bpy.data.objects[object_name].display_bounds_type) = self.target_object_display_backup[object_name]
-
-    def set_object_display(self, target_object="", hover_object="", is_root=False, mesh_vertid=-1, force=True):
-        """
-        Defines the target object.
-        Enables wireframe/bounds/display name on the target object and disable all that on the previous target object
-        """
-        if self.target_object != "":
-            self.revert_object_display(self.target_object)
-        if self.hover_object != "":
-            self.revert_object_display(self.hover_object)
-
-        if target_object != "":
-            self.store_object_display(target_object)
-            if self.settings.display_target_wireframe:
-                bpy.data.objects[target_object].show_wire = True
-            if is_root:
-                bpy.data.objects[target_object].show_name = True
-
-        self.target_object = target_object
-        self.target_object_is_root = is_root
-
-        if hover_object != "" and hover_object != target_object:
-            self.store_object_display(hover_object)
-            if self.settings.display_target_wireframe:
-                bpy.data.objects[hover_object].show_wire = True
-
-        self.hover_object = hover_object
-        self.closest_vertexid = mesh_vertid
-
-    def revert_data(self, context, apply=False):
-        """
-        Revert the backed up data (verts/curve points positions if in EDIT mode, objects locations if in OBJECT mode)
-        """
-        if self.object_mode:
-            for object_name in self.backup_object_positions:
-                bpy.data.objects[object_name].matrix_world = self.backup_object_positions[object_name].copy()
-        else:
-            # If the operation is not cancelled, simply move the selection back.
-            if not apply and self.last_translation is not None:
-                bpy.ops.transform.translate(value=self.last_translation * -1,
-                                            orient_type='GLOBAL',
-                                            snap=False,
-                                            use_automerge_and_split=False)
-                return
-            # Otherwise, properly revert all vertex/points data.
-            object_mode_backup = quicksnap_utils.set_object_mode_if_needed()
-            for object_name in self.bmeshs:
-                obj = bpy.data.objects[object_name]
-                self.bmeshs[object_name].to_mesh(bpy.data.objects[object_name].data)
-
-            for object_name in self.backup_curve_points:
-                obj = bpy.data.objects[object_name]
-                data = obj.data
-                for (curveindex, index, co, bezier, left, right) in self.backup_curve_points[object_name]:
-                    if bezier == 1:
-                        data.splines[curveindex].bezier_points[index].co = co
-                        data.splines[curveindex].bezier_points[index].handle_left = left
-                        data.splines[curveindex].bezier_points[index].handle_right = right
-                    else:
-                        data.splines[curveindex].points[index].co = co
-
-            quicksnap_utils.revert_mode(object_mode_backup)
-
-    def update(self, context, region):
-        """
-        Main Update Loop
-        """
-
-        # Update 3DView camera information
-        region3d = context.region_data
-        self.camera_position = region3d.view_matrix.inverted().translation
-        if region3d.view_perspective == 'CAMERA' and not region3d.is_perspective:
-            depth_location = context.space_data.camera.location
-            self.mouse_position_world = view3d_utils.region_2d_to_location_3d(region, region.data, self.mouse_position,
-                                                                              depth_location)
-        else:
-            self.mouse_position_world = view3d_utils.region_2d_to_origin_3d(region, region.data, self.mouse_position)
-        self.mouse_vector = view3d_utils.region_2d_to_vector_3d(region, region.data,
-                                                                self.mouse_position)
-
-        mouse_coord_screen_flat = Vector((self.mouse_position[0], self.mouse_position[1], 0))
-
-        depsgraph = context.evaluated_depsgraph_get()
-        hover_object = ""
-        if self.current_state == State.IDLE:
-            if self.snapdata_source.snap_type != 'ORIGINS':
-                if self.no_selection and self.object_mode:
-                    selection = []
-
-                    self.snapdata_source.add_nearby_objects(context, region, depsgraph, self.mouse_position, selection)
-                # Find object under the mouse
-                (direct_hit, _, _, self.target_face_index, direct_hit_object, _) = context.scene.ray_cast(
-                    context.evaluated_depsgraph_get(),
-                    origin=self.mouse_position_world,
-                    direction=self.mouse_vector)
-                # If found, we push this object on top of the stack of objects to process
-                if direct_hit and (direct_hit_object.name in self.selection_objects or (self.no_selection and self.object_mode)):
-                    hover_object = direct_hit_object.name
-                    self.snapdata_source.add_object_data(direct_hit_object.name,
-                                                         depsgraph=depsgraph,
-                                                         is_selected=True,
-                                                         set_first_priority=True)
-
-            # Find source vert/point the closest to the mouse, change cursor crosshair
-            closest = self.snapdata_source.find_closest(mouse_coord_screen_flat,
-                                                        search_origins_only=self.snapdata_source.snap_type == 'ORIGINS')
-            if closest is not None:
-                (self.closest_source_id, self.distance, target_name, is_root, mesh_vertid) = closest
-                self.set_object_display(target_name, hover_object, is_root)
-                if self.object_mode and self.no_selection and self.no_selection_target is None or \
-                        self.no_selection_target != target_name:
-                    self.no_selection_target = target_name
-                self.closest_actionable = True  # Points too far from the mouse are highlighted but can't be moved
-                bpy.context.window.cursor_set("SCROLL_XY")
-            else:
-                if self.object_mode and self.no_selection and self.no_selection_target is not None:
-                    self.no_selection_target = None
-                self.closest_source_id = -1
-                self.closest_vertexid = -1
-                self.set_object_display("", hover_object)
-                self.distance = -1
-                self.closest_actionable = False
-                bpy.context.window.cursor_set("CROSSHAIR")
-
-        elif self.current_state == State.SOURCE_PICKED:
-            # If we are only snapping to origins, only search through origin points.
-            if self.snapdata_target.snap_type == 'ORIGINS':
-                closest = self.snapdata_target.find_closest(mouse_coord_screen_flat, search_origins_only=True)
-                if closest is not None:
-                    (self.closest_target_id, self.distance, target_object_name, is_root, mesh_vertid) = closest
-                    self.set_object_display(target_object_name, hover_object, is_root, mesh_vertid=mesh_vertid)
-                else:
-                    self.closest_vertexid = -1
-                    self.closest_target_id = -1
-                    self.distance = -1
-                    self.set_object_display("", hover_object)
-
-            else:  # Snapping to all verts/points
-                # First hide the selection mesh not to raycast against it.
-                selected_objs = [bpy.data.objects[obj] for obj in self.selection_objects]
-                for obj in selected_objs:
-                    obj.hide_set(True)
-
-                (direct_hit, direct_hit_object_name, self.target_face_index) = \
-                    self.snapdata_target.add_nearby_objects(context, region, depsgraph, self.mouse_position,
-                                                            self.selection_objects)
-
-                if direct_hit:
-                    hover_object = direct_hit_object_name
-
-                # Revert hidden objects
-                for obj in self.selection_objects:
-                    bpy.data.objects[obj].hide_set(False)
-                for obj in self.selection_objects:  # re-select selection that might be lost in previous steps
-                    bpy.data.objects[obj].select_set(True)
-
-                # Find the closest target points
-                closest = self.snapdata_target.find_closest(mouse_coord_screen_flat)
-                if closest is not None:
-                    (self.closest_target_id, self.distance, target_object_name, is_root, mesh_vertid) = closest
-                    self.set_object_display(target_object_name, hover_object, is_root, mesh_vertid=mesh_vertid)
-                else:
-                    self.closest_vertexid = -1
-                    self.closest_target_id = -1
-                    self.distance = -1
-                    self.set_object_display("", hover_object)
-
-
-    def apply(self, context, region, use_auto_merge=False):
-        """
-        Apply operator modifications: Translate objects or vertices/points from source point to target point.
-        """
-        self.target = None
-        self.target2d = None
-        if self.current_state == State.SOURCE_PICKED:
-            self.revert_data(context)  # We first revert objects/verts/points to their original position
-
-            origin = self.snapdata_source.world_space[self.closest_source_id]
-
-            # If there is a target vert/point, use it and apply axis constraint if needed.
-            if self.closest_target_id >= 0:
-                self.target = self.snapdata_target.world_space[self.closest_target_id]
-                if len(self.snapping) == 0 or not self.snapping_local:
-                    self.target = quicksnap_utils.get_axis_target(origin, self.target, self.snapping)
-                else:
-                    self.target = quicksnap_utils.get_axis_target(origin,
-                                                                  self.snapdata_target.world_space[
-                                                                      self.closest_target_id],
-                                                                  self.snapping,
-                                                                  bpy.data.objects[self.selection_objects[0]])
-            # If there is no target, get the target on the place perpendicular to the camera,
-            # or closest to constrained axis.
-            else:
-                is_ortho = context.space_data.region_3d.view_perspective == 'ORTHO'
-                # The 3D location in this direction
-                if len(self.snapping) == 0 or not self.snapping_local:
-                    self.target = quicksnap_utils.get_target_free(origin, self.mouse_position_world, self.mouse_vector,
-                                                                  self.snapping, is_ortho=is_ortho)
-                else:
-                    self.target = quicksnap_utils.get_target_free(origin, self.mouse_position_world, self.mouse_vector,
-                                                                  self.snapping,
-                                                                  bpy.data.objects[self.selection_objects[0]],
-                                                                  is_ortho=is_ortho)
-
-            self.last_translation = (Vector(self.target) - Vector(origin))
-            tool_settings = context.tool_settings
-            use_auto_merge = use_auto_merge and not self.object_mode and tool_settings.use_mesh_automerge
-            bpy.ops.transform.translate(value=self.last_translation,
-                                        orient_type='GLOBAL',
-                                        snap=False,
-                                        use_automerge_and_split=use_auto_merge)
-
-            # Get the 2D position of the target for ui rendering
-            self.target2d = quicksnap_utils.transform_worldspace_coord2d(self.target, region,
-                                                                         context.space_data.region_3d)
-
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.icons = None
         self.icon_display_time = 0
-        self.view_distance = None
-        self.view_camera_zoom = None
-        self.no_selection = False
-        self.no_selection_target = None
-        self.mouse_position_world = None
         self.ignored_obj_names = set()
         self.clicktime = 0
         self.last_event = None
         self.clickdrag = None
-        self.ignore_modifiers = None
-        self.target_face_index = -1
         self.hotkey_type = 'V'
         self.hotkey_alt = False
         self.hotkey_ctrl = True
         self.hotkey_shift = True
         self.menu_open = False
-        self.hover_object = ""
-        self.target_bounds = None
-        self.source_highlight_data = None
-        self.source_allowed_indices = None
-        self.target_highlight_data = None
-        self.target_allowed_indices = None
-        self.source_npdata = None
-        self.target_npdata = None
-        self.backup_curve_points = None
-        self.last_translation = None
-        self.translate_ops = None
+        self.redraw_tracker = None
+        self.candidate_points = None
+        self.recorder = None
         self._timer = None
         self._handle_3d = None
         self._handle = None
-        self.mouse_position = None
-        self.bmeshs = None
-        self.backup_vertices = {}
-        self.backup_object_positions = {}
-        self.perspective_matrix_inverse = None
-        self.perspective_matrix = None
-        self.camera_position = None
-        self.mouse_vector = None
-        self.closest_target_object = ""
-        self.snapdata_target = None
-        self.snapdata_source = None
-        self.object_mode = None
-        self.target_object_display_backup = None
-        self.target_object_show_bounds_backup = False
-        self.target_object_display_bounds_type_backup = False
-        self.target_object_show_name_backup = False
-        self.target_object_show_wire_backup = False
-        self.target_object_is_root = False
-        self.target_object = ""
-        self.camera_moved = False
-        self.target2d = None
-        self.target = None
-        self.distance = 0
-        self.closest_actionable = False
-        self.closest_target_id = -1
-        self.closest_source_id = -1
-        self.closest_vertexid = -1
-        self.current_state = State.IDLE
-        self.selection_objects = None
         self.settings = get_addon_settings()
-        self.snapping_local = False
-        self.snapping = ""
 
     def __del__(self):
         pass
 
-    def refresh_vertex_data(self, context, region):
-        """
-        Re-Init the snapdata if the view camera moved. (Updates 2d positions of all points)
-        """
-        region3d = context.space_data.region_3d
-        if self.camera_position == region3d.view_matrix.inverted().translation \
-                and self.perspective_matrix == region3d.perspective_matrix \
-                and self.view_distance == region3d.view_distance \
-                and self.view_camera_zoom == region3d.view_camera_zoom:
-            return
-        logger.info("refresh data")
-        self.camera_position = region3d.view_matrix.inverted().translation
-        self.view_distance = region3d.view_distance
-        self.view_camera_zoom = region3d.view_camera_zoom
-        self.perspective_matrix = context.space_data.region_3d.perspective_matrix
-        self.perspective_matrix_inverse = self.perspective_matrix.inverted()
-        self.init_snap_data(context, region, self.current_state == State.IDLE, True)
-
     def modal(self, context, event):
 
         # Get 'WINDOW' region of the current context, useful when the context region is a child UI region of the window
@@ -466,17 +137,14 @@ class QuickVertexSnapOperator(bpy.types.Operator):
             if area_region.type == 'WINDOW':
                 region = area_region
 
+        if self.recorder is not None:
+            self.recorder.record_event(event, context.space_data.region_3d)
         if event.type not in {'MIDDLEMOUSE', 'WHEELUPMOUSE', 'WHEELDOWNMOUSE',
                                                                    'TIMER'}:
             self.refresh_vertex_data(context, region)
-        snapdata_updated = False
-        if self.current_state == State.IDLE:
-            snapdata_updated = snapdata_updated or self.snapdata_source.process_iteration(context)
-            if not self.snapdata_source.keep_processing:  # if all source are processed, start processing target points
-                snapdata_updated = snapdata_updated or self.snapdata_target.process_iteration(context)
-        else:
-            snapdata_updated = snapdata_updated or self.snapdata_target.process_iteration(context)
-        context.area.tag_redraw()
+        if event.type == 'TIMER':
+            self.frame_budget.tick()
+        snapdata_updated = self.process_snapdata(context)
 
         self.handle_hotkeys(context, event, region)
 
@@ -485,6 +153,9 @@ class QuickVertexSnapOperator(bpy.types.Operator):
             return {'CANCELLED'}
 
         elif event.type == 'LEFTMOUSE' and not self.menu_open:  # Confirm
+            if self.mouse_coalescer.has_pending:  # Make sure the latest mouse position is used.
+                if self.process_mouse_move(context, region, force=True):
+                    self.update_header(context)
             if event.value == 'PRESS':
                 self.clicktime = time.time()
             elif self.last_event == event.type or time.time()-self.clicktime <= 0.10:
@@ -492,57 +163,37 @@ class QuickVertexSnapOperator(bpy.types.Operator):
                 self.clickdrag = False
 
             if self.current_state == State.IDLE and self.closest_source_id >= 0 and self.closest_actionable:
-                if self.no_selection:
-                    obj_name = self.snapdata_source.get_object_name_at_index(self.closest_source_id)
-                    if self.object_mode:
-                        self.snapdata_source.keep_processing = False
-                        if obj_name is not None:
-                            self.selection_objects.append(obj_name)
-                            bpy.data.objects[obj_name].select_set(True)
-                            context.view_layer.objects.active = bpy.data.objects[obj_name]
-                            self.revert_object_display(obj_name)
-                        else:
-                            print("Error: Could not find target object.")
-                            self.terminate(context)
-                            return {'FINISHED'}
-                    else:
-                        obj = bpy.data.objects[obj_name]
-                        if self.closest_source_id in self.snapdata_source.origins_map and \
-                                self.snapdata_source.origins_map[self.closest_source_id] == obj_name:
-                            bpy.ops.object.mode_set(mode='OBJECT')
-                            self.selection_objects.append(obj_name)
-                            if obj_name in self.snapdata_target.to_process_scene:
-                                self.snapdata_target.to_process_scene.remove(obj_name)
-                            self.revert_object_display(obj_name)
-                        else:
-                            self.snapdata_source.select_points(obj, self.closest_source_id)
-
-                    self.backup_data(context)
-                    self.snapdata_target.is_enabled = False
-                    self.snapdata_target.__init__(context, region, self.settings, self.selection_objects,
-                                                  quicksnap_utils.get_scene_objects(True))
-                self.current_state = State.SOURCE_PICKED
+                if not self.pick_source(context, region):
+                    self.terminate(context)
+                    return {'FINISHED'}
                 self.icon_display_time = time.time()
-                self.set_object_display("", "")
                 self.update_header(context)
             elif event.value == 'PRESS' or self.clickdrag:  # Disable the tool on mouse release if click dragging.
                 # Last translation for applying auto-merge
-                self.apply(context, region, use_auto_merge=self.settings.use_auto_merge)
+                self.apply(context, region, use_auto_merge=self.settings.use_auto_merge, preview=False)
                 self.terminate(context)
                 return {'FINISHED'}
 
-        elif event.type == 'MOUSEMOVE' or snapdata_updated:  # Apply
+        elif event.type == 'MOUSEMOVE' or snapdata_updated or self.mouse_coalescer.has_pending:  # Apply
             if self.menu_open:
                 self.handle_pie_menu_closed(context, event, region)
                 self.menu_open = False
-            self.update_mouse_position(context, event)
-            self.update(context, region)
-            self.apply(context, region)
-            self.update_header(context)
+            if event.type == 'MOUSEMOVE':
+                self.mouse_coalescer.push((event.mouse_region_x, event.mouse_region_y))
+            if self.process_mouse_move(context, region, force=snapdata_updated):
+                self.update_header(context)
 
         if event.type != 'TIMER':
             self.last_event = event.type
 
+        self.update_timer(context)
+        self.trim_object_caches()
+        if self.recorder is not None:
+            self.recorder.record_state(self.current_state.value)
+        if self.redraw_tracker.need_redraw(self.get_overlay_state(),
+                                           force=event.type not in {'TIMER', 'MOUSEMOVE', 'INBETWEEN_MOUSEMOVE'}):
+            context.area.tag_redraw()
+
         # Allow navigation
         if event.type in {'MIDDLEMOUSE', 'WHEELUPMOUSE', 'WHEELDOWNMOUSE'}:
             self.update_mouse_position(context, event)
@@ -550,6 +201,45 @@ class QuickVertexSnapOperator(bpy.types.Operator):
 
         return {'RUNNING_MODAL'}
 
+    def update_timer(self, context):
+        """
+        The modal timer is only needed while there are points to process, pending mouse moves, or a fading icon.
+        Remove it when there is nothing left to do, add it back when needed.
+        """
+        icon_fading = self.settings.snap_target_type_icon == 'FADE' and \
+                      time.time() < self.icon_display_time + quicksnap_render.icon_display_duration
+        needs_timer = self.snapdata_source.keep_processing or self.snapdata_target.keep_processing or \
+                      self.mouse_coalescer.has_pending or icon_fading
+        if needs_timer and self._timer is None:
+            self._timer = context.window_manager.event_timer_add(0.005, window=context.window)
+        elif not needs_timer and self._timer is not None:
+            logger.debug("All points processed, removing modal timer")
+            context.window_manager.event_timer_remove(self._timer)
+            self._timer = None
+            self.frame_budget.reset_tick()
+
+    def get_overlay_state(self):
+        """
+        Returns everything the draw callbacks display that can change while the modal is running: state, closest
+        points, hovered object/face, constraint, mouse position, icon fade and the points being ingested.
+        """
+        icon_state = None
+        if self.settings.snap_target_type_icon == 'FADE':
+            remaining_time = self.icon_display_time + quicksnap_render.icon_display_duration - time.time()
+            icon_state = max(0, min(int(remaining_time / quicksnap_render.fade_duration * 20), 21))
+        # Only the mask of the hovered object is drawn (potential target points).
+        snapdata_state = (self.snapdata_source.get_allowed_mask_version(self.hover_object),
+                          self.snapdata_target.get_allowed_mask_version(self.hover_object))
+        if self.settings.display_all_candidates or self.settings.display_performance_hud:
+            snapdata_state += (self.snapdata_source.added_points_np, self.snapdata_target.added_points_np,
+                               self.snapdata_source.points_version, self.snapdata_target.points_version)
+        if self.settings.display_performance_hud:
+            snapdata_state += (len(self.snapdata_source.to_process_scene), len(self.snapdata_target.to_process_scene),
+                               round(self.frame_budget.budget, 4))
+        return (self.current_state, self.closest_source_id, self.closest_target_id, self.target_object,
+                self.hover_object, self.target_face_index, self.snapping, self.snapping_local,
+                self.mouse_position, icon_state, snapdata_state)
+
     def handle_hotkeys(self, context, event, region):
         """
         Toggle axis constraint and origin snapping.
@@ -563,101 +253,9 @@ class QuickVertexSnapOperator(bpy.types.Operator):
             self.menu_open = True
             logger.info(f"Pie menu called.")
             bpy.ops.wm.call_menu_pie(name="VIEW3D_MT_PIE_quicksnap")
-        elif event_type == 'ONE' or event_type == 'NUMPAD_1':
-            self.icon_display_time = time.time()
-            if self.current_state == State.IDLE:
-                if self.settings.snap_source_type != 'POINTS':
-                    self.settings.snap_source_type = 'POINTS'
-                    self.handle_pie_menu_closed(context, event, region)
-            elif self.current_state == State.SOURCE_PICKED:
-                if self.settings.snap_target_type != 'POINTS':
-                    self.settings.snap_target_type = 'POINTS'
-                    self.handle_pie_menu_closed(context, event, region)
-        elif event_type == 'TWO' or event_type == 'NUMPAD_2':
-            self.icon_display_time = time.time()
-            if self.current_state == State.IDLE:
-                if self.settings.snap_source_type != 'MIDPOINTS':
-                    self.settings.snap_source_type = 'MIDPOINTS'
-                    self.handle_pie_menu_closed(context, event, region)
-            elif self.current_state == State.SOURCE_PICKED:
-                if self.settings.snap_target_type != 'MIDPOINTS':
-                    self.settings.snap_target_type = 'MIDPOINTS'
-                    self.handle_pie_menu_closed(context, event, region)
-        elif event_type == 'THREE' or event_type == 'NUMPAD_3':
-            self.icon_display_time = time.time()
-            if self.current_state == State.IDLE:
-                if self.settings.snap_source_type != 'FACES':
-                    self.settings.snap_source_type = 'FACES'
-                    self.handle_pie_menu_closed(context, event, region)
-            elif self.current_state == State.SOURCE_PICKED:
-                if self.settings.snap_target_type != 'FACES':
-                    self.settings.snap_target_type = 'FACES'
-                    self.handle_pie_menu_closed(context, event, region)
-        elif event_type == 'O':
-            self.icon_display_time = time.time()
-            if self.current_state == State.IDLE:
-                if self.settings.snap_source_type != 'ORIGINS':
-                    self.settings.snap_source_type = 'ORIGINS'
-                    self.handle_pie_menu_closed(context, event, region)
-            elif self.current_state == State.SOURCE_PICKED:
-                if self.settings.snap_target_type != 'ORIGINS':
-                    self.settings.snap_target_type = 'ORIGINS'
-                    self.handle_pie_menu_closed(context, event, region)
-
-        elif event_type == 'X':
-            if event.shift:
-                new_snapping = 'YZ'
-            else:
-                new_snapping = 'X'
-            if self.snapping == new_snapping:
-                if not self.snapping_local and len(self.selection_objects) == 1:
-                    self.snapping_local = not self.snapping_local
-                else:
-                    self.snapping_local = False
-                    self.snapping = ""
-            else:
-                self.snapping = new_snapping
-            self.update(context, region)
-            self.apply(context, region)
-        elif event_type == 'Y':
-            if event.shift:
-                new_snapping = 'XZ'
-            else:
-                new_snapping = 'Y'
-            if self.snapping == new_snapping:
-                if not self.snapping_local and len(self.selection_objects) == 1:
-                    self.snapping_local = not self.snapping_local
-                else:
-                    self.snapping_local = False
-                    self.snapping = ""
-            else:
-                self.snapping = new_snapping
-            self.update(context, region)
-            self.apply(context, region)
-        elif event_type == 'Z':
-            if event.shift:
-                new_snapping = 'XY'
-            else:
-                new_snapping = 'Z'
-            if self.snapping == new_snapping:
-                if not self.snapping_local and len(self.selection_objects) == 1:
-                    self.snapping_local = not self.snapping_local
-                else:
-                    self.snapping_local = False
-                    self.snapping = ""
-            else:
-                self.snapping = new_snapping
-            self.update(context, region)
-            self.apply(context, region)
-
-        elif event_type == 'W':
-            self.settings.display_target_wireframe = not self.settings.display_target_wireframe
-            self.set_object_display(self.target_object, self.hover_object, self.target_object_is_root, force=True)
-        elif event_type == 'M':
-            self.settings.ignore_modifiers = not self.settings.ignore_modifiers
-
-            self.refresh_vertex_data(context, region)
-            self.set_object_display(self.target_object, self.hover_object, self.target_object_is_root, force=True)
+        elif self.handle_session_hotkey(context, region, event_type, event.shift):
+            if event_type in snap_type_hotkeys:
+                self.icon_display_time = time.time()
         elif event_type == 'TAB' and event.shift and event.ctrl:
             loglevel = logger.level
             if loglevel == logging.NOTSET:
@@ -705,8 +303,25 @@ class QuickVertexSnapOperator(bpy.types.Operator):
             bpy.context.window.cursor_set("CROSSHAIR")
         bpy.types.SpaceView3D.draw_handler_remove(self._handle, 'WINDOW')
         bpy.types.SpaceView3D.draw_handler_remove(self._handle_3d, 'WINDOW')
+        context.area.tag_redraw()
+        quicksnap_render.batch_cache.clear()
         self.snapdata_target.is_enabled = False
-        context.window_manager.event_timer_remove(self._timer)
+        if self._timer is not None:
+            context.window_manager.event_timer_remove(self._timer)
+            self._timer = None
+        logger.info(f"Mouse move coalescing stats: {self.mouse_coalescer.stats}")
+        logger.info(f"Frame budget stats: {self.frame_budget.stats} - budget={self.frame_budget.budget:.4f}s - "
+                    f"frame time={self.frame_budget.frame_time:.4f}s - draw time={self.frame_budget.draw_time:.4f}s")
+        logger.info(f"Redraw stats: {self.redraw_tracker.stats}")
+        memory_usage = self.get_memory_usage()
+        logger.info("Memory usage: " + " - ".join(f"{name}={quicksnap_utils.total_bytes(usage) / (1024 * 1024):.2f}MB"
+                                                  for name, usage in memory_usage.items()))
+        if self.settings.enable_profiling:
+            quicksnap_profiling.dump(bpy.path.abspath(self.settings.profiling_report_path))
+        quicksnap_profiling.enable(False)
+        if self.recorder is not None:
+            self.recorder.save()
+            self.recorder = None
 
         # Revert mode and selection
         if self.object_mode:
@@ -725,10 +340,8 @@ class QuickVertexSnapOperator(bpy.types.Operator):
             for selected_object in self.selection_objects:
                 bpy.data.objects[selected_object].select_set(True)
 
-        if self.target_npdata is not None and len(self.target_npdata) > 0:
-            for bm in self.target_npdata:
-                self.target_npdata[bm] = None
-            self.target_npdata = {}
+        for cache in self.get_object_caches().values():
+            cache.clear()
 
     def update_mouse_position(self, context, event):
         self.mouse_position = (event.mouse_region_x, event.mouse_region_y)
@@ -750,6 +363,12 @@ class QuickVertexSnapOperator(bpy.types.Operator):
                 axis_msg = "(World)"
         if self.settings.ignore_modifiers:
             ignore_modifiers_msg = " [MODIFIERS ARE IGNORED]"
+        else:
+            # Objects snapped on their base mesh: evaluated mesh not swapped in yet or above the vertex limit.
+            snapdata = self.snapdata_source if self.current_state == State.IDLE else self.snapdata_target
+            hovered_object = self.hover_object if self.hover_object != "" else self.target_object
+            if snapdata is not None and hovered_object in snapdata.base_mesh_objects:
+                ignore_modifiers_msg = f" [MODIFIERS IGNORED ON {hovered_object}]"
         if self.current_state == State.IDLE:
             context.area.header_text_set(f"QuickSnap: Pick the source vertex/point. {snapping_msg}{axis_msg} "
                                          f"{ignore_modifiers_msg}")
@@ -781,43 +400,8 @@ class QuickVertexSnapOperator(bpy.types.Operator):
         return {'RUNNING_MODAL'}
 
     def handle_pie_menu_closed(self, context, event, region):
-        if self.settings.snap_source_type != self.snapdata_source.snap_type or \
-                self.ignore_modifiers != self.settings.ignore_modifiers:
-            self.init_snap_data(context, region, True, False)
-            if self.current_state == State.IDLE:
-                self.icon_display_time = time.time()
-        if self.settings.snap_target_type != self.snapdata_target.snap_type or \
-                self.ignore_modifiers != self.settings.ignore_modifiers:
-            self.init_snap_data(context, region, False, True)
-            if self.current_state == State.SOURCE_PICKED:
-                self.icon_display_time = time.time()
-        self.ignore_modifiers = self.settings.ignore_modifiers
-        self.update(context,region)
-        pass
-
-    def init_snap_data(self, context, region, revert_source, revert_target):
-        if revert_source:
-            self.snapdata_source.__init__(context, region, self.settings, self.selection_objects,
-                                          quicksnap_utils.get_scene_objects(False), is_origin=True,
-                                          no_selection=self.no_selection)
-
-            self.closest_actionable = False
-            self.closest_source_id = -1
-
-            self.source_highlight_data = {}
-            self.source_allowed_indices = {}
-            self.source_npdata = {}
-        if revert_target:
-            self.snapdata_target.is_enabled = False
-            self.snapdata_target.__init__(context, region, self.settings, self.selection_objects,
-                                          quicksnap_utils.get_scene_objects(True))
-        self.target_highlight_data = {}
-        self.target_allowed_indices = {}
-        self.target_bounds = {}
-        self.target_npdata = {}
-        self.target_face_index = -1
-        self.closest_target_id = -1
-        self.closest_vertexid = -1
+        if self.update_snap_types(context, region):
+            self.icon_display_time = time.time()
 
     def detect_hotkey(self):
         logger.info(
@@ -883,6 +467,36 @@ class QuickVertexSnapPreference(bpy.types.AddonPreferences):
     display_potential_target_points: bpy.props.BoolProperty(name="Display near edge midpoints/face centers*"
                                                             , default=True)
     ignore_modifiers: bpy.props.BoolProperty(name="Ignore modifiers (For heavy scenes)", default=False)
+    progressive_modifiers: bpy.props.BoolProperty(
+        name="Progressive modifiers evaluation",
+        description="Snap to the mesh without modifiers first, the points of the evaluated mesh are swapped in "
+                    "once they are ready. Keeps the tool responsive on objects with heavy modifier stacks",
+        default=False)
+    evaluated_vertex_limit: bpy.props.IntProperty(
+        name="Evaluated vertex limit",
+        description="Objects with more vertices than this once evaluated are snapped without their modifiers. "
+                    "0 to disable the limit",
+        default=0, min=0)
+    display_all_candidates: bpy.props.BoolProperty(
+        name="Display all snap candidates",
+        description="Draw every point QuickSnap can currently snap to",
+        default=False)
+    display_performance_hud: bpy.props.BoolProperty(
+        name="Display performance HUD",
+        description="Display the points ingestion progress, closest point search/apply durations and frame budget "
+                    "in the viewport",
+        default=False)
+    cache_memory_limit: bpy.props.IntProperty(
+        name="Draw caches memory limit (MB)",
+        description="Maximum memory used by the per object data cached for the highlights. The least recently "
+                    "hovered objects are evicted first",
+        default=256, min=16, max=16384)
+    use_direct_preview: bpy.props.BoolProperty(
+        name="Fast live preview",
+        description="Move objects directly and draw a preview of the edited vertices while dragging, the edited "
+                    "vertices are only moved when the snap is confirmed. Drag latency no longer depends on the "
+                    "selection size.",
+        default=False)
 
     snap_source_type: bpy.props.EnumProperty(
         name="Snap From",
@@ -951,17 +565,38 @@ class QuickVertexSnapPreference(bpy.types.AddonPreferences):
         name='Log Level',
         default=0
     )
+    enable_profiling: bpy.props.BoolProperty(
+        name="Profiling",
+        description="Measure the duration of the processing phases and print the stats in the console when the tool "
+                    "ends",
+        default=False)
+    profiling_report_path: bpy.props.StringProperty(
+        name="Profiling report",
+        description="Optional JSON file the profiling stats are written to",
+        subtype='FILE_PATH',
+        default="")
+    record_session_path: bpy.props.StringProperty(
+        name="Record sessions to",
+        description="If set, the events and views of each QuickSnap session are recorded to this file "
+                    "(gzip JSON lines), to be replayed with benchmarks/replay_session.py",
+        subtype='FILE_PATH',
+        default="")
 
     def draw(self, context=None):
         layout = self.layout
         col = layout.column(align=True)
         col.use_property_split = True
         col.prop(self, "ignore_modifiers")
+        if not self.ignore_modifiers:
+            col.prop(self, "progressive_modifiers")
+            col.prop(self, "evaluated_vertex_limit")
+        col.prop(self, "use_direct_preview")
         col.prop(self, "use_auto_merge")
         col.prop(self, "snap_objects_origin")
         col.prop(self, "draw_rubberband")
         col.prop(self, "display_target_wireframe")
         col.prop(self, "display_potential_target_points")
+        col.prop(self, "display_all_candidates")
         col.prop(self, "selection_square_size")
         col.separator()
         col.prop(self, "snap_target_type_icon")
@@ -976,6 +611,13 @@ class QuickVertexSnapPreference(bpy.types.AddonPreferences):
             container.prop(self, "edge_highlight_color_target")
 
         col.label(text="*Can noticeably impact performances")
+        col.separator()
+        col.prop(self, "enable_profiling")
+        col.prop(self, "display_performance_hud")
+        col.prop(self, "cache_memory_limit")
+        if self.enable_profiling:
+            col.prop(self, "profiling_report_path")
+        col.prop(self, "record_session_path")
         box_content = layout.box()
         header = box_content.row(align=True)
         header.label(text="Keymap", icon='EVENT_A')
@@ -0,0 +1,349 @@
+"""
+Snapping engine working on plain NumPy arrays (no bpy/mathutils dependency): projection of object points in the
+viewport, ingestion of the projected points in batches, screen space index and closest point queries.
+quicksnap_snapdata is the Blender adapter: it gathers the object points from the Blender data and drives a SnapEngine
+indexed with mathutils kdtrees. Outside of Blender, the engine uses ScreenIndex and can be tested and benchmarked with
+plain Python (see tests/test_engine.py).
+"""
+import itertools
+
+import numpy as np
+
+from . import quicksnap_profiling
+
+# Depth is scaled down in the indexed coordinates, so that it does not affect the screen space distance.
+depth_scale = 0.00000001
+
+# Source of SnapEngine.points_version: values are unique across engines and rebuilds.
+points_version_counter = itertools.count(1)
+
+
+class Viewport:
+    """
+    Description of the 3D view region the points are projected in.
+    perspective_matrix: 4x4 view projection matrix (RegionView3D.perspective_matrix)
+    """
+
+    def __init__(self, perspective_matrix, width, height):
+        self.perspective_matrix = np.asarray(perspective_matrix, dtype=np.float64)
+        self.width = width
+        self.height = height
+        self.width_half = width / 2.0
+        self.height_half = height / 2.0
+
+
+def project_points(points_object_space, matrix_world, viewport):
+    """
+    Project object space points in the viewport.
+    Returns (world_space_co (N, 3), screen_space_co (N, 3): region x, y and view depth, visible mask) with only the
+    points in front of the camera and inside the region.
+    """
+    points_object_space = np.asarray(points_object_space, dtype=np.float64).reshape(-1, 3)
+    matrix_world = np.asarray(matrix_world, dtype=np.float64)
+    world_space_co = points_object_space @ matrix_world[:3, :3].T + matrix_world[:3, 3]
+    perspective_matrix = viewport.perspective_matrix
+    view_space_co = world_space_co @ perspective_matrix[:, :3].T + perspective_matrix[:, 3]
+
+    visible = view_space_co[:, 3] > 0  # Filtering behind camera
+    view_space_co = view_space_co[visible]
+    screen_space_co = np.column_stack(
+        (viewport.width_half + (view_space_co[:, 0] / view_space_co[:, 3]) * viewport.width_half,
+         viewport.height_half + (view_space_co[:, 1] / view_space_co[:, 3]) * viewport.height_half,
+         view_space_co[:, 3]))
+    inside_viewport = (screen_space_co[:, 0] > 0) & (screen_space_co[:, 1] > 0) & (
+            screen_space_co[:, 0] < viewport.width) & (screen_space_co[:, 1] < viewport.height)
+    visible[visible] = inside_viewport
+    return world_space_co[visible], screen_space_co[inside_viewport], visible
+
+
+def best_candidate(distances, depths, search_distance, weight_depth=3, weight_dist=1):
+    """
+    Returns the index of the best candidate amongst points found around the mouse: close to the mouse and to the
+    camera, the depth being more important than the distance to the mouse.
+    """
+    dist = np.asarray(distances, dtype=np.float64) / search_distance
+    depth = np.asarray(depths, dtype=np.float64)
+    depth = depth / np.amax(depth)  # Normalized depth
+    score = (depth * weight_depth + dist * weight_dist + dist * depth) / (weight_depth + weight_dist)
+    return int(np.argmin(score))
+
+
+class ScreenIndex:
+    """
+    NumPy point index with the interface of mathutils.kdtree.KDTree used by SnapEngine: KDTree(size), insert(co,
+    index), balance(), find_range(co, radius), find_n(co, n). Only the points inserted before the last balance() are
+    found. Points are sorted on x when balanced, find_range only measures the points of the [x - radius, x + radius]
+    slice.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.inserted_co = []
+        self.inserted_index = []
+        self.co = np.empty((0, 3), dtype=np.float64)
+        self.index = np.empty(0, dtype=np.int64)
+
+    def insert(self, co, index):
+        if len(self.inserted_index) >= self.size:
+            raise ValueError("Size exceeded")
+        self.inserted_co.append(tuple(co))
+        self.inserted_index.append(index)
+
+    def balance(self):
+        if len(self.inserted_index) == 0:
+            return
+        co = np.array(self.inserted_co, dtype=np.float64).reshape(-1, 3)
+        index = np.array(self.inserted_index, dtype=np.int64)
+        order = np.argsort(co[:, 0], kind='stable')
+        self.co = co[order]
+        self.index = index[order]
+
+    def find_range(self, co, radius):
+        """
+        Returns the (co, index, distance) of the points within radius of co, nearest first.
+        """
+        co = np.asarray(co, dtype=np.float64)
+        start = np.searchsorted(self.co[:, 0], co[0] - radius, side='left')
+        end = np.searchsorted(self.co[:, 0], co[0] + radius, side='right')
+        distances = np.linalg.norm(self.co[start:end] - co, axis=1)
+        found = np.flatnonzero(distances <= radius)
+        found = found[np.argsort(distances[found], kind='stable')]
+        return [(self.co[start + i], int(self.index[start + i]), float(distances[i])) for i in found]
+
+    def find_n(self, co, n):
+        """
+        Returns the (co, index, distance) of the n nearest points of co, nearest first.
+        """
+        distances = np.linalg.norm(self.co - np.asarray(co, dtype=np.float64), axis=1)
+        found = np.argsort(distances, kind='stable')[:n]
+        return [(self.co[i], int(self.index[i]), float(distances[i])) for i in found]
+
+
+class ObjectPoints:
+    """
+    Projected points of one object, ingested in batches by SnapEngine.ingest.
+    """
+
+    def __init__(self, points_object_space, matrix_world, viewport, indices, object_id, spline_index=None):
+        """
+        points_object_space: (N, 3) object space coordinates
+        matrix_world: 4x4 object matrix
+        indices: (N) element index (vertex/edge/face/curve point) of each point
+        object_id: object id of the points in the engine
+        spline_index: (N) spline index of each point, for curves
+        """
+        self.completed = False
+        self.insert_ranges = []  # (start, end) ranges of the points copied into the engine arrays
+        self.world_space_co, self.screen_space_co, visible = project_points(points_object_space, matrix_world,
+                                                                            viewport)
+        self.indices = np.asarray(indices)[visible]
+        self.is_curve = spline_index is not None
+        self.spline_index = np.asarray(spline_index)[visible] if self.is_curve else None
+        self.count = len(self.screen_space_co)
+        self.object_id = object_id
+        self.processed_point_count = 0
+
+    def nbytes(self):
+        """
+        Returns the bytes held by the points arrays of the object.
+        """
+        return sum(array.nbytes for array in (getattr(self, name, None) for name in
+                                              ('world_space_co', 'screen_space_co', 'indices', 'spline_index'))
+                   if isinstance(array, np.ndarray))
+
+    def release_arrays(self):
+        """
+        Free the points arrays, once all the points were copied into the engine arrays.
+        """
+        self.world_space_co = None
+        self.screen_space_co = None
+        self.indices = None
+        self.spline_index = None
+
+
+class SnapEngine:
+    """
+    Points the mouse can snap to: growing arrays of the ingested points, their screen space index and the closest
+    point queries.
+    Object origins are also indexed in a separate index (kd_origins), used when only origins are searched.
+    """
+
+    def __init__(self, viewport, capacity, origin_capacity, kdtree_type=ScreenIndex, origins_in_kd=True):
+        """
+        capacity: initial size of the points arrays, they grow if more points are added (see reserve)
+        origin_capacity: maximum count of object origins
+        kdtree_type: index class with the interface of mathutils.kdtree.KDTree (see ScreenIndex)
+        origins_in_kd: if False, object origins are only indexed in kd_origins
+        """
+        self.viewport = viewport
+        self.kdtree_type = kdtree_type
+        self.origins_in_kd = origins_in_kd
+        self.kd = kdtree_type(capacity)
+        self.kd_inserted_count = 0
+        self.kd_origins = kdtree_type(origin_capacity)
+        self.world_space = np.empty((capacity, 3), dtype=np.float64)
+        self.region_2d = np.empty((capacity, 3), dtype=np.float64)
+        self.depth = np.empty(capacity, dtype=np.float64)
+        self.indices = np.empty(capacity, dtype=int)
+        self.spline_index = np.empty(capacity, dtype=int)
+        self.object_id = np.empty(capacity, dtype=int)
+        self.invalid = np.zeros(capacity, dtype=bool)
+        self.origins_map = {}  # point index -> object name of the object origins
+        self.points_version = next(points_version_counter)
+        self.added_points_np = 0
+
+    def reserve(self, count):
+        """
+        Grow the points arrays to fit {count} points. The kdtree has a fixed size: it is rebuilt with the points it
+        contained.
+        """
+        capacity = len(self.world_space)
+        if count <= capacity:
+            return
+        capacity = max(count, capacity * 2)
+        for name in ('world_space', 'region_2d', 'depth', 'indices', 'spline_index', 'object_id', 'invalid'):
+            array = getattr(self, name)
+            grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:self.added_points_np] = array[:self.added_points_np]
+            setattr(self, name, grown)
+        self.kd = self.kdtree_type(capacity)
+        insert = self.kd.insert
+        for i in range(self.kd_inserted_count):
+            if self.invalid[i] or (i in self.origins_map and not self.origins_in_kd):
+                continue
+            insert(self.region_2d[i], i)
+        self.kd.balance()
+
+    def add_point(self, world_co, object_id, add_to_kd=True):
+        """
+        Add a single world space point: object origins, cursor. Use ingest for large amounts of points.
+        Returns the index of the point, -1 if it is behind the camera or out of the viewport.
+        """
+        world_space_co, screen_space_co, _ = project_points(world_co, np.identity(4), self.viewport)
+        if len(screen_space_co) == 0:
+            return -1
+        index = self.added_points_np
+        self.reserve(index + 1)
+        self.world_space[index] = world_space_co[0]
+        self.region_2d[index] = (screen_space_co[0, 0], screen_space_co[0, 1], screen_space_co[0, 2] * depth_scale)
+        self.depth[index] = screen_space_co[0, 2]
+        self.indices[index] = -1
+        self.spline_index[index] = -1
+        self.object_id[index] = object_id
+        if add_to_kd:
+            self.kd.insert(self.region_2d[index], index)
+            self.kd_inserted_count = index + 1
+        self.added_points_np += 1
+        return index
+
+    def add_origin(self, world_co, object_id, object_name):
+        """
+        Add the origin of an object, indexed in kd_origins (and in kd if origins_in_kd). The trees must then be
+        balanced (see balance_tree and balance_origins).
+        Returns the index of the point, -1 if it is not visible.
+        """
+        index = self.add_point(world_co, object_id, add_to_kd=self.origins_in_kd)
+        if index < 0:
+            return index
+        self.origins_map[index] = object_name
+        self.kd_origins.insert((self.region_2d[index][0], self.region_2d[index][1], 0), index)
+        return index
+
+    def ingest(self, object_points, batch_size=500):
+        """
+        Copy the next {batch_size} points of object_points into the points arrays. They are indexed by the next
+        balance_tree call.
+        Returns the element indices of the copied points.
+        """
+        start_index = object_points.processed_point_count
+        end_index = min(start_index + batch_size, object_points.count)
+        insert_count = end_index - start_index
+        start_insert = self.added_points_np
+        end_insert = start_insert + insert_count
+        self.reserve(end_insert)
+
+        screen_space_co = object_points.screen_space_co[start_index:end_index]
+        self.world_space[start_insert:end_insert] = object_points.world_space_co[start_index:end_index]
+        self.region_2d[start_insert:end_insert] = screen_space_co
+        self.region_2d[start_insert:end_insert, 2] = screen_space_co[:, 2] * depth_scale
+        self.depth[start_insert:end_insert] = screen_space_co[:, 2]
+        self.object_id[start_insert:end_insert] = object_points.object_id
+        indices = object_points.indices[start_index:end_index]
+        self.indices[start_insert:end_insert] = indices
+        if object_points.is_curve:
+            self.spline_index[start_insert:end_insert] = object_points.spline_index[start_index:end_index]
+        else:
+            self.spline_index[start_insert:end_insert] = -1
+
+        self.added_points_np += insert_count
+        if len(object_points.insert_ranges) > 0 and object_points.insert_ranges[-1][1] == start_insert:
+            object_points.insert_ranges[-1] = (object_points.insert_ranges[-1][0], end_insert)
+        else:
+            object_points.insert_ranges.append((start_insert, end_insert))
+        object_points.processed_point_count = end_index
+        if object_points.processed_point_count == object_points.count:
+            object_points.completed = True
+            object_points.release_arrays()
+        return indices
+
+    @quicksnap_profiling.timed('balance_tree')
+    def balance_tree(self, start_index=None, end_index=None):
+        """
+        Adds stored points from start_index to end_index into the kdtree, then balance it.
+        If they are not set, only balance the kdtree.
+        """
+        if start_index is not None and end_index is not None:
+            insert = self.kd.insert
+            for i in range(start_index, end_index):
+                insert(self.region_2d[i], i)
+            self.kd_inserted_count = max(self.kd_inserted_count, end_index)
+        self.kd.balance()
+
+    def balance_origins(self):
+        """
+        Balance the origins kdtree, once the origins are added.
+        """
+        self.kd_origins.balance()
+
+    def invalidate(self, object_points):
+        """
+        Flag the points of an object already copied into the points arrays as invalid: find_closest ignores them.
+        """
+        for start_index, end_index in object_points.insert_ranges:
+            self.invalid[start_index:end_index] = True
+        object_points.insert_ranges = []
+        self.points_version = next(points_version_counter)
+
+    @quicksnap_profiling.timed('find_closest')
+    def find_closest(self, mouse_coord_screen_flat, search_origins_only=False, search_distance=20,
+                     origin_search_distance=40):
+        """
+        Returns the best point around the mouse, None if there is none:
+         (point index, distance to the mouse, object id, is the point an object origin, element index)
+        search_distance: radius in pixels around the mouse position
+        """
+        if self.added_points_np == 0:
+            return None
+        if search_origins_only:
+            for (co, index, dist) in self.kd_origins.find_n(mouse_coord_screen_flat, 1):
+                if dist > origin_search_distance:
+                    return None
+                return index, dist, self.object_id[index], index in self.origins_map, -1
+            return None
+
+        points_found = [point for point in self.kd.find_range(mouse_coord_screen_flat, search_distance)
+                        if not self.invalid[point[1]]]
+        if len(points_found) == 0:
+            return None
+        # Depth was scaled down in the indexed coordinates for depth to not affect the closest search.
+        depth = np.array([co[2] for (co, _, _) in points_found], dtype=np.float64) / depth_scale
+        distances = np.array([dist for (_, _, dist) in points_found], dtype=np.float64)
+        _, index, dist = points_found[best_candidate(distances, depth, search_distance)]
+        return index, dist, self.object_id[index], index in self.origins_map, self.indices[index]
+
+    def memory_usage(self):
+        """
+        Returns the bytes held by the points arrays.
+        """
+        return sum(array.nbytes for array in (self.world_space, self.region_2d, self.depth, self.indices,
+                                              self.spline_index, self.object_id, self.invalid))
@@ -0,0 +1,258 @@
+﻿"""
+Geometry builders for the QuickSnap overlays.
+Only produce plain NumPy vertex/index arrays (no bpy/gpu dependency), the GPU batches are built from these arrays
+in quicksnap_render.
+"""
+import numpy as np
+
+square_indices = np.array(((0, 1), (1, 2), (2, 3), (3, 0)), dtype=np.uint32)
+
+bounds_indices = np.array((
+    (0, 1), (1, 2), (2, 3), (3, 0),
+    (4, 5), (5, 6), (6, 7), (7, 4),
+    (0, 4), (1, 5), (2, 6), (3, 7),
+), dtype=np.uint32)
+
+
+def unit_square():
+    """
+    Returns the vertices and LINES indices of a square of half size 1 centered on (0, 0).
+    Position and size are applied with the gpu matrix when drawing.
+    """
+    vertices = np.array(((-1, -1), (1, -1), (1, 1), (-1, 1)), dtype=np.float32)
+    return vertices, square_indices
+
+
+def unit_point_2d():
+    """
+    Returns a single 2D point at (0, 0).
+    """
+    return np.zeros((1, 2), dtype=np.float32)
+
+
+def unit_quad(uv_rect=(0, 0, 1, 1)):
+    """
+    Returns the TRI_FAN vertices and texture coordinates of a quad of size 1 centered on (0, 0).
+    uv_rect: (u_min, v_min, u_max, v_max) of the texture area displayed on the quad.
+    """
+    vertices = np.array(((-.5, -.5), (.5, -.5), (.5, .5), (-.5, .5)), dtype=np.float32)
+    u_min, v_min, u_max, v_max = uv_rect
+    tex_coords = np.array(((u_min, v_min), (u_max, v_min), (u_max, v_max), (u_min, v_max)), dtype=np.float32)
+    return vertices, tex_coords
+
+
+def line(source, target):
+    """
+    Returns the LINES vertices of a 2D or 3D segment.
+    """
+    return np.array((source, target), dtype=np.float32)
+
+
+def points(coords, dimensions=3):
+    """
+    Returns the POINTS vertices of a list/array of coordinates.
+    """
+    return np.asarray(coords, dtype=np.float32).reshape(-1, dimensions)
+
+
+def bounds(points_co):
+    """
+    Returns the vertices and LINES indices of a bounding box, from its 8 corners (Blender bound_box order).
+    """
+    return np.asarray(points_co, dtype=np.float32).reshape(8, 3), bounds_indices
+
+
+class OverlayBuffers:
+    """
+    Collects the overlay primitives of a frame, so that they can be drawn with one draw call per primitive type
+    (LINES, POINTS, TRIS). Every vertex has its own color.
+    """
+
+    def __init__(self):
+        self.lines_co = []
+        self.lines_color = []
+        self.points_co = []
+        self.points_color = []
+        self.tris_co = []
+        self.tris_color = []
+        self.tris_indices = []
+        self.tris_vertex_count = 0
+
+    def add_lines(self, coords, colors):
+        """
+        Add LINES vertices: coords (2 * N, 3), colors: single RGBA color or one color per vertex.
+        """
+        coords = points(coords)
+        self.lines_co.append(coords)
+        self.lines_color.append(vertex_colors(colors, len(coords)))
+
+    def add_points(self, coords, colors):
+        """
+        Add POINTS vertices: coords (N, 3), colors: single RGBA color or one color per vertex.
+        """
+        coords = points(coords)
+        self.points_co.append(coords)
+        self.points_color.append(vertex_colors(colors, len(coords)))
+
+    def add_tris(self, coords, indices, colors):
+        """
+        Add TRIS: coords (N, 3), indices (M, 3) into coords, colors: single RGBA color or one color per vertex.
+        """
+        coords = points(coords)
+        self.tris_co.append(coords)
+        self.tris_color.append(vertex_colors(colors, len(coords)))
+        self.tris_indices.append(np.asarray(indices, dtype=np.uint32).reshape(-1, 3) + self.tris_vertex_count)
+        self.tris_vertex_count += len(coords)
+
+    def get_lines(self):
+        """
+        Returns merged (coords, colors) of all the lines, None if there are none.
+        """
+        if len(self.lines_co) == 0:
+            return None
+        return np.concatenate(self.lines_co), np.concatenate(self.lines_color)
+
+    def get_points(self):
+        """
+        Returns merged (coords, colors) of all the points, None if there are none.
+        """
+        if len(self.points_co) == 0:
+            return None
+        return np.concatenate(self.points_co), np.concatenate(self.points_color)
+
+    def get_tris(self):
+        """
+        Returns merged (coords, colors, indices) of all the triangles, None if there are none.
+        """
+        if len(self.tris_co) == 0:
+            return None
+        return np.concatenate(self.tris_co), np.concatenate(self.tris_color), np.concatenate(self.tris_indices)
+
+
+def vertex_colors(colors, vertex_count):
+    """
+    Returns a (vertex_count, 4) color array from a single RGBA color or from per vertex colors.
+    """
+    colors = np.asarray(colors, dtype=np.float32)
+    if colors.ndim == 1:
+        return np.tile(colors, (vertex_count, 1))
+    return colors.reshape(vertex_count, 4)
+
+
+def gradient_lines_colors(line_count, color_start, color_end):
+    """
+    Returns per vertex colors for {line_count} lines fading from color_start to color_end.
+    """
+    return np.tile(np.array((color_start, color_end), dtype=np.float32), (line_count, 1))
+
+
+def vertex_edge_adjacency(edge_verts, vertex_count):
+    """
+    Build a CSR vertex->edge adjacency from the (E, 2) edge vertices array.
+    Returns (offsets, edge_ends): the edge ends of vertex v are edge_ends[offsets[v]:offsets[v + 1]],
+    an edge end is edge_index * 2 + side, the other vertex of the edge being edge_verts[edge_index, 1 - side].
+    """
+    flat_verts = edge_verts.ravel()
+    edge_ends = np.argsort(flat_verts, kind='stable')
+    return index_offsets(flat_verts, vertex_count), edge_ends
+
+
+def index_offsets(sorted_indices, count):
+    """
+    Returns the (count + 1) offsets of each value range in a sorted index array: the items with value i are
+    sorted_indices[offsets[i]:offsets[i + 1]].
+    """
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sorted_indices, minlength=count), out=offsets[1:])
+    return offsets
+
+
+def polygon_outline(polygon_co):
+    """
+    Returns the (N, 2, 3) outline edges of a polygon from its (N, 3) ordered vertex coordinates.
+    """
+    return np.stack((polygon_co, np.roll(polygon_co, -1, axis=0)), axis=1)
+
+
+def local_indices(polygon_verts, vertex_indices):
+    """
+    Convert mesh vertex indices to indices in the polygon vertices array.
+    """
+    sorter = np.argsort(polygon_verts)
+    return sorter[np.searchsorted(polygon_verts, vertex_indices, sorter=sorter)]
+
+
+def in_mask(mask, indices):
+    """
+    Vectorized membership test of indices in a boolean mask, indices beyond the mask length are not in it.
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    result = indices < len(mask)
+    result[result] = mask[indices[result]]
+    return result
+
+
+class PointSegments:
+    """
+    Incremental copy of a growing points array (SnapData.world_space[:added_points_np]) split in segments, so that a
+    GPU batch only has to be built for the points added since the last update.
+    To keep the draw call count low, the last segment is merged with the previous one while they have a similar size
+    (the previous one is not larger), like the digits of a binary counter: there are O(log(N)) segments and a merge
+    only copies the most recent points. Segments are not merged past max_segment_size points.
+    """
+
+    def __init__(self, max_segment_size=1 << 20):
+        self.max_segment_size = max_segment_size
+        self.version = None
+        self.count = 0
+        self.segments = []
+        self.last_key = 0
+
+    def reset(self):
+        self.version = None
+        self.count = 0
+        self.segments = []
+
+    def update(self, source, count, version, invalid=None):
+        """
+        Add the points of source[self.count:count] as a new segment.
+        version: identifies the points in source (see SnapData.points_version), the segments are reset when it
+        changes (the snapdata was rebuilt or points were invalidated) or when source has fewer points.
+        invalid: mask of the points to skip
+        Returns True if the segments changed.
+        """
+        changed = False
+        if version != self.version or count < self.count:
+            changed = len(self.segments) > 0
+            self.reset()
+            self.version = version
+        if count == self.count:
+            return changed
+        coords = source[self.count:count]
+        if invalid is not None:
+            coords = coords[~invalid[self.count:count]]
+        self.count = count
+        if len(coords) == 0:
+            return changed
+        self.segments.append(self.new_segment(points(coords)))
+        self.merge_tail()
+        return True
+
+    def merge_tail(self):
+        """
+        Merge the last segment with the previous one while the previous one is not larger.
+        """
+        while len(self.segments) > 1:
+            previous_coords = self.segments[-2][1]
+            last_coords = self.segments[-1][1]
+            if len(previous_coords) > len(last_coords) or \
+                    len(previous_coords) + len(last_coords) > self.max_segment_size:
+                return
+            self.segments[-2:] = [self.new_segment(np.concatenate((previous_coords, last_coords)))]
+
+    def new_segment(self, coords):
+        """
+        Returns a (key, coords) segment, the key is unique and can be used to cache the segment batch.
+        """
+        self.last_key += 1
+        return self.last_key, coords
@@ -0,0 +1,166 @@
+"""
+Session cache of the mesh arrays used by the snapdata and the draw callbacks (vertices, edges, polygons, loop
+triangles). Evaluated meshes (modifiers, geometry nodes) are only queried once per object and per array group, instead
+of every time an object is added to a snapdata or highlighted.
+"""
+import bpy
+import logging
+import numpy as np
+
+from . import quicksnap_geometry
+from . import quicksnap_utils
+
+__name_addon__ = '.'.join(__name__.split('.')[:-1])
+logger = logging.getLogger(__name_addon__)
+
+
+def extract_vertices(mesh):
+    return {'verts_co': quicksnap_utils.get_vertices_co(mesh)}
+
+
+def extract_edges(mesh):
+    edge_count = len(mesh.edges)
+    edge_verts = np.empty(edge_count * 2, dtype=int)
+    mesh.edges.foreach_get('vertices', edge_verts)
+    edge_verts.shape = (edge_count, 2)
+    return {'edge_verts': edge_verts}
+
+
+def extract_polygons(mesh):
+    polygon_count = len(mesh.polygons)
+    polygon_loop_start = np.empty(polygon_count, dtype=int)
+    mesh.polygons.foreach_get('loop_start', polygon_loop_start)
+    polygon_loop_total = np.empty(polygon_count, dtype=int)
+    mesh.polygons.foreach_get('loop_total', polygon_loop_total)
+    polygon_centers = np.empty(polygon_count * 3, dtype=np.float64)
+    mesh.polygons.foreach_get('center', polygon_centers)
+    polygon_centers.shape = (polygon_count, 3)
+    loop_verts = np.empty(len(mesh.loops), dtype=int)
+    mesh.loops.foreach_get('vertex_index', loop_verts)
+    loop_edges = np.empty(len(mesh.loops), dtype=int)
+    mesh.loops.foreach_get('edge_index', loop_edges)
+    return {
+        'polygon_loop_start': polygon_loop_start,
+        'polygon_loop_total': polygon_loop_total,
+        'polygon_centers': polygon_centers,
+        'loop_verts': loop_verts,
+        'loop_edges': loop_edges,
+    }
+
+
+def extract_loop_triangles(mesh):
+    """
+    Loop triangles are sorted by polygon: the triangles of polygon i are
+    loop_triangle_verts[polygon_loop_tri_offsets[i]:polygon_loop_tri_offsets[i + 1]]
+    """
+    mesh.calc_loop_triangles()
+    triangle_count = len(mesh.loop_triangles)
+    triangle_polygons = np.empty(triangle_count, dtype=int)
+    mesh.loop_triangles.foreach_get('polygon_index', triangle_polygons)
+    triangle_verts = np.empty(triangle_count * 3, dtype=int)
+    mesh.loop_triangles.foreach_get('vertices', triangle_verts)
+    triangle_verts.shape = (triangle_count, 3)
+    return {
+        'loop_triangle_verts': triangle_verts,
+        'polygon_loop_tri_offsets': quicksnap_geometry.index_offsets(triangle_polygons, len(mesh.polygons)),
+    }
+
+
+# Function extracting each array (and the other arrays of its group) from a mesh.
+array_extractors = {
+    'verts_co': extract_vertices,
+    'edge_verts': extract_edges,
+    'polygon_loop_start': extract_polygons,
+    'polygon_loop_total': extract_polygons,
+    'polygon_centers': extract_polygons,
+    'loop_verts': extract_polygons,
+    'loop_edges': extract_polygons,
+    'loop_triangle_verts': extract_loop_triangles,
+    'polygon_loop_tri_offsets': extract_loop_triangles,
+}
+
+
+def get_mesh(object_name, evaluated, depsgraph=None):
+    """
+    Returns the mesh of an object, with the modifiers applied if evaluated is True.
+    """
+    obj = bpy.data.objects[object_name]
+    if evaluated:
+        return obj.evaluated_get(depsgraph).data
+    return obj.data
+
+
+class MeshData:
+    """
+    Arrays of the mesh of one object. Element counts are read on creation, arrays are extracted by group the first
+    time one of them is requested (see array_extractors).
+    """
+
+    def __init__(self, object_name, evaluated, depsgraph=None):
+        self.object_name = object_name
+        self.evaluated = evaluated
+        mesh = get_mesh(object_name, evaluated, depsgraph)
+        self.vertex_count = len(mesh.vertices)
+        self.edge_count = len(mesh.edges)
+        self.polygon_count = len(mesh.polygons)
+        self.arrays = {}
+
+    def get(self, name, depsgraph=None):
+        """
+        Returns the array {name} (see array_extractors), extracted from the mesh if it was not requested before.
+        """
+        if name not in self.arrays:
+            self.arrays.update(array_extractors[name](get_mesh(self.object_name, self.evaluated, depsgraph)))
+        return self.arrays[name]
+
+    def get_vertex_edges(self, depsgraph=None):
+        """
+        Returns the CSR vertex->edge adjacency (offsets, edge_ends), see quicksnap_geometry.vertex_edge_adjacency.
+        """
+        if 'vert_edges' not in self.arrays:
+            self.arrays['vert_edges'] = quicksnap_geometry.vertex_edge_adjacency(self.get('edge_verts', depsgraph),
+                                                                               self.vertex_count)
+        return self.arrays['vert_edges']
+
+    def get_element_count(self, snap_type):
+        """
+        Returns the count of snap points of the mesh for a snap type: vertices, edges mid-points or face centers.
+        """
+        if snap_type == 'POINTS':
+            return self.vertex_count
+        if snap_type == 'MIDPOINTS':
+            return self.edge_count
+        if snap_type == 'FACES':
+            return self.polygon_count
+        return 0
+
+    def nbytes(self):
+        return quicksnap_utils.get_nbytes(self.arrays)
+
+
+class MeshDataCache(quicksnap_utils.ObjectCache):
+    """
+    MeshData of the objects of the session, for the meshes with and without modifiers:
+    {(object name, evaluated): MeshData}
+    """
+
+    def get_mesh_data(self, object_name, evaluated, depsgraph=None):
+        key = (object_name, evaluated)
+        if key not in self:
+            self[key] = MeshData(object_name, evaluated, depsgraph)
+        return self[key]
+
+    def touch_object(self, object_name):
+        """
+        Mark the meshes of the object as recently used.
+        """
+        for evaluated in (False, True):
+            if (object_name, evaluated) in self:
+                self.touch((object_name, evaluated))
+
+    def discard(self, object_names):
+        """
+        Forget the meshes of the objects, to be called when their mesh data was modified.
+        """
+        for key in [key for key in self if key[0] in object_names]:
+            del self[key]
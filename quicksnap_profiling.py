@@ -0,0 +1,147 @@
+"""
+Named timers measuring the duration of the QuickSnap processing phases (points extraction, kdtree balancing, closest
+point search, apply, draw callbacks).
+Timers are disabled by default: a timed function then only costs one global flag check.
+When enabled, durations are aggregated for the session and can be dumped to the console or to a JSON file.
+"""
+import functools
+import json
+import logging
+import time
+
+__name_addon__ = '.'.join(__name__.split('.')[:-1])
+logger = logging.getLogger(__name_addon__)
+
+# Histogram bucket upper bounds, in milliseconds. The last bucket contains all longer durations.
+histogram_bounds = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250)
+
+enabled = False
+timers = {}
+
+
+class TimerStats:
+    """
+    Aggregated durations of one named timer.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.last = 0
+        self.histogram = [0] * (len(histogram_bounds) + 1)
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.last = duration
+        self.min = duration if self.min is None else min(self.min, duration)
+        self.max = max(self.max, duration)
+        duration_ms = duration * 1000
+        bucket = 0
+        while bucket < len(histogram_bounds) and duration_ms > histogram_bounds[bucket]:
+            bucket += 1
+        self.histogram[bucket] += 1
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total_ms': self.total * 1000,
+            'mean_ms': self.total * 1000 / self.count if self.count > 0 else 0,
+            'min_ms': (self.min or 0) * 1000,
+            'max_ms': self.max * 1000,
+            'histogram_ms': {f"<={bound}" if index < len(histogram_bounds) else f">{histogram_bounds[-1]}": count
+                             for index, (bound, count) in
+                             enumerate(zip(histogram_bounds + (histogram_bounds[-1],), self.histogram))},
+        }
+
+
+def enable(value=True):
+    global enabled
+    enabled = value
+
+
+def reset():
+    timers.clear()
+
+
+def add_duration(name, duration):
+    """
+    Register a duration in the timer {name}.
+    """
+    if name not in timers:
+        timers[name] = TimerStats(name)
+    timers[name].add(duration)
+
+
+def timed(name):
+    """
+    Decorator measuring each call of the function in the timer {name}, when profiling is enabled.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start_time = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                add_duration(name, time.perf_counter() - start_time)
+        return wrapper
+    return decorator
+
+
+class measure:
+    """
+    Context manager measuring a block of code in the timer {name}, when profiling is enabled.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.start_time = None
+
+    def __enter__(self):
+        if enabled:
+            self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.start_time is not None:
+            add_duration(self.name, time.perf_counter() - self.start_time)
+            self.start_time = None
+
+
+def last_duration(name):
+    """
+    Returns the duration of the last measure of the timer {name}, None if it was never measured.
+    """
+    if name not in timers:
+        return None
+    return timers[name].last
+
+
+def report():
+    """
+    Returns the stats of all timers as a dictionary.
+    """
+    return {name: timer.to_dict() for name, timer in sorted(timers.items())}
+
+
+def dump(file_path=None):
+    """
+    Log the timers stats, and write them to {file_path} as JSON if set.
+    """
+    if len(timers) == 0:
+        return
+    for name, stats in report().items():
+        logger.info(f"[profiling] {name}: count={stats['count']} - total={stats['total_ms']:.2f}ms - "
+                    f"mean={stats['mean_ms']:.3f}ms - min={stats['min_ms']:.3f}ms - max={stats['max_ms']:.3f}ms")
+    if file_path:
+        try:
+            with open(file_path, 'w') as json_file:
+                json.dump(report(), json_file, indent=2)
+        except OSError as error:
+            logger.warning(f"Could not write profiling report to {file_path}: {error}")
@@ -0,0 +1,87 @@
+"""
+Recording of QuickSnap modal sessions, to replay them outside of the interactive session
+(see benchmarks/replay_session.py).
+A session file is gzip compressed JSON lines: a header dictionary, then one list per record:
+    ["V", time, view_matrix (16 floats), window_matrix (16 floats), view_perspective, is_perspective]: the 3D view
+        changed
+    ["E", time, event type, event value, mouse region x, mouse region y,
+        modifiers (shift=1, ctrl=2, alt=4, key repeat=8)]
+    ["S", time, state]: the operator state changed (State value, 2: source picked)
+Time is in seconds since the start of the recording.
+"""
+import gzip
+import json
+import logging
+import time
+
+__name_addon__ = '.'.join(__name__.split('.')[:-1])
+logger = logging.getLogger(__name_addon__)
+
+file_version = 1
+
+
+def flatten_matrix(matrix):
+    return [round(value, 6) for row in matrix for value in row]
+
+
+class SessionRecorder:
+    """
+    Records the modal events, 3D view matrices and timings of a session, written to {file_path} by save().
+    """
+
+    def __init__(self, file_path, header=None):
+        self.file_path = file_path
+        self.header = {'version': file_version}
+        if header is not None:
+            self.header.update(header)
+        self.start_time = time.perf_counter()
+        self.records = []
+        self.last_view = None
+        self.last_state = None
+
+    def record_view(self, region3d):
+        """
+        Add a view record if the view/window matrices or the projection changed since the last one.
+        """
+        view = (flatten_matrix(region3d.view_matrix), flatten_matrix(region3d.window_matrix),
+                region3d.view_perspective, region3d.is_perspective)
+        if view == self.last_view:
+            return
+        self.last_view = view
+        self.records.append(["V", round(time.perf_counter() - self.start_time, 5), *view])
+
+    def record_event(self, event, region3d=None):
+        if region3d is not None:
+            self.record_view(region3d)
+        modifiers = int(event.shift) | int(event.ctrl) << 1 | int(event.alt) << 2 | int(event.is_repeat) << 3
+        self.records.append(["E", round(time.perf_counter() - self.start_time, 5), event.type, event.value,
+                             event.mouse_region_x, event.mouse_region_y, modifiers])
+
+    def record_state(self, state_value):
+        if state_value == self.last_state:
+            return
+        self.last_state = state_value
+        self.records.append(["S", round(time.perf_counter() - self.start_time, 5), state_value])
+
+    def save(self):
+        try:
+            with gzip.open(self.file_path, 'wt') as session_file:
+                session_file.write(json.dumps(self.header) + "\n")
+                for record in self.records:
+                    session_file.write(json.dumps(record, separators=(',', ':')) + "\n")
+        except OSError as error:
+            logger.warning(f"Could not write session recording to {self.file_path}: {error}")
+            return
+        logger.info(f"Session recorded: {self.file_path} - {len(self.records)} records")
+
+
+def load_session(file_path):
+    """
+    Returns (header, records) of a session file written by SessionRecorder.
+    """
+    with gzip.open(file_path, 'rt') as session_file:
+        header = json.loads(session_file.readline())
+        records = [json.loads(line) for line in session_file if line.strip()]
+    if header.get('version') != file_version:
+        raise ValueError(f"Unsupported session file version: {header.get('version')}")
+    return header, records
@@ -1,6 +1,8 @@
 ﻿from pathlib import Path
 
+import blf
 import bpy
+import functools
 import bpy_extras
 import gpu
 import logging
@@ -10,17 +12,62 @@ import time
 from gpu_extras.batch import batch_for_shader
 from mathutils import Vector
 
+from . import quicksnap_geometry
+from . import quicksnap_profiling
 from .quicksnap_utils import State
 from .quicksnap_utils import dump
+from .quicksnap_utils import transform_points_np
 if bpy.app.version >= (3, 4, 0):
-    from .quicksnap_shader_gpu_module import shader_2d_image_color, shader_2d_uniform_color, shader_3d_uniform_color, shader_3d_smooth_color, shader_3d_polyline_smooth_color, draw_line_3d_smooth_blend_versionized, draw_polygon_smooth_blend_versionized
+    from .quicksnap_shader_gpu_module import shader_2d_image_color, shader_2d_uniform_color, shader_3d_uniform_color, shader_3d_smooth_color, shader_3d_polyline_smooth_color, draw_line_3d_smooth_blend_versionized, draw_polygon_smooth_blend_versionized, shader_3d_lines_smooth_color, bind_lines_smooth_color_versionized
 else:
-    from .quicksnap_shader_legacy import shader_2d_image_color, shader_2d_uniform_color, shader_3d_uniform_color, shader_3d_smooth_color, shader_3d_polyline_smooth_color, draw_line_3d_smooth_blend_versionized, draw_polygon_smooth_blend_versionized
+    from .quicksnap_shader_legacy import shader_2d_image_color, shader_2d_uniform_color, shader_3d_uniform_color, shader_3d_smooth_color, shader_3d_polyline_smooth_color, draw_line_3d_smooth_blend_versionized, draw_polygon_smooth_blend_versionized, shader_3d_lines_smooth_color, bind_lines_smooth_color_versionized
 
 __name_addon__ = '.'.join(__name__.split('.')[:-1])
 logger = logging.getLogger(__name_addon__)
-square_indices = ((0, 1), (1, 2), (2, 3), (3, 0))
-icons = {}
+
+
+class BatchCache:
+    """
+    Retained GPU batches. A batch is only rebuilt when the key it was built with changes, colors/positions that
+    change every frame are given with uniforms and the gpu matrix when drawing.
+    """
+
+    def __init__(self):
+        self.batches = {}
+        self.stats = {
+            'hits': 0,
+            'builds': 0,
+        }
+
+    def get(self, name, key, build):
+        """
+        Returns the batch stored under {name}, rebuilt with build() if it was built with a different key.
+        build: function returning (shader, primitive type, content, indices), with NumPy arrays from quicksnap_geometry
+        """
+        cached = self.batches.get(name)
+        if cached is not None and cached[0] == key:
+            self.stats['hits'] += 1
+            return cached[1]
+        shader, primitive_type, content, indices = build()
+        if indices is not None:
+            indices = indices.tolist()
+        batch = batch_for_shader(shader, primitive_type, content, indices=indices)
+        self.batches[name] = (key, batch)
+        self.stats['builds'] += 1
+        return batch
+
+    def discard_indexed(self, prefix, count):
+        """
+        Remove the batches named {prefix}{index} with an index >= count, when less of them are drawn.
+        """
+        for name in [name for name in self.batches if name.startswith(prefix) and int(name[len(prefix):]) >= count]:
+            del self.batches[name]
+
+    def clear(self):
+        self.batches.clear()
+
+
+batch_cache = BatchCache()
 
 
 def draw_square_2d(position_x, position_y, size, color=(1, 1, 0, 1), line_width=1, point_width=4):
@@ -32,24 +79,26 @@ def draw_square_2d(position_x, position_y, size, color=(1, 1, 0, 1), line_width=
     if line_width != 1:
         gpu.state.line_width_set(line_width)
     gpu.state.blend_set("ALPHA")
-    if line_width > 0:
-        vertices = (
-            (position_x - size, position_y - size),
-            (position_x + size, position_y - size),
-            (position_x + size, position_y + size),
-            (position_x - size, position_y + size))
-
-        batch = batch_for_shader(shader_2d_uniform_color, 'LINES', {"pos": vertices}, indices=square_indices)
-        shader_2d_uniform_color.bind()
-        shader_2d_uniform_color.uniform_float("color", color)
-        batch.draw(shader_2d_uniform_color)
-    if point_width > 0:
-        gpu.state.point_size_set(point_width)
-        batch = batch_for_shader(shader_2d_uniform_color, 'POINTS', {"pos": [(position_x, position_y)]})
-        shader_2d_uniform_color.bind()
-        shader_2d_uniform_color.uniform_float("color", color)
-        batch.draw(shader_2d_uniform_color)
-        gpu.state.point_size_set(5)
+    with gpu.matrix.push_pop():
+        gpu.matrix.translate((position_x, position_y))
+        if line_width > 0:
+            vertices, indices = quicksnap_geometry.unit_square()
+            batch = batch_cache.get('square_2d', None,
+                                    lambda: (shader_2d_uniform_color, 'LINES', {"pos": vertices}, indices))
+            with gpu.matrix.push_pop():
+                gpu.matrix.scale((size, size))
+                shader_2d_uniform_color.bind()
+                shader_2d_uniform_color.uniform_float("color", color)
+                batch.draw(shader_2d_uniform_color)
+        if point_width > 0:
+            gpu.state.point_size_set(point_width)
+            batch = batch_cache.get('point_2d', None,
+                                    lambda: (shader_2d_uniform_color, 'POINTS',
+                                             {"pos": quicksnap_geometry.unit_point_2d()}, None))
+            shader_2d_uniform_color.bind()
+            shader_2d_uniform_color.uniform_float("color", color)
+            batch.draw(shader_2d_uniform_color)
+            gpu.state.point_size_set(5)
 
     if line_width != 1:
         gpu.state.line_width_set(1)
@@ -61,38 +110,28 @@ def draw_image(self, position_x=100, position_y=100, size=20, image='MISSING', c
     """
         Draw an icon in the viewport.
     """
-    halfsize = size * .5
-    vertices = (
-        (position_x - halfsize, position_y - halfsize),
-        (position_x + halfsize, position_y - halfsize),
-        (position_x + halfsize, position_y + halfsize),
-        (position_x - halfsize, position_y + halfsize))
+    if image not in icon_atlas.uv_rects:
+        image = 'MISSING'
+        if image not in icon_atlas.uv_rects:
+            return
     previous_blend_state = gpu.state.blend_get()
     gpu.state.blend_set("ALPHA")
-    if image not in icons:
-        texture_name = f'QUICKSNAP_{image}.tif'
-        texture_path = get_icons_dir() / texture_name
-        if not texture_path.exists():
-            texture_path = get_icons_dir() / f'QUICKSNAP_MISSING.tif'
-            if not texture_path.exists():
-                return
-        if texture_name in bpy.data.images:
-            bpy.data.images.remove(bpy.data.images[f'QUICKSNAP_{image}.tif'])
-        img = bpy.data.images.load(str(texture_path), check_existing=True)
-        icons[image] = gpu.texture.from_image(img)
-    batch = batch_for_shader(
-        shader_2d_image_color, 'TRI_FAN',
-        {
-            "pos": vertices,
-            "texCoord": ((0, 0), (1, 0), (1, 1), (0, 1)),
-        },
-    )
-    shader_2d_image_color.bind()
-    shader_2d_image_color.uniform_float("Color", color)
-    shader_2d_image_color.uniform_float("Color_bg", color_bg)
-    shader_2d_image_color.uniform_float("Fade", fade)
-    shader_2d_image_color.uniform_sampler("Image", icons[image])
-    batch.draw(shader_2d_image_color)
+    uv_rect = icon_atlas.uv_rects[image]
+
+    def build_icon_quad():
+        vertices, tex_coords = quicksnap_geometry.unit_quad(uv_rect)
+        return shader_2d_image_color, 'TRI_FAN', {"pos": vertices, "texCoord": tex_coords}, None
+
+    batch = batch_cache.get('icon', uv_rect, build_icon_quad)
+    with gpu.matrix.push_pop():
+        gpu.matrix.translate((position_x, position_y))
+        gpu.matrix.scale((size, size))
+        shader_2d_image_color.bind()
+        shader_2d_image_color.uniform_float("Color", color)
+        shader_2d_image_color.uniform_float("Color_bg", color_bg)
+        shader_2d_image_color.uniform_float("Fade", fade)
+        shader_2d_image_color.uniform_sampler("Image", icon_atlas.texture)
+        batch.draw(shader_2d_image_color)
 
     gpu.state.blend_set(previous_blend_state)
 
@@ -104,11 +143,11 @@ def draw_line_2d(source_x, source_y, target_x, target_y, color=(1, 1, 0, 1), lin
     if line_width != 1:
         gpu.state.line_width_set(line_width)
     gpu.state.blend_set("ALPHA")
-    vertices = (
-        (source_x, source_y),
-        (target_x, target_y))
-
-    batch = batch_for_shader(shader_2d_uniform_color, 'LINES', {"pos": vertices})
+    key = (source_x, source_y, target_x, target_y)
+    batch = batch_cache.get('line_2d', key,
+                            lambda: (shader_2d_uniform_color, 'LINES',
+                                     {"pos": quicksnap_geometry.line((source_x, source_y), (target_x, target_y))},
+                                     None))
     shader_2d_uniform_color.bind()
     shader_2d_uniform_color.uniform_float("color", color)
     batch.draw(shader_2d_uniform_color)
@@ -118,9 +157,10 @@ def draw_line_2d(source_x, source_y, target_x, target_y, color=(1, 1, 0, 1), lin
     gpu.state.blend_set("NONE")
 
 
-def draw_line_3d(source, target, color=(1, 1, 0, 1), line_width=1, depth_test=False):
+def draw_line_3d(source, target, color=(1, 1, 0, 1), line_width=1, depth_test=False, name='line_3d'):
     """
         Draw a 3d line in the viewport.
+        name: batch cache name, lines drawn every frame should use different names.
     """
     if line_width != 1:
         gpu.state.line_width_set(line_width)
@@ -128,11 +168,9 @@ def draw_line_3d(source, target, color=(1, 1, 0, 1), line_width=1, depth_test=Fa
 
     if depth_test:
         gpu.state.depth_test_set("LESS")
-    vertices = (
-        (source[0], source[1], source[2]),
-        (target[0], target[1], target[2]))
-
-    batch = batch_for_shader(shader_3d_uniform_color, 'LINES', {"pos": vertices})
+    vertices = quicksnap_geometry.line(source[:3], target[:3])
+    batch = batch_cache.get(name, vertices.tobytes(),
+                            lambda: (shader_3d_uniform_color, 'LINES', {"pos": vertices}, None))
     shader_3d_uniform_color.bind()
     shader_3d_uniform_color.uniform_float("color", color)
     batch.draw(shader_3d_uniform_color)
@@ -157,16 +195,19 @@ def draw_polygon_smooth_blend(points, indices, color, depth_test):
     draw_polygon_smooth_blend_versionized(points, indices, color, depth_test)
 
 
-def draw_points_3d(coords, color=(1, 1, 0, 1), point_width=3, depth_test=False):
+def draw_points_3d(coords, color=(1, 1, 0, 1), point_width=3, depth_test=False, name='points_3d'):
     """
         Draw a list of points in the viewport.
+        name: batch cache name, point lists drawn every frame should use different names.
     """
     gpu.state.blend_set("ALPHA")
     if depth_test:
         gpu.state.depth_test_set("LESS")
 
     gpu.state.point_size_set(point_width)
-    batch = batch_for_shader(shader_3d_uniform_color, 'POINTS', {"pos": coords})
+    vertices = quicksnap_geometry.points(coords)
+    batch = batch_cache.get(name, vertices.tobytes(),
+                            lambda: (shader_3d_uniform_color, 'POINTS', {"pos": vertices}, None))
     shader_3d_uniform_color.bind()
     shader_3d_uniform_color.uniform_float("color", color)
     batch.draw(shader_3d_uniform_color)
@@ -187,7 +228,112 @@ icon_display_duration = 2
 fade_duration = 0.2
 
 
+def draw_overlay_buffers(buffers, line_width=1):
+    """
+        Draw the collected overlay primitives, with one draw call per primitive type.
+    """
+    gpu.state.blend_set("ALPHA")
+
+    lines = buffers.get_lines()
+    if lines is not None:
+        lines_co, lines_color = lines
+        batch = batch_cache.get('highlight_lines', (lines_co.tobytes(), lines_color.tobytes()),
+                                lambda: (shader_3d_lines_smooth_color, 'LINES',
+                                         {"pos": lines_co, "color": lines_color}, None))
+        bind_lines_smooth_color_versionized(line_width)
+        batch.draw(shader_3d_lines_smooth_color)
+        gpu.state.line_width_set(1)
+
+    gpu.state.depth_test_set("LESS")
+    tris = buffers.get_tris()
+    if tris is not None:
+        tris_co, tris_color, tris_indices = tris
+        batch = batch_cache.get('highlight_tris',
+                                (tris_co.tobytes(), tris_color.tobytes(), tris_indices.tobytes()),
+                                lambda: (shader_3d_smooth_color, 'TRIS',
+                                         {"pos": tris_co, "color": tris_color}, tris_indices))
+        shader_3d_smooth_color.bind()
+        batch.draw(shader_3d_smooth_color)
+
+    points = buffers.get_points()
+    if points is not None:
+        points_co, points_color = points
+        gpu.state.point_size_set(4)
+        batch = batch_cache.get('highlight_points', (points_co.tobytes(), points_color.tobytes()),
+                                lambda: (shader_3d_smooth_color, 'POINTS',
+                                         {"pos": points_co, "color": points_color}, None))
+        shader_3d_smooth_color.bind()
+        batch.draw(shader_3d_smooth_color)
+        gpu.state.point_size_set(5)
+
+    gpu.state.depth_test_set("NONE")
+    gpu.state.blend_set("NONE")
+
+
+def draw_text_lines(lines, position_x, position_y, size=11, color=(1, 1, 1, 0.8)):
+    """
+        Draw lines of text, the first line at the top.
+    """
+    font_id = 0
+    if bpy.app.version >= (3, 4, 0):
+        blf.size(font_id, size * ui_scale)
+    else:
+        blf.size(font_id, size * ui_scale, 72)
+    blf.color(font_id, *color)
+    line_height = size * ui_scale * 1.5
+    for index, line in enumerate(lines):
+        blf.position(font_id, position_x, position_y + (len(lines) - 1 - index) * line_height, 0)
+        blf.draw(font_id, line)
+
+
+def format_duration(duration):
+    if duration is None:
+        return "-"
+    return f"{duration * 1000:.2f}ms"
+
 
+def format_bytes(size):
+    return f"{size / (1024 * 1024):.1f}MB"
+
+
+def draw_performance_hud(self):
+    """
+        Draw the ingestion progress and timings of the current session, from the snapdata/profiling counters.
+    """
+    lines = ["QuickSnap"]
+    for label, snapdata in (("Source", self.snapdata_source), ("Target", self.snapdata_target)):
+        queued_objects = len(snapdata.to_process_selected) + len(snapdata.to_process_scene)
+        lines.append(f"{label}: {snapdata.added_points_np}/{len(snapdata.world_space)} points - "
+                     f"{queued_objects} queued objects - {len(snapdata.to_evaluate)} pending modifiers"
+                     f"{' - processing' if snapdata.keep_processing else ''}")
+    lines.append(f"find_closest: {format_duration(quicksnap_profiling.last_duration('find_closest'))} - "
+                 f"apply: {format_duration(quicksnap_profiling.last_duration('apply'))}")
+    # Measured by the cache trimming of the modal loop, not on each redraw.
+    lines.append(f"Memory: snapdata {format_bytes(self.snapdata_memory)} - "
+                 f"draw caches {format_bytes(self.cache_memory)}")
+    if self.frame_budget is not None:
+        lines.append(f"Frame budget: {format_duration(self.frame_budget.budget)} - "
+                     f"frame: {format_duration(self.frame_budget.frame_time)} - "
+                     f"draw: {format_duration(self.frame_budget.draw_time)}")
+    draw_text_lines(lines, 20 * ui_scale, 20 * ui_scale)
+
+
+def measure_draw_time(draw_callback):
+    """
+    Decorator registering the duration of a draw callback in the operator frame budget.
+    """
+    @functools.wraps(draw_callback)
+    def wrapper(self, context):
+        start_time = time.perf_counter()
+        draw_callback(self, context)
+        if self.frame_budget is not None:
+            self.frame_budget.add_draw_time(time.perf_counter() - start_time)
+    return wrapper
+
+
+
+@measure_draw_time
+@quicksnap_profiling.timed('draw_callback_2d')
 def draw_callback_2d(self, context):
     """
         Draw all QuickSnap 2D UI: Icons, source/target square. rubberband/
@@ -255,6 +401,9 @@ def draw_callback_2d(self, context):
         # Draw grey square when tool is enabled, additional indication that the tool is active
         draw_square_2d(self.mouse_position[0], self.mouse_position[1], square_width, color=(1, 1, 1, 0.3), point_width=0)
 
+    if self.settings.display_performance_hud:
+        draw_performance_hud(self)
+
 
 def draw_snap_axis(self, context):
     """
@@ -270,43 +419,95 @@ def draw_snap_axis(self, context):
                     axis_x = Vector((obj_matrix[0][0], obj_matrix[1][0], obj_matrix[2][0])).normalized()
                     start = point_position + axis_x * 10 ** 5
                     end = point_position - axis_x * 10 ** 5
-                    draw_line_3d(start, end, (1, 0.5, 0.5, 0.6), 1)
+                    draw_line_3d(start, end, (1, 0.5, 0.5, 0.6), 1, name=f'axis_x_{object_name}')
                 if 'Y' in self.snapping:
                     axis_y = Vector((obj_matrix[0][1], obj_matrix[1][1], obj_matrix[2][1])).normalized()
                     start = point_position + axis_y * 10 ** 5
                     end = point_position - axis_y * 10 ** 5
-                    draw_line_3d(start, end, (0.5, 1, 0.5, 0.6), 1)
+                    draw_line_3d(start, end, (0.5, 1, 0.5, 0.6), 1, name=f'axis_y_{object_name}')
                 if 'Z' in self.snapping:
                     axis_z = Vector((obj_matrix[0][2], obj_matrix[1][2], obj_matrix[2][2])).normalized()
                     start = point_position + axis_z * 10 ** 5
                     end = point_position - axis_z * 10 ** 5
-                    draw_line_3d(start, end, (0.2, 0.6, 1, 0.6), 1)
+                    draw_line_3d(start, end, (0.2, 0.6, 1, 0.6), 1, name=f'axis_z_{object_name}')
         else:
             if 'X' in self.snapping:
                 start = point_position.copy()
                 start[0] = start[0] + 10 ** 5
                 end = point_position.copy()
                 end[0] = end[0] - 10 ** 5
-                draw_line_3d(start, end, (1, 0.5, 0.5, 0.6), 1)
+                draw_line_3d(start, end, (1, 0.5, 0.5, 0.6), 1, name='axis_x')
             if 'Y' in self.snapping:
                 start = point_position.copy()
                 start[1] = start[1] + 10 ** 5
                 end = point_position.copy()
                 end[1] = end[1] - 10 ** 5
-                draw_line_3d(start, end, (0.5, 1, 0.5, 0.6), 1)
+                draw_line_3d(start, end, (0.5, 1, 0.5, 0.6), 1, name='axis_y')
             if 'Z' in self.snapping:
                 start = point_position.copy()
                 start[2] = start[2] + 10 ** 5
                 end = point_position.copy()
                 end[2] = end[2] - 10 ** 5
-                draw_line_3d(start, end, (0.2, 0.6, 1, 0.6), 1)
+                draw_line_3d(start, end, (0.2, 0.6, 1, 0.6), 1, name='axis_z')
 
 
-indices_bounds = (
-    (0, 1), (1, 2), (2, 3), (3, 0),
-    (4, 5), (5, 6), (6, 7), (7, 4),
-    (0, 4), (1, 5), (2, 6), (3, 7),
-)
+def draw_candidate_points(self, color=(1, 1, 1, 0.3), point_width=2):
+    """
+        Draw all the snap candidates of the current snapdata. Batches are only built for the newly added points.
+    """
+    if self.current_state == State.IDLE:
+        snapdata = self.snapdata_source
+    else:
+        snapdata = self.snapdata_target
+    if snapdata is None:
+        return
+    self.candidate_points.update(snapdata.world_space, snapdata.added_points_np, snapdata.points_version,
+                                 snapdata.invalid)
+    # Segments may have been merged or reset: release the batches that are not drawn anymore.
+    batch_cache.discard_indexed('candidates_', len(self.candidate_points.segments))
+    if len(self.candidate_points.segments) == 0:
+        return
+
+    gpu.state.blend_set("ALPHA")
+    gpu.state.depth_test_set("LESS_EQUAL")
+    gpu.state.point_size_set(point_width)
+    shader_3d_uniform_color.bind()
+    shader_3d_uniform_color.uniform_float("color", color)
+    for index, (segment_key, coords) in enumerate(self.candidate_points.segments):
+        batch = batch_cache.get(f'candidates_{index}', segment_key,
+                                lambda: (shader_3d_uniform_color, 'POINTS', {"pos": coords}, None))
+        batch.draw(shader_3d_uniform_color)
+    gpu.state.point_size_set(5)
+    gpu.state.depth_test_set("NONE")
+    gpu.state.blend_set("NONE")
+
+
+def draw_selection_preview(self, color=(1, 1, 1, 0.6), point_width=3):
+    """
+        Draw the edit mode selection at its live preview position. The batches are built once per backup, the
+        translation is applied with the gpu matrix.
+    """
+    if self.preview_translation is None or len(self.preview_wires) == 0:
+        return
+    gpu.state.blend_set("ALPHA")
+    gpu.state.point_size_set(point_width)
+    shader_3d_uniform_color.bind()
+    shader_3d_uniform_color.uniform_float("color", color)
+    with gpu.matrix.push_pop():
+        gpu.matrix.translate(self.preview_translation)
+        for object_name, (vertices_co, edge_indices) in self.preview_wires.items():
+            if len(vertices_co) == 0:
+                continue
+            if len(edge_indices) > 0:
+                batch = batch_cache.get(f'preview_edges_{object_name}', self.preview_version,
+                                        lambda: (shader_3d_uniform_color, 'LINES', {"pos": vertices_co},
+                                                 edge_indices))
+                batch.draw(shader_3d_uniform_color)
+            batch = batch_cache.get(f'preview_points_{object_name}', self.preview_version,
+                                    lambda: (shader_3d_uniform_color, 'POINTS', {"pos": vertices_co}, None))
+            batch.draw(shader_3d_uniform_color)
+    gpu.state.point_size_set(5)
+    gpu.state.blend_set("NONE")
 
 
 def draw_bounds(points, color=(1, 1, 0, 1), line_width=3, depth_test=False):
@@ -318,9 +519,9 @@ def draw_bounds(points, color=(1, 1, 0, 1), line_width=3, depth_test=False):
     gpu.state.blend_set("ALPHA")
     if depth_test:
         gpu.state.depth_test_set("LESS")
-    vertices = points
-
-    batch = batch_for_shader(shader_3d_uniform_color, 'LINES', {"pos": vertices}, indices=indices_bounds)
+    vertices, indices = quicksnap_geometry.bounds(points)
+    batch = batch_cache.get('bounds', vertices.tobytes(),
+                            lambda: (shader_3d_uniform_color, 'LINES', {"pos": vertices}, indices))
     shader_3d_uniform_color.bind()
     shader_3d_uniform_color.uniform_float("color", color)
     batch.draw(shader_3d_uniform_color)
@@ -338,124 +539,138 @@ point_color = {
 }
 
 
+@measure_draw_time
+@quicksnap_profiling.timed('draw_callback_3d')
 def draw_callback_3d(self, context):
     """
         Draw all 3D ui for QuickSnap: Snap axis, edge/points highlight.
     """
     draw_snap_axis(self, context)
+    draw_selection_preview(self)
+    if self.settings.display_all_candidates:
+        draw_candidate_points(self)
     if self.current_state == State.IDLE and not (self.object_mode and self.no_selection):
         coords = [self.snapdata_source.world_space[objectid] for objectid in self.snapdata_source.origins_map]
     else:
         coords = [self.snapdata_target.world_space[objectid] for objectid in self.snapdata_target.origins_map]
     if (self.current_state == State.IDLE and self.snapdata_source.snap_type == 'ORIGINS')\
             or (self.current_state == State.SOURCE_PICKED and self.snapdata_target.snap_type == 'ORIGINS'):
-        draw_points_3d(coords, point_width=5)
+        draw_points_3d(coords, point_width=5, name='origins')
     elif self.settings.snap_objects_origin == 'ALWAYS':
-        draw_points_3d(coords, color=(1, 1, 0, 0.5), point_width=3, depth_test=True)
+        draw_points_3d(coords, color=(1, 1, 0, 0.5), point_width=3, depth_test=True, name='origins')
 
+    buffers = quicksnap_geometry.OverlayBuffers()
+    add_highlight_overlay(self, context, buffers)
+    draw_overlay_buffers(buffers, line_width=self.settings.edge_highlight_width)
+
+
+def add_highlight_overlay(self, context, buffers):
+    """
+        Collect the edge/points highlight of the hovered object and target in the overlay buffers.
+        Bounds of a targeted object origin are drawn directly.
+    """
     if self.settings.highlight_target_vertex_edges or self.settings.display_potential_target_points:
         if self.current_state == State.IDLE:
             if not self.settings.ignore_modifiers and self.hover_object != '' and \
-                    self.settings.display_potential_target_points:
-                if self.hover_object not in self.source_allowed_indices:
-                    if not (self.no_selection and self.object_mode):
-                        allowed_indices = self.snapdata_source.indices[:self.snapdata_source.added_points_np]
-                        object_indices = self.snapdata_source.object_id[:self.snapdata_source.added_points_np]
-                        self.source_allowed_indices[self.hover_object] = allowed_indices[
-                            object_indices == self.snapdata_source.scene_meshes.index(self.hover_object)]
-                    else:
-                        self.source_allowed_indices[self.hover_object] = None
-                draw_face_center(self, context,
+                    self.settings.display_potential_target_points and \
+                    self.hover_object not in self.snapdata_source.base_mesh_objects:
+                if not (self.no_selection and self.object_mode):
+                    allowed_mask = self.snapdata_source.get_allowed_mask(self.hover_object)
+                else:
+                    allowed_mask = None
+                draw_face_center(self, context, buffers,
+                                 npdata=self.source_npdata,
+                                 mesh_cache=self.mesh_cache,
                                  target_object=self.hover_object,
                                  face_index=self.target_face_index,
-                                 allowed_indices=self.source_allowed_indices[self.hover_object],
+                                 allowed_mask=allowed_mask,
+                                 allowed_mask_version=self.snapdata_source.get_allowed_mask_version(self.hover_object),
                                  snap_type=self.snapdata_source.snap_type,
                                  ignore_modifiers=self.settings.ignore_modifiers or not self.object_mode,
                                  color=point_color[not self.no_selection]
                                  )
             if self.closest_source_id in self.snapdata_source.origins_map:
-                obj_name = self.snapdata_source.origins_map[self.closest_source_id]
-                if obj_name not in self.target_bounds:
-                    obj = bpy.data.objects[obj_name]
-                    bound_points = [v[:] for v in obj.bound_box]
-
-                    region3d = context.space_data.region_3d
-                    camera_position = region3d.view_matrix.inverted().translation
-                    camera_vector = region3d.view_rotation @ Vector((0.0, 0.0, -1.0))
-                    is_ortho = region3d.view_perspective == 'ORTHO'
-                    points = [obj.matrix_world @ Vector(point) for point in bound_points]
-                    self.target_bounds[obj_name] = [add_camera_offset(point,
-                                                                      camera_position,
-                                                                      camera_vector,
-                                                                      is_ortho) for point in points]
-                draw_bounds(self.target_bounds[obj_name], color=(1, 1, 0, 0.8), line_width=1, depth_test=True)
+                draw_origin_bounds(context, self.target_bounds, self.snapdata_source, self.closest_source_id)
                 return
             if self.settings.highlight_target_vertex_edges:
-                draw_edge_highlight(context,
+                draw_edge_highlight(context, buffers,
                                     target_object=self.target_object,
                                     target_id=self.closest_source_id,
                                     snapdata=self.snapdata_source,
                                     highlight_data=self.source_highlight_data,
-                                    npdata=self.source_npdata,
-                                    ignore_modifiers=self.settings.ignore_modifiers or not self.object_mode,
+                                    mesh_cache=self.mesh_cache,
+                                    ignore_modifiers=self.settings.ignore_modifiers or not self.object_mode or
+                                    self.target_object in self.snapdata_source.base_mesh_objects,
                                     width=self.settings.edge_highlight_width,
                                     color=self.settings.edge_highlight_color_source,
                                     opacity=self.settings.edge_highlight_opacity)
 
         elif self.current_state == State.SOURCE_PICKED:
             if not self.settings.ignore_modifiers:
-                if self.hover_object != '' and self.settings.display_potential_target_points:
+                if self.hover_object != '' and self.settings.display_potential_target_points and \
+                        self.hover_object not in self.snapdata_target.base_mesh_objects:
                     is_selection = self.hover_object in self.selection_objects
-                    if self.hover_object not in self.target_allowed_indices:
-                        if is_selection:
-                            allowed_indices = self.snapdata_target.indices[:self.snapdata_target.added_points_np]
-                            object_indices = self.snapdata_target.object_id[:self.snapdata_target.added_points_np]
-                            self.target_allowed_indices[self.hover_object] = \
-                                allowed_indices[
-                                    object_indices == self.snapdata_target.scene_meshes.index(self.hover_object)]
-                        else:
-                            self.target_allowed_indices[self.hover_object] = None
-                    draw_face_center(self, context,
+                    if is_selection:
+                        allowed_mask = self.snapdata_target.get_allowed_mask(self.hover_object)
+                    else:
+                        allowed_mask = None
+                    draw_face_center(self, context, buffers,
+                                     npdata=self.target_npdata,
+                                     mesh_cache=self.mesh_cache,
                                      target_object=self.hover_object,
                                      face_index=self.target_face_index,
-                                     allowed_indices=self.target_allowed_indices[self.hover_object],
+                                     allowed_mask=allowed_mask,
+                                     allowed_mask_version=self.snapdata_target.get_allowed_mask_version(
+                                         self.hover_object),
                                      snap_type=self.snapdata_target.snap_type,
                                      ignore_modifiers=self.settings.ignore_modifiers or (
                                              is_selection and not self.object_mode),
                                      color=point_color[False]
                                      )
             if self.closest_target_id in self.snapdata_target.origins_map:
-                obj_name = self.snapdata_target.origins_map[self.closest_target_id]
-                if obj_name not in self.target_bounds:
-                    obj = bpy.data.objects[obj_name]
-                    bound_points = [v[:] for v in obj.bound_box]
-
-                    region3d = context.space_data.region_3d
-                    camera_position = region3d.view_matrix.inverted().translation
-                    camera_vector = region3d.view_rotation @ Vector((0.0, 0.0, -1.0))
-                    is_ortho = region3d.view_perspective == 'ORTHO'
-                    points = [obj.matrix_world @ Vector(point) for point in bound_points]
-                    self.target_bounds[obj_name] = [add_camera_offset(point,
-                                                                      camera_position,
-                                                                      camera_vector,
-                                                                      is_ortho) for point in points]
-
-                draw_bounds(self.target_bounds[obj_name], color=(1, 1, 0, 0.8), line_width=1, depth_test=True)
+                draw_origin_bounds(context, self.target_bounds, self.snapdata_target, self.closest_target_id)
                 return
             if self.settings.highlight_target_vertex_edges:
-                draw_edge_highlight(context,
+                draw_edge_highlight(context, buffers,
                                     target_object=self.target_object,
                                     target_id=self.closest_target_id,
                                     snapdata=self.snapdata_target,
                                     highlight_data=self.target_highlight_data,
-                                    npdata=self.target_npdata,
+                                    mesh_cache=self.mesh_cache,
                                     ignore_modifiers=self.settings.ignore_modifiers or (
-                                            self.target_object in self.selection_objects and not self.object_mode),
+                                            self.target_object in self.selection_objects and not self.object_mode) or
+                                    self.target_object in self.snapdata_target.base_mesh_objects,
                                     width=self.settings.edge_highlight_width,
                                     color=self.settings.edge_highlight_color_target,
                                     opacity=self.settings.edge_highlight_opacity)
 
 
+def draw_origin_bounds(context, bounds_cache, snapdata, origin_id):
+    """
+        Draw the bounding box of the object of a snapdata origin point.
+        The local bounding boxes of all the snapdata origins objects are gathered in one (N, 8, 3) array the first
+        time, the world matrix and camera offset are applied when drawing so that they follow the view.
+        The local boxes do not depend on the view and are kept for the whole session, the boxes of edited objects are
+        dropped by init_snap_data.
+    """
+    obj_name = snapdata.origins_map[origin_id]
+    if obj_name not in bounds_cache:
+        names = [name for name in set(snapdata.origins_map.values()) if name not in bounds_cache]
+        local_bounds = np.array([[corner[:] for corner in bpy.data.objects[name].bound_box] for name in names],
+                                dtype=np.float64).reshape(-1, 8, 3)
+        bounds_cache.update(zip(names, local_bounds))
+    region3d = context.space_data.region_3d
+    camera_position = region3d.view_matrix.inverted().translation
+    camera_vector = region3d.view_rotation @ Vector((0.0, 0.0, -1.0))
+    is_ortho = region3d.view_perspective == 'ORTHO'
+    points = add_camera_offset_np(transform_points_np(bpy.data.objects[obj_name].matrix_world,
+                                                      bounds_cache[obj_name]),
+                                  camera_position,
+                                  camera_vector,
+                                  is_ortho)
+    draw_bounds(points, color=(1, 1, 0, 0.8), line_width=1, depth_test=True)
+
+
 def add_camera_offset(co, camera_position, camera_vector, is_ortho):
     """
     Offset a point towards the camera position to avoid z-fighting.
@@ -467,19 +682,31 @@ def add_camera_offset(co, camera_position, camera_vector, is_ortho):
         return co + cam_point_vector * 0.01
 
 
+def add_camera_offset_np(co, camera_position, camera_vector, is_ortho):
+    """
+    Array version of add_camera_offset, for (N, 3) points.
+    """
+    cam_point_vector = np.asarray(camera_position) - co
+    if is_ortho:
+        return co - np.asarray(camera_vector) * np.linalg.norm(cam_point_vector, axis=1)[:, np.newaxis] * 0.01
+    else:
+        return co + cam_point_vector * 0.01
+
+
 def draw_edge_highlight(context,
+                        buffers,
                         target_object,
                         target_id,
                         snapdata,
                         highlight_data,
-                        npdata,
+                        mesh_cache,
                         ignore_modifiers,
                         width=2,
                         color=(1, 1, 0),
                         opacity=1
                         ):
     """
-        Store necessary information and draw edge highlight of tht target point/edge/face.
+        Store necessary information and add the edge highlight of tht target point/edge/face to the overlay buffers.
     """
     if target_id >= 0:
         if len(snapdata.indices) <= target_id:
@@ -490,208 +717,239 @@ def draw_edge_highlight(context,
         vert_object = bpy.data.objects[target_object]
         if vert_object.type != "MESH":
             return
+        highlight_key = (vert_index, ignore_modifiers)  # Base and evaluated mesh indices are different
         if target_object not in highlight_data:
             highlight_data[target_object] = {}
-        if vert_index not in highlight_data[target_object]:
+        if highlight_key not in highlight_data[target_object]:
             matrix = vert_object.matrix_world
-            if ignore_modifiers:
-                data = vert_object.data
-            else:
-                data = vert_object.evaluated_get(context.evaluated_depsgraph_get()).data
+            depsgraph = context.evaluated_depsgraph_get()
+            mesh_data = mesh_cache.get_mesh_data(target_object, not ignore_modifiers, depsgraph)
+            verts_co = mesh_data.get('verts_co', depsgraph)
 
             if snapdata.snap_type == 'POINTS':
-                if target_object not in npdata:
-                    npdata[target_object] = {}
-                if "edge_verts" not in npdata[target_object]:
-                    arr = np.zeros(len(data.edges) * 2, dtype=int)
-                    data.edges.foreach_get('vertices', arr)
-                    arr.shape = (len(data.edges), 2)
-                    npdata[target_object]["edge_verts"] = arr
-
-                filter_left = npdata[target_object]["edge_verts"][
-                    npdata[target_object]["edge_verts"][:, 0] == vert_index]
-                filter_right = npdata[target_object]["edge_verts"][
-                    npdata[target_object]["edge_verts"][:, 1] == vert_index]
-                highlight_data[target_object][vert_index] = {}
-                highlight_data[target_object][vert_index]["edges"] = []
-                for match in filter_left:
-                    highlight_data[target_object][vert_index]["edges"].append((matrix @ data.vertices[match[0]].co,
-                                                                               matrix @ data.vertices[match[1]].co))
-                for match in filter_right:
-                    highlight_data[target_object][vert_index]["edges"].append((matrix @ data.vertices[match[1]].co,
-                                                                               matrix @ data.vertices[match[0]].co))
+                edge_verts = mesh_data.get('edge_verts', depsgraph)
+                offsets, edge_ends = mesh_data.get_vertex_edges(depsgraph)
+                if len(offsets) <= vert_index + 1:
+                    return
+                vert_edge_ends = edge_ends[offsets[vert_index]:offsets[vert_index + 1]]
+                other_verts = edge_verts[vert_edge_ends // 2, 1 - vert_edge_ends % 2]
+                edges_co = transform_points_np(matrix, verts_co[np.append(vert_index, other_verts)])
+                highlight_data[target_object][highlight_key] = {}
+                highlight_data[target_object][highlight_key]["edges"] = np.stack(
+                    (np.broadcast_to(edges_co[0], (len(other_verts), 3)), edges_co[1:]), axis=1)
             elif snapdata.snap_type == 'MIDPOINTS':
-                verts = data.vertices
-                edges = data.edges
-                if len(edges) <= vert_index:
+                edge_verts = mesh_data.get('edge_verts', depsgraph)
+                if len(edge_verts) <= vert_index:
                     return
-                highlight_data[target_object][vert_index] = {}
-                highlight_data[target_object][vert_index]["edges"] = []
-                highlight_data[target_object][vert_index]["edges"].append(
-                    (snapdata.world_space[target_id],
-                     matrix @ verts[edges[vert_index].vertices[0]].co))
-                highlight_data[target_object][vert_index]["edges"].append(
-                    (snapdata.world_space[target_id],
-                     matrix @ verts[edges[vert_index].vertices[1]].co))
+                edge_co = transform_points_np(matrix, verts_co[edge_verts[vert_index]])
+                highlight_data[target_object][highlight_key] = {}
+                highlight_data[target_object][highlight_key]["edges"] = []
+                highlight_data[target_object][highlight_key]["edges"].append(
+                    (snapdata.world_space[target_id], edge_co[0]))
+                highlight_data[target_object][highlight_key]["edges"].append(
+                    (snapdata.world_space[target_id], edge_co[1]))
 
             elif snapdata.snap_type == 'FACES':
-                if target_object not in npdata:
-                    npdata[target_object] = {}
-                if "polygon_loop_tri_idx" not in npdata[target_object]:
-                    data.calc_loop_triangles()
-                    arr = np.zeros(len(data.loop_triangles), dtype=int)
-                    data.loop_triangles.foreach_get('polygon_index', arr)
-                    npdata[target_object]["polygon_loop_tri_idx"] = arr
-                    arr2 = np.zeros(len(data.loop_triangles) * 3, dtype=int)
-                    data.loop_triangles.foreach_get('vertices', arr2)
-                    arr2.shape = (len(data.loop_triangles), 3)
-                    npdata[target_object]["polygon_loop_verts"] = arr2
-
-                verts = data.vertices
-                polygons = data.polygons
-                loops = data.loops
-                highlight_data[target_object][vert_index] = {}
-                highlight_data[target_object][vert_index]["edges"] = []
-                highlight_data[target_object][vert_index]["face_co"] = []
-                highlight_data[target_object][vert_index]["face_indices"] = []
-                if len(polygons) <= vert_index:
+                polygon_loop_start = mesh_data.get('polygon_loop_start', depsgraph)
+                highlight_data[target_object][highlight_key] = {}
+                highlight_data[target_object][highlight_key]["edges"] = []
+                highlight_data[target_object][highlight_key]["face_co"] = []
+                highlight_data[target_object][highlight_key]["face_indices"] = []
+                if len(polygon_loop_start) <= vert_index:
                     return
-                poly = polygons[vert_index]
                 region3d = context.space_data.region_3d
                 camera_position = region3d.view_matrix.inverted().translation
                 camera_vector = region3d.view_rotation @ Vector((0.0, 0.0, -1.0))
                 is_ortho = not region3d.is_perspective
 
-                vert_local_index = {}
-                verts_co = {}
-                for idx in range(0, poly.loop_total):
-                    current_loop = poly.loop_start + idx
-                    loop_second = poly.loop_start + ((idx + 1) % poly.loop_total)
-                    vert_index_a = loops[current_loop].vertex_index
-                    vert_index_b = loops[loop_second].vertex_index
-                    if vert_index_a not in verts_co:
-                        verts_co[vert_index_a] = matrix @ verts[vert_index_a].co
-                        verts_co[vert_index_a] = add_camera_offset(verts_co[vert_index_a],
-                                                                   camera_position,
-                                                                   camera_vector,
-                                                                   is_ortho)
-                        new_index = len(highlight_data[target_object][vert_index]["face_co"])
-                        vert_local_index[vert_index_a] = new_index
-                        highlight_data[target_object][vert_index]["face_co"].append(verts_co[vert_index_a])
-                    if vert_index_b not in verts_co:
-                        verts_co[vert_index_b] = matrix @ verts[vert_index_b].co
-                        verts_co[vert_index_b] = add_camera_offset(verts_co[vert_index_b],
-                                                                   camera_position,
-                                                                   camera_vector,
-                                                                   is_ortho)
-
-                        new_index = len(highlight_data[target_object][vert_index]["face_co"])
-                        vert_local_index[vert_index_b] = new_index
-                        highlight_data[target_object][vert_index]["face_co"].append(verts_co[vert_index_b])
-                    highlight_data[target_object][vert_index]["edges"].append(
-                        (verts_co[vert_index_a], verts_co[vert_index_b]))
-
-                filtered = np.argwhere(npdata[target_object]["polygon_loop_tri_idx"] == vert_index)
-                for triangle_index in filtered:
-                    triangle = npdata[target_object]["polygon_loop_verts"][triangle_index].flatten()
-                    highlight_data[target_object][vert_index]["face_indices"].extend(
-                        [[vert_local_index[vertid] for vertid in triangle]])
+                loop_start = polygon_loop_start[vert_index]
+                loop_end = loop_start + mesh_data.get('polygon_loop_total', depsgraph)[vert_index]
+                face_verts = mesh_data.get('loop_verts', depsgraph)[loop_start:loop_end]
+                face_co = add_camera_offset_np(transform_points_np(matrix, verts_co[face_verts]),
+                                               camera_position,
+                                               camera_vector,
+                                               is_ortho)
+                tri_offsets = mesh_data.get('polygon_loop_tri_offsets', depsgraph)
+                face_triangles = mesh_data.get('loop_triangle_verts', depsgraph)[
+                    tri_offsets[vert_index]:tri_offsets[vert_index + 1]]
+                highlight_data[target_object][highlight_key]["edges"] = quicksnap_geometry.polygon_outline(face_co)
+                highlight_data[target_object][highlight_key]["face_co"] = face_co
+                highlight_data[target_object][highlight_key]["face_indices"] = quicksnap_geometry.local_indices(
+                    face_verts, face_triangles)
+
+            highlight = highlight_data[target_object][highlight_key]
+            highlight["edges"] = np.asarray(highlight["edges"], dtype=np.float32).reshape(-1, 2, 3)
 
         if snapdata.snap_type == 'POINTS':
             alpha_end = 0
         else:
             alpha_end = opacity
 
-        for edge in highlight_data[target_object][vert_index]["edges"]:
-            draw_line_3d_smooth_blend(edge[0],
-                                      edge[1],
-                                      color_a=(*color, opacity),
-                                      color_b=(*color, alpha_end),
-                                      line_width=width, depth_test=False)
-        if snapdata.snap_type == 'FACES':
-            draw_polygon_smooth_blend(highlight_data[target_object][vert_index]["face_co"],
-                                      highlight_data[target_object][vert_index]["face_indices"],
-                                      color=(*color, 0.1),
-                                      depth_test=True)
+        highlight = highlight_data[target_object][highlight_key]
+        if len(highlight["edges"]) > 0:
+            buffers.add_lines(highlight["edges"].reshape(-1, 3),
+                              quicksnap_geometry.gradient_lines_colors(len(highlight["edges"]),
+                                                                       (*color, opacity),
+                                                                       (*color, alpha_end)))
+        if snapdata.snap_type == 'FACES' and len(highlight["face_indices"]) > 0:
+            buffers.add_tris(highlight["face_co"], highlight["face_indices"], (*color, 0.1))
 
 
 def draw_face_center(self, context,
+                     buffers,
+                     npdata,
+                     mesh_cache,
                      target_object,
                      face_index,
-                     allowed_indices,
+                     allowed_mask,
+                     allowed_mask_version,
                      snap_type,
                      ignore_modifiers,
                      color):
     """
-        Store necessary information and draw points of the target point/edge/face.
+        Store necessary information and add the points of the target point/edge/face to the overlay buffers.
+        Candidate points are only computed when the hovered face or the allowed mask changes.
     """
     if face_index < 0 or target_object == '':
         return
     obj = bpy.data.objects[target_object]
     if obj.type != 'MESH':
         return
-    if ignore_modifiers:
-        data = obj.data
-    else:
-        data = obj.evaluated_get(context.evaluated_depsgraph_get()).data
+    # Draw verts points if not in edit mode + vertex mode
+    if snap_type == 'POINTS' and not self.object_mode and context.scene.tool_settings.mesh_select_mode[0]:
+        return
+    if snap_type not in ('FACES', 'MIDPOINTS', 'POINTS'):
+        return
 
+    if target_object not in npdata:
+        npdata[target_object] = {}
+    object_npdata = npdata[target_object]
+    face_points_key = (face_index, snap_type, ignore_modifiers, allowed_mask is None, allowed_mask_version)
+    if "face_points" not in object_npdata or object_npdata["face_points"][0] != face_points_key:
+        object_npdata["face_points"] = (face_points_key,
+                                        get_face_points(context, mesh_cache, target_object, face_index, allowed_mask,
+                                                        snap_type, ignore_modifiers))
+    points_co = object_npdata["face_points"][1]
+    if len(points_co) == 0:
+        return
 
     region3d = context.space_data.region_3d
     camera_position = region3d.view_matrix.inverted().translation
     camera_vector = region3d.view_rotation @ Vector((0.0, 0.0, -1.0))
     is_ortho = not region3d.is_perspective
-    if snap_type == 'FACES':
-        # and face_index in allowed_indices
-        # print(f"face index:{face_index}")
-        # print(f"len(data.polygons):{len(data.polygons)}")
-        if face_index < len(data.polygons) and (allowed_indices is None or face_index in allowed_indices):
-            target_polygon = data.polygons[face_index]
-            center = obj.matrix_world @ target_polygon.center
-            region3d = context.space_data.region_3d
-            camera_position = region3d.view_matrix.inverted().translation
-            center = add_camera_offset(center,
-                                       camera_position,
-                                       camera_vector,
-                                       is_ortho)
-            draw_points_3d([center], color=(*color, 1), point_width=4,
-                           depth_test=True)
+    points_co = add_camera_offset_np(transform_points_np(obj.matrix_world, points_co),
+                                     camera_position,
+                                     camera_vector,
+                                     is_ortho)
+    buffers.add_points(points_co, (*color, 1))
+
 
+def get_face_points(context, mesh_cache, target_object, face_index, allowed_mask, snap_type, ignore_modifiers):
+    """
+        Returns the object space (N, 3) candidate points of a face: its center, its edges midpoints or its vertices.
+        allowed_mask: mask of the allowed face/edge/vertex indices (see SnapData.get_allowed_mask), None if all
+        are allowed.
+    """
+    no_points = np.zeros((0, 3))
+    depsgraph = context.evaluated_depsgraph_get()
+    mesh_data = mesh_cache.get_mesh_data(target_object, not ignore_modifiers, depsgraph)
+    polygon_loop_start = mesh_data.get('polygon_loop_start', depsgraph)
+    if face_index >= len(polygon_loop_start):
+        return no_points
+
+    loop_start = polygon_loop_start[face_index]
+    loop_end = loop_start + mesh_data.get('polygon_loop_total', depsgraph)[face_index]
+    face_verts = mesh_data.get('loop_verts', depsgraph)[loop_start:loop_end]
+    verts_co = mesh_data.get('verts_co', depsgraph)
+    if snap_type == 'FACES':
+        if allowed_mask is not None and not quicksnap_geometry.in_mask(allowed_mask, [face_index])[0]:
+            return no_points
+        return verts_co[face_verts].mean(axis=0)[np.newaxis]
     elif snap_type == 'MIDPOINTS':
-        if face_index < len(data.polygons):
-            target_polygon = data.polygons[face_index]
-            camera_position = context.space_data.region_3d.view_matrix.inverted().translation
-            midpoints = []
-            for loop_index in range(0, target_polygon.loop_total):
-                current_loop = data.loops[target_polygon.loop_start + loop_index]
-                if allowed_indices is not None and current_loop.edge_index not in allowed_indices:
-                    continue
-                loop_second = data.loops[target_polygon.loop_start + ((loop_index + 1) % target_polygon.loop_total)]
-                midpoint = obj.matrix_world @ ((data.vertices[current_loop.vertex_index].co +
-                                                data.vertices[loop_second.vertex_index].co) / 2)
-                midpoint = add_camera_offset(midpoint,
-                                             camera_position,
-                                             camera_vector,
-                                             is_ortho)
-                midpoints.append(midpoint)
-            draw_points_3d(midpoints, color=(*color, 1), point_width=4, depth_test=True)
-            
-    # Draw verts points if not in edit mode + vertex mode
-    elif snap_type == 'POINTS' and not (not self.object_mode and context.scene.tool_settings.mesh_select_mode[0]):
-        if face_index < len(data.polygons):
-            target_polygon = data.polygons[face_index]
-            camera_position = context.space_data.region_3d.view_matrix.inverted().translation
-            points = []
-            for vert_id in target_polygon.vertices:
-                if allowed_indices is not None and vert_id not in allowed_indices:
-                    continue
-                point = obj.matrix_world @ data.vertices[vert_id].co
-                point = add_camera_offset(point,
-                                          camera_position,
-                                          camera_vector,
-                                          is_ortho)
-                points.append(point)
-            draw_points_3d(points, color=(*color, 1), point_width=4, depth_test=True)
+        midpoints = (verts_co[face_verts] + verts_co[np.roll(face_verts, -1)]) / 2
+        if allowed_mask is None:
+            return midpoints
+        loop_edges = mesh_data.get('loop_edges', depsgraph)[loop_start:loop_end]
+        return midpoints[quicksnap_geometry.in_mask(allowed_mask, loop_edges)]
+    else:
+        if allowed_mask is None:
+            return verts_co[face_verts]
+        return verts_co[face_verts[quicksnap_geometry.in_mask(allowed_mask, face_verts)]]
 
 
 def get_icons_dir():
     return Path(os.path.dirname(__file__)) / "icons"
+
+
+class IconAtlas:
+    """
+    All the QUICKSNAP_<name>.tif icons packed side by side in a single GPU texture, with the UV rect of each icon.
+    Built once after the addon registration, so that the modal never loads images from disk.
+    """
+
+    def __init__(self):
+        self.texture = None
+        self.uv_rects = {}
+
+    def build(self):
+        """
+        Load the icons and create the atlas texture. Returns False if the icons could not be loaded.
+        """
+        if self.texture is not None:
+            return True
+        icons_pixels = {}
+        for texture_path in sorted(get_icons_dir().glob('QUICKSNAP_*.tif')):
+            name = texture_path.stem[len('QUICKSNAP_'):]
+            try:
+                img = bpy.data.images.load(str(texture_path), check_existing=False)
+            except RuntimeError:
+                logger.warning(f"Could not load icon: {texture_path}")
+                continue
+            width, height = img.size
+            pixels = np.empty(width * height * 4, dtype=np.float32)
+            img.pixels.foreach_get(pixels)
+            icons_pixels[name] = pixels.reshape(height, width, 4)
+            bpy.data.images.remove(img)
+        if len(icons_pixels) == 0:
+            return False
+
+        atlas_width = sum(pixels.shape[1] for pixels in icons_pixels.values())
+        atlas_height = max(pixels.shape[0] for pixels in icons_pixels.values())
+        atlas = np.zeros((atlas_height, atlas_width, 4), dtype=np.float32)
+        offset_x = 0
+        for name, pixels in icons_pixels.items():
+            height, width = pixels.shape[:2]
+            atlas[:height, offset_x:offset_x + width] = pixels
+            self.uv_rects[name] = (offset_x / atlas_width, 0,
+                                   (offset_x + width) / atlas_width, height / atlas_height)
+            offset_x += width
+        buffer = gpu.types.Buffer('FLOAT', atlas.size, atlas.ravel())
+        self.texture = gpu.types.GPUTexture((atlas_width, atlas_height), format='RGBA32F', data=buffer)
+        logger.debug(f"Icon atlas built: {list(self.uv_rects)} - size: {atlas_width}x{atlas_height}")
+        return True
+
+    def clear(self):
+        self.texture = None
+        self.uv_rects = {}
+
+
+icon_atlas = IconAtlas()
+
+
+def build_icon_atlas():
+    """
+    Timer callback building the icon atlas once Blender is ready after registration.
+    """
+    icon_atlas.build()
+    return None
+
+
+def register():
+    if not bpy.app.background:
+        bpy.app.timers.register(build_icon_atlas, first_interval=0.1)
+
+
+def unregister():
+    if bpy.app.timers.is_registered(build_icon_atlas):
+        bpy.app.timers.unregister(build_icon_atlas)
+    icon_atlas.clear()
@@ -0,0 +1,738 @@
+"""
+Snapping session of a QuickSnap invocation: snapdata of the source and target points, closest points search and
+translation of the selection.
+The modal operator (quicksnap.QuickVertexSnapOperator) adds the UI on top of it: events, pie menu, draw handlers and
+header. benchmarks/replay_session.py drives the same methods headlessly to replay recorded sessions.
+"""
+import time
+import bmesh
+import bpy
+import logging
+import numpy as np
+from mathutils import Matrix, Vector
+
+from . import quicksnap_meshdata
+from . import quicksnap_profiling
+from . import quicksnap_utils
+from .quicksnap_snapdata import SnapData
+from bpy_extras import view3d_utils
+from .quicksnap_utils import State
+
+__name_addon__ = '.'.join(__name__.split('.')[:-1])
+logger = logging.getLogger(__name_addon__)
+
+# Hotkeys handled by SnapSession.handle_session_hotkey
+snap_type_hotkeys = {'ONE': 'POINTS', 'NUMPAD_1': 'POINTS', 'TWO': 'MIDPOINTS', 'NUMPAD_2': 'MIDPOINTS',
+                     'THREE': 'FACES', 'NUMPAD_3': 'FACES', 'O': 'ORIGINS'}
+axis_hotkeys = {'X': ('X', 'YZ'), 'Y': ('Y', 'XZ'), 'Z': ('Z', 'XY')}  # (axis, plane with Shift)
+
+
+class SnapSession:
+    """
+    State and update path of a snapping session. Expects self.settings (addon preferences or any object with the same
+    attributes), self.selection_objects, self.no_selection, self.object_mode and self.mouse_position to be set before
+    init_session().
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.settings = None
+        self.view_distance = None
+        self.view_camera_zoom = None
+        self.no_selection = False
+        self.no_selection_target = None
+        self.mouse_position_world = None
+        self.ignore_modifiers = None
+        self.target_face_index = -1
+        self.hover_object = ""
+        self.target_bounds = None
+        self.source_highlight_data = None
+        self.target_highlight_data = None
+        self.source_npdata = None
+        self.target_npdata = None
+        self.mesh_cache = None
+        self.hierarchy = None
+        self.scene_objects = None
+        self.last_cache_trim_time = 0
+        # Bytes held by the snapdata and by the draw caches, measured by trim_object_caches.
+        self.snapdata_memory = 0
+        self.cache_memory = 0
+        self.backup_curve_points = None
+        self.last_translation = None
+        self.last_translation_direct = False
+        self.direct_preview = False
+        self.preview_wires = {}
+        self.preview_translation = None
+        self.preview_version = 0
+        self.translate_ops = None
+        self.mouse_coalescer = None
+        self.frame_budget = None
+        self.mouse_position = None
+        self.bmeshs = None
+        self.backup_vertices = {}
+        self.backup_object_positions = {}
+        self.perspective_matrix_inverse = None
+        self.perspective_matrix = None
+        self.camera_position = None
+        self.mouse_vector = None
+        self.closest_target_object = ""
+        self.snapdata_target = None
+        self.snapdata_source = None
+        self.object_mode = None
+        self.target_object_display_backup = None
+        self.target_object_show_bounds_backup = False
+        self.target_object_display_bounds_type_backup = False
+        self.target_object_show_name_backup = False
+        self.target_object_show_wire_backup = False
+        self.target_object_is_root = False
+        self.target_object = ""
+        self.camera_moved = False
+        self.target2d = None
+        self.target = None
+        self.distance = 0
+        self.closest_actionable = False
+        self.closest_target_id = -1
+        self.closest_source_id = -1
+        self.closest_vertexid = -1
+        self.current_state = State.IDLE
+        self.selection_objects = None
+        self.snapping_local = False
+        self.snapping = ""
+
+    def init_session(self, context, region):
+        """
+        Create the snapdata and the caches of the session, back up the selection and search the closest point to the
+        mouse.
+        """
+        # Create SnapData objects that will store all the vertex/point info (World space, view space, and kdtree to
+        # search the closest point). The meshes arrays are shared by the snapdata and the draw callbacks.
+        self.mesh_cache = quicksnap_meshdata.MeshDataCache()
+        self.hierarchy = quicksnap_utils.HierarchyIndex()
+        self.scene_objects = quicksnap_utils.SceneObjects(context.view_layer)
+        self.snapdata_source = SnapData(context, region, self.settings, self.selection_objects,
+                                        self.scene_objects.get_scene_objects(False),
+                                        is_origin=True,
+                                        no_selection=self.no_selection,
+                                        mesh_cache=self.mesh_cache, hierarchy=self.hierarchy)
+        if self.no_selection:
+            self.snapdata_target = SnapData(context, region, self.settings, [],
+                                            [], mesh_cache=self.mesh_cache, hierarchy=self.hierarchy)
+        else:
+            self.snapdata_target = SnapData(context, region, self.settings, self.selection_objects,
+                                            self.scene_objects.get_scene_objects(True),
+                                            mesh_cache=self.mesh_cache, hierarchy=self.hierarchy)
+
+        # Store 3DView camera information.
+        region3d = context.space_data.region_3d
+        self.camera_position = region3d.view_matrix.inverted().translation
+        self.mouse_vector = view3d_utils.region_2d_to_vector_3d(region, context.space_data.region_3d,
+                                                                self.mouse_position)
+        self.perspective_matrix = context.space_data.region_3d.perspective_matrix
+        self.perspective_matrix_inverse = self.perspective_matrix.inverted()
+        self.target_bounds = quicksnap_utils.ObjectCache()
+        self.target_npdata = quicksnap_utils.ObjectCache()
+        self.no_selection_target = None
+        self.ignore_modifiers = self.settings.ignore_modifiers
+        self.target_face_index = -1
+        self.target_object_display_backup = {}
+        self.source_highlight_data = quicksnap_utils.ObjectCache()
+        self.target_highlight_data = quicksnap_utils.ObjectCache()
+        self.source_npdata = quicksnap_utils.ObjectCache()
+        self.last_cache_trim_time = 0
+        self.mouse_coalescer = quicksnap_utils.MouseMoveCoalescer()
+        self.frame_budget = quicksnap_utils.FrameBudget()
+        self.backup_data(context)
+        self.update(context, region)
+
+    def set_cursor(self, cursor):
+        """
+        Set the mouse cursor of the window, if there is one (not in background mode).
+        """
+        if bpy.context.window is not None:
+            bpy.context.window.cursor_set(cursor)
+
+    def process_snapdata(self, context):
+        """
+        Add points to the snapdata in use, within the frame budget: the source points, then the target points once all
+        the source points are added. Returns True if points were added.
+        """
+        max_run_duration = self.frame_budget.budget
+        snapdata_updated = False
+        if self.current_state == State.IDLE:
+            snapdata_updated = snapdata_updated or self.snapdata_source.process_iteration(context, max_run_duration)
+            if not self.snapdata_source.keep_processing:  # if all source are processed, start processing target points
+                snapdata_updated = snapdata_updated or self.snapdata_target.process_iteration(context,
+                                                                                              max_run_duration)
+        else:
+            snapdata_updated = snapdata_updated or self.snapdata_target.process_iteration(context, max_run_duration)
+        return snapdata_updated
+
+    def pick_source(self, context, region):
+        """
+        Start moving the selection from the closest source point. Without selection, the object (object mode) or the
+        points (edit mode) of the source point become the selection.
+        Returns False if the object of the source point could not be found.
+        """
+        if self.no_selection:
+            obj_name = self.snapdata_source.get_object_name_at_index(self.closest_source_id)
+            if self.object_mode:
+                self.snapdata_source.keep_processing = False
+                if obj_name is not None:
+                    self.selection_objects.append(obj_name)
+                    bpy.data.objects[obj_name].select_set(True)
+                    context.view_layer.objects.active = bpy.data.objects[obj_name]
+                    self.revert_object_display(obj_name)
+                else:
+                    print("Error: Could not find target object.")
+                    return False
+            else:
+                obj = bpy.data.objects[obj_name]
+                if self.closest_source_id in self.snapdata_source.origins_map and \
+                        self.snapdata_source.origins_map[self.closest_source_id] == obj_name:
+                    bpy.ops.object.mode_set(mode='OBJECT')
+                    self.selection_objects.append(obj_name)
+                    if obj_name in self.snapdata_target.to_process_scene:
+                        self.snapdata_target.to_process_scene.remove(obj_name)
+                    self.revert_object_display(obj_name)
+                else:
+                    self.snapdata_source.select_points(obj, self.closest_source_id)
+
+            self.backup_data(context)
+            self.scene_objects.update_selection(self.selection_objects)
+            self.snapdata_target.is_enabled = False
+            self.snapdata_target.__init__(context, region, self.settings, self.selection_objects,
+                                          self.scene_objects.get_scene_objects(True),
+                                          mesh_cache=self.mesh_cache, hierarchy=self.hierarchy)
+        self.current_state = State.SOURCE_PICKED
+        self.set_object_display("", "")
+        return True
+
+    def backup_data(self, context):
+        """
+        Backup points positions if in Object mode, otherwise backup object positions. used for cancelling operator
+        """
+        self.backup_object_positions = {}
+        self.direct_preview = self.settings.use_direct_preview
+        if self.object_mode:
+            for object_name in self.hierarchy.keep_only_parents(self.selection_objects):
+                self.backup_object_positions[object_name] = bpy.data.objects[object_name].matrix_world.copy()
+        else:
+            self.backup_curve_points = {}
+            self.backup_vertices = {}
+            self.bmeshs = {}
+            self.preview_wires = {}
+            self.preview_translation = None
+            self.preview_version += 1
+            for object_name in self.snapdata_source.selected_ids:
+                obj = bpy.data.objects[object_name]
+                if obj.type == "MESH":
+                    self.bmeshs[object_name] = bmesh.new()
+                    self.bmeshs[object_name].from_mesh(obj.data)
+                    # Vertex coordinates before the translation and selected vertices, for the array based apply.
+                    if obj.data.is_editmode:
+                        obj.update_from_editmode()
+                        self.backup_vertices[object_name] = (
+                            quicksnap_utils.get_vertices_co(obj.data),
+                            np.flatnonzero(quicksnap_utils.get_vertices_select(obj.data)))
+                    # Selected vertices/edges, drawn at the translated position during the live preview.
+                    if self.direct_preview and obj.data.is_editmode:
+                        self.preview_wires[object_name] = quicksnap_utils.get_selection_wire_np(obj)
+                    else:
+                        self.direct_preview = False
+
+                elif obj.type == "CURVE":
+                    if not obj.data.is_editmode:
+                        self.direct_preview = False
+                    self.backup_curve_points[object_name] = quicksnap_utils.flatten([[
+                        (spline_index, index, point.co.copy(), 1, point.handle_left.copy(), point.handle_right.copy())
+                        for index, point in enumerate(spline.bezier_points) if point.select_control_point]
+                        for spline_index, spline in enumerate(obj.data.splines)])
+
+                    self.backup_curve_points[object_name].extend(quicksnap_utils.flatten([[(
+                        spline_index, index, point.co.copy(), 0, 0, 0)
+                        for index, point in enumerate(spline.points) if point.select]
+                        for spline_index, spline in enumerate(obj.data.splines)]))
+
+    def store_object_display(self, object_name):
+        if object_name not in self.target_object_display_backup:
+            self.target_object_display_backup[object_name] = (bpy.data.objects[object_name].show_wire,
+                                                              bpy.data.objects[object_name].show_name,
+                                                              bpy.data.objects[object_name].show_bounds,
+                                                              bpy.data.objects[object_name].display_bounds_type)
+
+    def revert_object_display(self, object_name):
+        if object_name in self.target_object_display_backup:
+            (bpy.data.objects[object_name].show_wire,
+             bpy.data.objects[object_name].show_name,
+             bpy.data.objects[object_name].show_bounds,
+             bpy.data.objects[object_name].display_bounds_type) = self.target_object_display_backup[object_name]
+
+    def set_object_display(self, target_object="", hover_object="", is_root=False, mesh_vertid=-1, force=True):
+        """
+        Defines the target object.
+        Enables wireframe/bounds/display name on the target object and disable all that on the previous target object
+        """
+        if self.target_object != "":
+            self.revert_object_display(self.target_object)
+        if self.hover_object != "":
+            self.revert_object_display(self.hover_object)
+
+        if target_object != "":
+            self.store_object_display(target_object)
+            if self.settings.display_target_wireframe:
+                bpy.data.objects[target_object].show_wire = True
+            if is_root:
+                bpy.data.objects[target_object].show_name = True
+
+        self.target_object = target_object
+        self.target_object_is_root = is_root
+
+        if hover_object != "" and hover_object != target_object:
+            self.store_object_display(hover_object)
+            if self.settings.display_target_wireframe:
+                bpy.data.objects[hover_object].show_wire = True
+
+        self.hover_object = hover_object
+        self.closest_vertexid = mesh_vertid
+
+    def revert_data(self, context, apply=False):
+        """
+        Revert the backed up data (verts/curve points positions if in EDIT mode, objects locations if in OBJECT mode)
+        """
+        if self.object_mode:
+            for object_name in self.backup_object_positions:
+                bpy.data.objects[object_name].matrix_world = self.backup_object_positions[object_name].copy()
+        else:
+            # If the operation is not cancelled, simply move the selection back.
+            if not apply and self.last_translation is not None:
+                if self.last_translation_direct:
+                    self.translate_selection_direct(Vector((0, 0, 0)))
+                    return
+                bpy.ops.transform.translate(value=self.last_translation * -1,
+                                            orient_type='GLOBAL',
+                                            snap=False,
+                                            use_automerge_and_split=False)
+                return
+            # Otherwise, properly revert all vertex/points data.
+            object_mode_backup = quicksnap_utils.set_object_mode_if_needed()
+            for object_name in self.bmeshs:
+                obj = bpy.data.objects[object_name]
+                self.bmeshs[object_name].to_mesh(bpy.data.objects[object_name].data)
+
+            for object_name in self.backup_curve_points:
+                obj = bpy.data.objects[object_name]
+                data = obj.data
+                for (curveindex, index, co, bezier, left, right) in self.backup_curve_points[object_name]:
+                    if bezier == 1:
+                        data.splines[curveindex].bezier_points[index].co = co
+                        data.splines[curveindex].bezier_points[index].handle_left = left
+                        data.splines[curveindex].bezier_points[index].handle_right = right
+                    else:
+                        data.splines[curveindex].points[index].co = co
+
+            quicksnap_utils.revert_mode(object_mode_backup)
+
+    def translate_selection_direct(self, translation):
+        """
+        Live preview: move the selection from its backed up state by writing object matrices or curve point
+        coordinates directly, instead of calling bpy.ops.transform.translate.
+        Edit mode meshes are not modified: their selection is drawn with the translation applied (see
+        quicksnap_render.draw_selection_preview), the vertices are moved once when the snap is confirmed.
+        """
+        translation_matrix = Matrix.Translation(translation)
+        if self.object_mode:
+            for object_name in self.backup_object_positions:
+                bpy.data.objects[object_name].matrix_world = translation_matrix @ \
+                                                             self.backup_object_positions[object_name]
+        else:
+            self.preview_translation = translation.copy() if translation.length > 0 else None
+            for object_name in self.backup_curve_points:
+                quicksnap_utils.translate_curvepoints_worldspace(bpy.data.objects[object_name],
+                                                                 self.backup_curve_points[object_name],
+                                                                 translation_matrix)
+
+    def translate_selection_np(self, translation):
+        """
+        Move the selected vertices/points of edit mode objects from their backed up coordinates with array writes
+        (see quicksnap_utils.translate_vertices_worldspace_np), instead of calling bpy.ops.transform.translate.
+        The objects are switched to object mode for the write.
+        """
+        translation_matrix = Matrix.Translation(translation)
+        object_mode_backup = quicksnap_utils.set_object_mode_if_needed()
+        for object_name, (base_co, vertex_indices) in self.backup_vertices.items():
+            quicksnap_utils.translate_vertices_worldspace_np(bpy.data.objects[object_name], base_co, vertex_indices,
+                                                             translation_matrix)
+        for object_name in self.backup_curve_points:
+            quicksnap_utils.translate_curvepoints_worldspace(bpy.data.objects[object_name],
+                                                             self.backup_curve_points[object_name],
+                                                             translation_matrix)
+        quicksnap_utils.revert_mode(object_mode_backup)
+
+    def update(self, context, region):
+        """
+        Main Update Loop
+        """
+
+        # Update 3DView camera information
+        region3d = context.region_data
+        self.camera_position = region3d.view_matrix.inverted().translation
+        if region3d.view_perspective == 'CAMERA' and not region3d.is_perspective:
+            depth_location = context.space_data.camera.location
+            self.mouse_position_world = view3d_utils.region_2d_to_location_3d(region, region.data, self.mouse_position,
+                                                                              depth_location)
+        else:
+            self.mouse_position_world = view3d_utils.region_2d_to_origin_3d(region, region.data, self.mouse_position)
+        self.mouse_vector = view3d_utils.region_2d_to_vector_3d(region, region.data,
+                                                                self.mouse_position)
+
+        mouse_coord_screen_flat = Vector((self.mouse_position[0], self.mouse_position[1], 0))
+
+        depsgraph = context.evaluated_depsgraph_get()
+        hover_object = ""
+        if self.current_state == State.IDLE:
+            if self.snapdata_source.snap_type != 'ORIGINS':
+                if self.no_selection and self.object_mode:
+                    selection = []
+
+                    self.snapdata_source.add_nearby_objects(context, region, depsgraph, self.mouse_position, selection)
+                # Find object under the mouse
+                (direct_hit, _, _, self.target_face_index, direct_hit_object, _) = context.scene.ray_cast(
+                    context.evaluated_depsgraph_get(),
+                    origin=self.mouse_position_world,
+                    direction=self.mouse_vector)
+                # If found, we push this object on top of the stack of objects to process
+                if direct_hit and (direct_hit_object.name in self.selection_objects or (self.no_selection and self.object_mode)):
+                    hover_object = direct_hit_object.name
+                    self.snapdata_source.add_object_data(direct_hit_object.name,
+                                                         depsgraph=depsgraph,
+                                                         is_selected=True,
+                                                         set_first_priority=True)
+
+            # Find source vert/point the closest to the mouse, change cursor crosshair
+            closest = self.snapdata_source.find_closest(mouse_coord_screen_flat,
+                                                        search_origins_only=self.snapdata_source.snap_type == 'ORIGINS')
+            if closest is not None:
+                (self.closest_source_id, self.distance, target_name, is_root, mesh_vertid) = closest
+                self.set_object_display(target_name, hover_object, is_root)
+                if self.object_mode and self.no_selection and self.no_selection_target is None or \
+                        self.no_selection_target != target_name:
+                    self.no_selection_target = target_name
+                self.closest_actionable = True  # Points too far from the mouse are highlighted but can't be moved
+                self.set_cursor("SCROLL_XY")
+            else:
+                if self.object_mode and self.no_selection and self.no_selection_target is not None:
+                    self.no_selection_target = None
+                self.closest_source_id = -1
+                self.closest_vertexid = -1
+                self.set_object_display("", hover_object)
+                self.distance = -1
+                self.closest_actionable = False
+                self.set_cursor("CROSSHAIR")
+
+        elif self.current_state == State.SOURCE_PICKED:
+            # If we are only snapping to origins, only search through origin points.
+            if self.snapdata_target.snap_type == 'ORIGINS':
+                closest = self.snapdata_target.find_closest(mouse_coord_screen_flat, search_origins_only=True)
+                if closest is not None:
+                    (self.closest_target_id, self.distance, target_object_name, is_root, mesh_vertid) = closest
+                    self.set_object_display(target_object_name, hover_object, is_root, mesh_vertid=mesh_vertid)
+                else:
+                    self.closest_vertexid = -1
+                    self.closest_target_id = -1
+                    self.distance = -1
+                    self.set_object_display("", hover_object)
+
+            else:  # Snapping to all verts/points
+                # First hide the selection mesh not to raycast against it.
+                selected_objs = [bpy.data.objects[obj] for obj in self.selection_objects]
+                for obj in selected_objs:
+                    obj.hide_set(True)
+
+                (direct_hit, direct_hit_object_name, self.target_face_index) = \
+                    self.snapdata_target.add_nearby_objects(context, region, depsgraph, self.mouse_position,
+                                                            self.selection_objects)
+
+                if direct_hit:
+                    hover_object = direct_hit_object_name
+
+                # Revert hidden objects
+                for obj in self.selection_objects:
+                    bpy.data.objects[obj].hide_set(False)
+                for obj in self.selection_objects:  # re-select selection that might be lost in previous steps
+                    bpy.data.objects[obj].select_set(True)
+
+                # Find the closest target points
+                closest = self.snapdata_target.find_closest(mouse_coord_screen_flat)
+                if closest is not None:
+                    (self.closest_target_id, self.distance, target_object_name, is_root, mesh_vertid) = closest
+                    self.set_object_display(target_object_name, hover_object, is_root, mesh_vertid=mesh_vertid)
+                else:
+                    self.closest_vertexid = -1
+                    self.closest_target_id = -1
+                    self.distance = -1
+                    self.set_object_display("", hover_object)
+
+    @quicksnap_profiling.timed('apply')
+    def apply(self, context, region, use_auto_merge=False, preview=True):
+        """
+        Apply operator modifications: Translate objects or vertices/points from source point to target point.
+        If preview is True and direct preview is enabled, the selection is moved without bpy.ops, the transform
+        operator is then only called once when the operation is confirmed (preview=False).
+        When the operation is confirmed in edit mode without auto merge, the vertices are written with arrays instead
+        of calling the transform operator (see translate_selection_np).
+        """
+        self.target = None
+        self.target2d = None
+        if self.current_state == State.SOURCE_PICKED:
+            self.revert_data(context)  # We first revert objects/verts/points to their original position
+
+            origin, self.target = self.get_snap_target(context)
+
+            self.last_translation = (Vector(self.target) - Vector(origin))
+            self.last_translation_direct = preview and self.direct_preview
+            tool_settings = context.tool_settings
+            use_auto_merge = use_auto_merge and not self.object_mode and tool_settings.use_mesh_automerge
+            if self.last_translation_direct:
+                self.translate_selection_direct(self.last_translation)
+            elif not preview and not self.object_mode and not use_auto_merge and \
+                    len(self.backup_vertices) == len(self.bmeshs):
+                self.translate_selection_np(self.last_translation)
+            else:
+                bpy.ops.transform.translate(value=self.last_translation,
+                                            orient_type='GLOBAL',
+                                            snap=False,
+                                            use_automerge_and_split=use_auto_merge)
+
+            # Get the 2D position of the target for ui rendering
+            self.target2d = quicksnap_utils.transform_worldspace_coord2d(self.target, region,
+                                                                         context.space_data.region_3d)
+
+    def get_snap_target(self, context):
+        """
+        Returns the world space (origin, target) positions of the translation, taking constraints into account.
+        """
+        origin = self.snapdata_source.world_space[self.closest_source_id]
+
+        # If there is a target vert/point, use it and apply axis constraint if needed.
+        if self.closest_target_id >= 0:
+            target = self.snapdata_target.world_space[self.closest_target_id]
+            if len(self.snapping) == 0 or not self.snapping_local:
+                target = quicksnap_utils.get_axis_target(origin, target, self.snapping)
+            else:
+                target = quicksnap_utils.get_axis_target(origin,
+                                                         self.snapdata_target.world_space[self.closest_target_id],
+                                                         self.snapping,
+                                                         bpy.data.objects[self.selection_objects[0]])
+        # If there is no target, get the target on the place perpendicular to the camera,
+        # or closest to constrained axis.
+        else:
+            is_ortho = context.space_data.region_3d.view_perspective == 'ORTHO'
+            # The 3D location in this direction
+            if len(self.snapping) == 0 or not self.snapping_local:
+                target = quicksnap_utils.get_target_free(origin, self.mouse_position_world, self.mouse_vector,
+                                                         self.snapping, is_ortho=is_ortho)
+            else:
+                target = quicksnap_utils.get_target_free(origin, self.mouse_position_world, self.mouse_vector,
+                                                         self.snapping,
+                                                         bpy.data.objects[self.selection_objects[0]],
+                                                         is_ortho=is_ortho)
+        return origin, target
+
+    def refresh_vertex_data(self, context, region):
+        """
+        Re-Init the snapdata if the view camera moved. (Updates 2d positions of all points)
+        """
+        region3d = context.space_data.region_3d
+        if self.camera_position == region3d.view_matrix.inverted().translation \
+                and self.perspective_matrix == region3d.perspective_matrix \
+                and self.view_distance == region3d.view_distance \
+                and self.view_camera_zoom == region3d.view_camera_zoom:
+            return
+        logger.info("refresh data")
+        self.camera_position = region3d.view_matrix.inverted().translation
+        self.view_distance = region3d.view_distance
+        self.view_camera_zoom = region3d.view_camera_zoom
+        self.perspective_matrix = context.space_data.region_3d.perspective_matrix
+        self.perspective_matrix_inverse = self.perspective_matrix.inverted()
+        self.init_snap_data(context, region, self.current_state == State.IDLE, True)
+
+    def get_object_caches(self):
+        """
+        Returns the per object caches of the draw callbacks: {cache name: ObjectCache}
+        """
+        return {
+            'source_npdata': self.source_npdata,
+            'target_npdata': self.target_npdata,
+            'source_highlight_data': self.source_highlight_data,
+            'target_highlight_data': self.target_highlight_data,
+            'target_bounds': self.target_bounds,
+            'mesh_cache': self.mesh_cache,
+        }
+
+    def get_memory_usage(self):
+        """
+        Returns the bytes held by the snapdata and the draw caches, per structure and per object.
+        """
+        usage = {
+            'snapdata_source': self.snapdata_source.memory_usage(),
+            'snapdata_target': self.snapdata_target.memory_usage(),
+        }
+        for cache_name, cache in self.get_object_caches().items():
+            usage[cache_name] = cache.memory_usage()
+        return usage
+
+    def trim_object_caches(self, min_interval=0.5):
+        """
+        Keep the draw caches under the memory limit set in the preferences, evicting the least recently used objects
+        first. Sizes are measured at most once every {min_interval} seconds, the totals are kept in
+        self.snapdata_memory and self.cache_memory.
+        """
+        if time.perf_counter() - self.last_cache_trim_time < min_interval:
+            return
+        self.last_cache_trim_time = time.perf_counter()
+        # The highlights of the target/hovered objects are drawn from data cached on their first draw, the mesh arrays
+        # they were built from are not read again: keep them as recent as the highlights.
+        for object_name in (self.target_object, self.hover_object):
+            if object_name != "":
+                self.mesh_cache.touch_object(object_name)
+        total, evicted = quicksnap_utils.trim_object_caches(list(self.get_object_caches().values()),
+                                                            self.settings.cache_memory_limit * 1024 * 1024)
+        self.cache_memory = total
+        self.snapdata_memory = sum(quicksnap_utils.total_bytes(snapdata.memory_usage())
+                                   for snapdata in (self.snapdata_source, self.snapdata_target))
+        if evicted > 0:
+            logger.debug(f"Draw caches: evicted {evicted} objects - {total / (1024 * 1024):.2f}MB left")
+
+    def process_mouse_move(self, context, region, force=False):
+        """
+        Update the closest points and apply the translation for the latest coalesced mouse position.
+        If force is False, nothing is done until the coalescer lets the pending mouse position through.
+        Returns True if the mouse position was processed.
+        """
+        if not self.mouse_coalescer.should_process(force):
+            return False
+        mouse_position = self.mouse_coalescer.pop()
+        if mouse_position is not None:
+            self.mouse_position = mouse_position
+        self.update(context, region)
+        self.apply_if_needed(context, region)
+        return True
+
+    def get_apply_key(self, context):
+        """
+        Returns the inputs that fully define the translation done by apply(): source/target ids, constraint and
+        target position rounded to 5 decimals (for free targets).
+        Returns None if the result cannot be memoized.
+        """
+        if self.current_state != State.SOURCE_PICKED:
+            return (self.current_state,)
+        _, target = self.get_snap_target(context)
+        if target is None:
+            return None
+        return (self.current_state, self.closest_source_id, self.closest_target_id, self.snapping,
+                self.snapping_local, tuple(round(value, 5) for value in target))
+
+    def apply_if_needed(self, context, region):
+        """
+        Apply the translation, unless the inputs are the same as the last apply (no-op frames).
+        """
+        if self.mouse_coalescer.need_apply(self.get_apply_key(context)):
+            self.apply(context, region)
+
+    def handle_session_hotkey(self, context, region, event_type, shift=False):
+        """
+        Snap type (1/2/3/O), axis/plane constraint (X/Y/Z, Shift for the plane), target wireframe (W) and modifiers (M)
+        hotkeys. Returns True if event_type is one of them.
+        """
+        if event_type in snap_type_hotkeys:
+            self.set_snap_type(context, region, snap_type_hotkeys[event_type])
+        elif event_type in axis_hotkeys:
+            self.toggle_constraint(context, region, axis_hotkeys[event_type][int(shift)])
+        elif event_type == 'W':
+            self.settings.display_target_wireframe = not self.settings.display_target_wireframe
+            self.set_object_display(self.target_object, self.hover_object, self.target_object_is_root, force=True)
+        elif event_type == 'M':
+            self.settings.ignore_modifiers = not self.settings.ignore_modifiers
+
+            self.refresh_vertex_data(context, region)
+            self.set_object_display(self.target_object, self.hover_object, self.target_object_is_root, force=True)
+        else:
+            return False
+        return True
+
+    def set_snap_type(self, context, region, snap_type):
+        """
+        Snap from (before the source is picked) or to {snap_type} points.
+        """
+        if self.current_state == State.IDLE:
+            if self.settings.snap_source_type != snap_type:
+                self.settings.snap_source_type = snap_type
+                self.update_snap_types(context, region)
+        elif self.current_state == State.SOURCE_PICKED:
+            if self.settings.snap_target_type != snap_type:
+                self.settings.snap_target_type = snap_type
+                self.update_snap_types(context, region)
+
+    def toggle_constraint(self, context, region, new_snapping):
+        """
+        Constrain the translation on an axis/plane ('X', 'YZ'...). Pressing the same constraint again switches to the
+        local axis (single selected object), then removes the constraint.
+        """
+        if self.snapping == new_snapping:
+            if not self.snapping_local and len(self.selection_objects) == 1:
+                self.snapping_local = not self.snapping_local
+            else:
+                self.snapping_local = False
+                self.snapping = ""
+        else:
+            self.snapping = new_snapping
+        self.update(context, region)
+        self.apply_if_needed(context, region)
+
+    def update_snap_types(self, context, region):
+        """
+        Rebuild the snapdata whose snap type or modifiers setting changed.
+        Returns True if the snapdata of the current state (source or target) was rebuilt.
+        """
+        rebuilt = False
+        if self.settings.snap_source_type != self.snapdata_source.snap_type or \
+                self.ignore_modifiers != self.settings.ignore_modifiers:
+            self.init_snap_data(context, region, True, False)
+            rebuilt = rebuilt or self.current_state == State.IDLE
+        if self.settings.snap_target_type != self.snapdata_target.snap_type or \
+                self.ignore_modifiers != self.settings.ignore_modifiers:
+            self.init_snap_data(context, region, False, True)
+            rebuilt = rebuilt or self.current_state == State.SOURCE_PICKED
+        self.ignore_modifiers = self.settings.ignore_modifiers
+        self.update(context, region)
+        return rebuilt
+
+    def init_snap_data(self, context, region, revert_source, revert_target):
+        if not self.object_mode:  # The edited meshes may have changed since their arrays/bounds were cached.
+            self.mesh_cache.discard(self.selection_objects)
+            for object_name in self.selection_objects:
+                if object_name in self.target_bounds:
+                    del self.target_bounds[object_name]
+        self.scene_objects.update_selection(self.selection_objects)
+        if revert_source:
+            self.snapdata_source.__init__(context, region, self.settings, self.selection_objects,
+                                          self.scene_objects.get_scene_objects(False), is_origin=True,
+                                          no_selection=self.no_selection, mesh_cache=self.mesh_cache,
+                                          hierarchy=self.hierarchy)
+
+            self.closest_actionable = False
+            self.closest_source_id = -1
+
+            self.source_highlight_data.clear()
+            self.source_npdata.clear()
+        if revert_target:
+            self.snapdata_target.is_enabled = False
+            self.snapdata_target.__init__(context, region, self.settings, self.selection_objects,
+                                          self.scene_objects.get_scene_objects(True),
+                                          mesh_cache=self.mesh_cache, hierarchy=self.hierarchy)
+        self.target_highlight_data.clear()
+        self.target_npdata.clear()
+        self.target_face_index = -1
+        self.closest_target_id = -1
+        self.closest_vertexid = -1
+        self.mouse_coalescer.reset_apply()
@@ -90,4 +90,16 @@ def draw_polygon_smooth_blend_versionized(points, indices, color, depth_test):
 
     gpu.state.blend_set("NONE")
     if depth_test:
-        gpu.state.depth_test_set("NONE")
\ No newline at end of file
+        gpu.state.depth_test_set("NONE")
+
+
+shader_3d_lines_smooth_color = shader_3d_polyline_smooth_color
+
+
+def bind_lines_smooth_color_versionized(line_width):
+    """
+        Bind the smooth color line shader (per vertex colors) and set the line width.
+    """
+    shader_3d_polyline_smooth_color.bind()
+    shader_3d_polyline_smooth_color.uniform_float("viewportSize", gpu.state.viewport_get()[2:])
+    shader_3d_polyline_smooth_color.uniform_float("lineWidth", line_width)
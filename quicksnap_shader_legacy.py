@@ -71,3 +71,13 @@ def draw_polygon_smooth_blend_versionized(points, indices, color, depth_test):
     if depth_test:
         gpu.state.depth_test_set("NONE")
 
+
+shader_3d_lines_smooth_color = shader_3d_smooth_color
+
+
+def bind_lines_smooth_color_versionized(line_width):
+    """
+        Bind the smooth color line shader (per vertex colors) and set the line width.
+    """
+    gpu.state.line_width_set(line_width)
+    shader_3d_smooth_color.bind()
@@ -5,6 +5,9 @@ import logging
 import mathutils
 from mathutils import Vector
 from bpy_extras import view3d_utils
+from . import quicksnap_engine
+from . import quicksnap_meshdata
+from . import quicksnap_profiling
 from . import quicksnap_utils
 
 __name_addon__ = '.'.join(__name__.split('.')[:-1])
@@ -12,22 +15,26 @@ logger = logging.getLogger(__name_addon__)
 
 
 def time_it(func):
+    """
+    Log the duration of each call of the decorated function. See quicksnap_profiling for aggregated timers.
+    """
     def wrapper(*arg, **kw):
-        t1 = time.time()
-        for i in range(20):
-            func(*arg, **kw)
-        t2 = time.time()
-        logger.debug(func.__name__, (t2 - t1))
+        t1 = time.perf_counter()
+        result = func(*arg, **kw)
+        t2 = time.perf_counter()
+        logger.debug(f"{func.__name__}: {(t2 - t1) * 1000:.3f}ms")
+        return result
 
     return wrapper
 
 
-class ObjectPointData:
+class ObjectPointData(quicksnap_engine.ObjectPoints):
     """    Contains the world space/screen space/counts of one object in the scene.  """
 
+    @quicksnap_profiling.timed('object_point_data')
     def __init__(self, obj, object_id, perspective_matrix, width, height, width_half, height_half, view_location,
                  check_select=False,
-                 filter_selected=True, snap_type='POINTS'):
+                 filter_selected=True, snap_type='POINTS', mesh_data=None, depsgraph=None):
         """Initialize the ObjectPointData, calculates WorldSpace/ScreenSpace coordinates from local space coordinates
 
         Args:
@@ -38,25 +45,25 @@ class ObjectPointData:
             view_location: world space position of the camera
             check_select: If true filter points base on point selection
             filter_selected: If true includes only selected points, if false include only un-selected points
+            mesh_data: MeshData of the object mesh (see quicksnap_meshdata), defaults to the mesh without modifiers
+            depsgraph: depsgraph used to evaluate the mesh of mesh_data, if its arrays were not extracted yet
         """
-        self.completed = False
         # logger.debug(f"ObjectPointData {obj.name}- check_select={check_select} - filter_selected={filter_selected}")
         matrix_world = obj.matrix_world
-        self.is_curve = obj.type == 'CURVE' and snap_type == 'POINTS'
+        viewport = quicksnap_engine.Viewport(perspective_matrix, width, height)
+        is_curve = obj.type == 'CURVE' and snap_type == 'POINTS'
         # Gather object space points coordinates from the mesh/curves data
         if obj.type == 'MESH':
+            if mesh_data is None:
+                mesh_data = quicksnap_meshdata.MeshData(obj.name, evaluated=False)
             if snap_type == 'POINTS':
-                vertices = obj.data.vertices
-                max_count = len(vertices)
-                shape = (max_count, 3)
                 # Copy verts co points
-                points_object_space = np.empty(max_count * 3, dtype=np.float64)
-                vertices.foreach_get('co', points_object_space)
-                points_object_space.shape = shape
+                points_object_space = mesh_data.get('verts_co', depsgraph)
+                max_count = len(points_object_space)
                 self.indices = np.arange(max_count)
                 if check_select:
                     selected_mask = np.empty(max_count, dtype=bool)
-                    vertices.foreach_get('select', selected_mask)
+                    obj.data.vertices.foreach_get('select', selected_mask)
                     if filter_selected:
                         points_object_space = points_object_space[selected_mask]
                         self.indices = self.indices[selected_mask]
@@ -66,20 +73,12 @@ class ObjectPointData:
 
             elif snap_type == 'MIDPOINTS':
                 # Get verts
-                vertices = obj.data.vertices
-                verts_count = len(vertices)
-                shape = (verts_count, 3)
-                verts_object_space = np.empty(verts_count * 3, dtype=np.float64)
-                vertices.foreach_get('co', verts_object_space)
-                verts_object_space.shape = shape
+                verts_object_space = mesh_data.get('verts_co', depsgraph)
+                verts_count = len(verts_object_space)
 
                 # Get edges verts id
-                edges = obj.data.edges
-                edge_count = len(edges)
-                edges_vertid_shape = (edge_count, 2)
-                edges_vertid = np.zeros((edge_count * 2), dtype=int)  # [0.0, 0.0] * len(mesh.edges)
-                edges.foreach_get('vertices', edges_vertid)
-                edges_vertid.shape = edges_vertid_shape
+                edges_vertid = mesh_data.get('edge_verts', depsgraph)
+                edge_count = len(edges_vertid)
                 # Get edges center points
                 points_object_space = (verts_object_space[edges_vertid[:, 0]] + verts_object_space[
                     edges_vertid[:, 1]]) / 2
@@ -87,7 +86,7 @@ class ObjectPointData:
                 if check_select:
                     # filter out selected/unselected
                     selected_vert_mask = np.empty(verts_count, dtype=bool)
-                    vertices.foreach_get('select', selected_vert_mask)
+                    obj.data.vertices.foreach_get('select', selected_vert_mask)
 
                     if filter_selected:
                         # Filter edges where both edges are selected
@@ -101,29 +100,17 @@ class ObjectPointData:
                         self.indices = self.indices[~selected_mask]
 
             elif snap_type == 'FACES':
-                polygons = obj.data.polygons
-                polygons_count = len(polygons)
-                points_object_space = np.empty(polygons_count * 3, dtype=np.float64)
-                polygons.foreach_get('center', points_object_space)
-                points_object_space.shape = (polygons_count, 3)
+                points_object_space = mesh_data.get('polygon_centers', depsgraph)
+                polygons_count = len(points_object_space)
                 self.indices = np.arange(polygons_count)
-                if check_select:
+                if check_select and polygons_count > 0:
                     # get verts to find selected verts
-                    vertices = obj.data.vertices
-                    verts_count = len(vertices)
-                    verts_selected = np.empty(verts_count, dtype=bool)
-                    vertices.foreach_get('select', verts_selected)
+                    verts_selected = np.empty(mesh_data.vertex_count, dtype=bool)
+                    obj.data.vertices.foreach_get('select', verts_selected)
 
                     # get face verts
-                    polygon_vert_count = np.empty(polygons_count, dtype=int)
-                    polygons.foreach_get('loop_total', polygon_vert_count)
-
-                    polygon_vert_start_index = np.concatenate(
-                        [np.zeros(1, dtype=int), np.cumsum(polygon_vert_count[1:])])
-
-                    polygon_verts = np.empty(np.sum(polygon_vert_count), dtype=int)
-                    polygons.foreach_get('vertices', polygon_verts)
-                    selected_polygon_verts = verts_selected[polygon_verts]
+                    polygon_vert_start_index = mesh_data.get('polygon_loop_start', depsgraph)
+                    selected_polygon_verts = verts_selected[mesh_data.get('loop_verts', depsgraph)]
 
                     if filter_selected:
                         # Filter polygons where all verts are selected
@@ -136,7 +123,7 @@ class ObjectPointData:
                         points_object_space = points_object_space[~selected_mask]
                         self.indices = self.indices[~selected_mask]
 
-        elif self.is_curve:
+        elif is_curve:
             all_points = quicksnap_utils.flatten(
                 [[(point.co, point_index, spline_index) for point_index, point in enumerate(spline.bezier_points)] for spline_index, spline in enumerate(obj.data.splines)])
             all_points.extend(quicksnap_utils.flatten([[(Vector((point.co[0], point.co[1], point.co[2])), point_index, spline_index)
@@ -171,41 +158,13 @@ class ObjectPointData:
                     self.indices = self.indices[~selected_mask]
                     self.spline_index = self.spline_index[~selected_mask]
         else:
+            super().__init__(np.empty((0, 3)), matrix_world, viewport, np.empty(0, dtype=int), object_id)
             self.completed = True
             return
 
-        # Get WorldSpace
-        world_space_co = np.ones(shape=(len(points_object_space), 4), dtype=np.float64)
-        world_space_co[:, :-1] = points_object_space  # cos v (x,y,z,1) - point,   v(x,y,z,0)- vector
-        world_space_co = np.einsum('ij,aj->ai', matrix_world, world_space_co)
-        self.world_space_co = world_space_co[:, :-1]
-
-        # Get ViewSpace
-        verts_viewspace = np.einsum('ij,aj->ai', perspective_matrix, world_space_co)  # Matrix mult
-        filter_behind_camera = (verts_viewspace[:, 3] > 0)
-        verts_viewspace = verts_viewspace[filter_behind_camera]  # Filtering behind camera
-        self.world_space_co = self.world_space_co[filter_behind_camera]
-        self.indices = self.indices[filter_behind_camera]
-        if self.is_curve:
-            self.spline_index = self.spline_index[filter_behind_camera]
-
-        # Get 2dScreenSpace
-        self.screen_space_co = np.column_stack(
-            (width_half + (verts_viewspace[:, 0] / verts_viewspace[:, 3]) * width_half,
-             height_half + (verts_viewspace[:, 1] / verts_viewspace[:, 3]) * height_half,
-             verts_viewspace[:, 3]))
-        filter_outside_viewport = (self.screen_space_co[:, 0] > 0) & (self.screen_space_co[:, 1] > 0) & (
-                self.screen_space_co[:, 0] < width) & (self.screen_space_co[:, 1] < height)
-        self.screen_space_co = self.screen_space_co[filter_outside_viewport]
-        self.world_space_co = self.world_space_co[filter_outside_viewport]
-        self.indices = self.indices[filter_outside_viewport]
-        if self.is_curve:
-            self.spline_index = self.spline_index[filter_outside_viewport]
-        self.count = len(self.screen_space_co)
-
-        # Misc
-        self.object_id = object_id
-        self.processed_point_count = 0
+        # Get WorldSpace/2dScreenSpace, filter points behind the camera and outside the viewport
+        super().__init__(points_object_space, matrix_world, viewport, self.indices, object_id,
+                         spline_index=self.spline_index if is_curve else None)
 
 
 class SnapData:
@@ -214,8 +173,16 @@ class SnapData:
     """
 
     def __init__(self, context, region, settings, selected_meshes, scene_meshes=None, is_origin=False,
-                 no_selection=False):
+                 no_selection=False, mesh_cache=None, hierarchy=None):
+        """
+        mesh_cache: MeshDataCache of the session, shared by the snapdata and the draw callbacks. A new cache is used
+        if None.
+        hierarchy: HierarchyIndex of the session, used to skip the children of the selection. Built from the scene
+        objects if None.
+        """
         self.no_selection = no_selection
+        self.mesh_cache = mesh_cache if mesh_cache is not None else quicksnap_meshdata.MeshDataCache()
+        self.hierarchy = hierarchy if hierarchy is not None else quicksnap_utils.HierarchyIndex()
         self.settings = settings
         self.is_origin_snapdata = is_origin
         self.object_mode = context.active_object is None or context.active_object.mode == 'OBJECT'
@@ -247,28 +214,37 @@ class SnapData:
         self.selected_ids = {}
         self.objects_point_data = {}
         self.origins_map = {}
-        self.snap_origins = quicksnap_utils.get_addon_settings().snap_objects_origin
-
-        # Initialize kdtrees-target points nparray with correct size
-        max_vertex_count = self.get_max_vertex_count(context, selected_meshes, scene_meshes)
-        self.kd = mathutils.kdtree.KDTree(max_vertex_count)
-        self.world_space = np.empty((max_vertex_count, 3), dtype=np.float64)
-        self.region_2d = np.empty((max_vertex_count, 3), dtype=np.float64)
-        self.depth = np.empty(max_vertex_count, dtype=np.float64)
-        self.indices = np.empty(max_vertex_count, dtype=int)
-        self.spline_index = np.empty(max_vertex_count, dtype=int)
-        self.object_id = np.empty(max_vertex_count, dtype=int)
-        self.added_points_np = 0
+        # Per object masks of the mesh element indices added to the points arrays.
+        self.allowed_masks = {}
+        # Value of allowed_masks_version when the mask of each object last changed.
+        self.allowed_masks_version = 0
+        self.allowed_mask_versions = {}
+        self.snap_origins = settings.snap_objects_origin
+
+        # Objects snapped on their base mesh although modifiers are not ignored (evaluated mesh not read yet, or too
+        # many vertices), and (object name, is selected) of the objects waiting for their evaluated points.
+        self.base_mesh_objects = set()
+        self.to_evaluate = []
+        # Objects whose evaluated mesh was read: their points no longer need to be deferred.
+        self.evaluated_objects = set()
 
         # figure out origin count
         if not self.is_origin_snapdata or self.no_selection:  # Add all scene origins
             self.scene_meshes = scene_meshes.copy()
             self.scene_meshes.extend(selected_meshes.copy())
-            self.kd_origins = mathutils.kdtree.KDTree(len(self.scene_meshes))
-            self.add_scene_roots(context, selected_meshes, scene_meshes)
         else:   # Add selection origins
             self.scene_meshes = selected_meshes.copy()
-            self.kd_origins = mathutils.kdtree.KDTree(len(selected_meshes))
+
+        # Points arrays, kdtrees and closest point queries of the engine, initialized with the max points count. Arrays
+        # grow if more points are added, points of swapped objects are flagged in the invalid mask.
+        max_vertex_count = self.get_max_vertex_count(context, selected_meshes, scene_meshes)
+        viewport = quicksnap_engine.Viewport(self.perspective_matrix, self.width, self.height)
+        self.engine = quicksnap_engine.SnapEngine(viewport, max_vertex_count, len(self.scene_meshes),
+                                                  kdtree_type=mathutils.kdtree.KDTree,
+                                                  origins_in_kd=self.snap_origins == "ALWAYS")
+        if not self.is_origin_snapdata or self.no_selection:
+            self.add_scene_roots(context, selected_meshes, scene_meshes)
+        else:
             self.add_scene_roots(context, selected_meshes)
 
         self.meshes_selection = selected_meshes
@@ -277,7 +253,7 @@ class SnapData:
         if self.snap_type != 'ORIGINS':
             # Add initial objects for target destination.
             if not self.is_origin_snapdata or (self.no_selection and self.object_mode):  # Add scene + selection
-                selected_objs = [bpy.data.objects[obj] for obj in selected_meshes]
+                selection_descendants = self.hierarchy.get_descendants(selected_meshes)
                 # If Snapdata contains target points and we are in edit mode, add all selected meshes to
                 # target objects lists (for snapping to unselected verts).
                 if not self.object_mode:
@@ -287,7 +263,7 @@ class SnapData:
                 # Add meshes that do not have polygons. (cannot be found via ray-cast)
                 for object_name in scene_meshes:
                     obj = bpy.data.objects[object_name]
-                    if self.object_mode and quicksnap_utils.has_parent(obj, selected_objs):  # Do not add child objs
+                    if self.object_mode and object_name in selection_descendants:  # Do not add child objs
                         if obj.name not in self.processed:
                             self.processed.add(obj.name)
                         continue
@@ -334,23 +310,14 @@ class SnapData:
                 # logger.debug(f"add_object_data:{object_name} - First add - is origin:{self.is_origin_snapdata}")
                 if self.is_origin_snapdata:
                     current_mode = quicksnap_utils.set_object_mode_if_needed()
-                if self.object_mode and not self.settings.ignore_modifiers:
-                    obj = bpy.data.objects[object_name].evaluated_get(depsgraph)
-                else:
-                    obj = bpy.data.objects[object_name]
-                self.objects_point_data[object_name] = ObjectPointData(obj,
-                                                                       self.scene_meshes.index(object_name),
-                                                                       self.perspective_matrix,
-                                                                       width=self.width,
-                                                                       height=self.height,
-                                                                       width_half=self.width_half,
-                                                                       height_half=self.height_half,
-                                                                       view_location=self.view_location,
-                                                                       check_select=not self.object_mode and not self.no_selection,
-                                                                       filter_selected=self.is_origin_snapdata,
-                                                                       snap_type=self.snap_type)
+                evaluated = self.object_mode and not self.settings.ignore_modifiers
+                self.objects_point_data[object_name] = self.create_point_data(
+                    object_name, self.scene_meshes.index(object_name), evaluated, depsgraph, is_selected=True,
+                    check_select=not self.object_mode and not self.no_selection,
+                    filter_selected=self.is_origin_snapdata)
 
                 self.to_process_selected.insert(0, object_name)
+                self.keep_processing = True
                 if self.is_origin_snapdata:
                     quicksnap_utils.revert_mode(current_mode)
                     self.selected_ids[object_name] = []
@@ -365,26 +332,152 @@ class SnapData:
             # Add object in the list if it is not already
             else:
                 # logger.debug(f"Addmesh:{object_name} -  FIRST ADD Scene")
-                if self.settings.ignore_modifiers:
-                    obj = bpy.data.objects[object_name]
-                else:
-                    obj = bpy.data.objects[object_name].evaluated_get(depsgraph)
-
                 if object_name not in self.scene_meshes:
                     object_index = -1
                 else:
                     object_index = self.scene_meshes.index(object_name)
-                self.objects_point_data[object_name] = ObjectPointData(obj,
-                                                                       object_index,
-                                                                       self.perspective_matrix,
-                                                                       width=self.width,
-                                                                       height=self.height,
-                                                                       width_half=self.width_half,
-                                                                       height_half=self.height_half,
-                                                                       view_location=self.view_location,
-                                                                       snap_type=self.snap_type)
+                self.objects_point_data[object_name] = self.create_point_data(
+                    object_name, object_index, not self.settings.ignore_modifiers, depsgraph)
                 # logger.debug(f"Adding to target verts data scene:{object_name}")
                 self.to_process_scene.append(object_name)
+                self.keep_processing = True
+
+    def create_point_data(self, object_name, object_index, evaluated, depsgraph, is_selected=False,
+                          check_select=False, filter_selected=True):
+        """
+        Returns the ObjectPointData of an object, from its evaluated mesh if {evaluated} and if choose_mesh allows it.
+        Objects that fall back to their base mesh are added to base_mesh_objects, and to to_evaluate if their
+        evaluated mesh is only deferred.
+        """
+        use_evaluated, deferred = self.choose_mesh(object_name, evaluated, depsgraph)
+        if evaluated and not use_evaluated:
+            self.base_mesh_objects.add(object_name)
+            if deferred:
+                self.to_evaluate.append((object_name, is_selected))
+        if use_evaluated:
+            obj = bpy.data.objects[object_name].evaluated_get(depsgraph)
+        else:
+            obj = bpy.data.objects[object_name]
+        return ObjectPointData(obj,
+                               object_index,
+                               self.perspective_matrix,
+                               width=self.width,
+                               height=self.height,
+                               width_half=self.width_half,
+                               height_half=self.height_half,
+                               view_location=self.view_location,
+                               check_select=check_select,
+                               filter_selected=filter_selected,
+                               snap_type=self.snap_type,
+                               mesh_data=self.get_mesh_data(object_name, use_evaluated, depsgraph),
+                               depsgraph=depsgraph)
+
+    def choose_mesh(self, object_name, evaluated, depsgraph):
+        """
+        Returns (evaluated, deferred) for an object whose points are requested from its evaluated mesh or not:
+        - In progressive mode, an object with modifiers whose evaluated mesh was never read uses its base mesh and
+          deferred is True: its evaluated points are swapped in later (see evaluate_next_object).
+        - An object whose evaluated mesh has more vertices than the limit set in the preferences uses its base mesh.
+        """
+        obj = bpy.data.objects[object_name]
+        if not evaluated or obj.type != 'MESH' or len(obj.modifiers) == 0:
+            return evaluated, False
+        if self.settings.progressive_modifiers and object_name not in self.evaluated_objects:
+            return False, True
+        return not self.exceeds_vertex_limit(object_name, depsgraph), False
+
+    def exceeds_vertex_limit(self, object_name, depsgraph):
+        vertex_limit = self.settings.evaluated_vertex_limit
+        return vertex_limit > 0 and \
+            self.get_mesh_data(object_name, True, depsgraph).vertex_count > vertex_limit
+
+    def get_mesh_data(self, object_name, evaluated, depsgraph):
+        """
+        Returns the MeshData of a mesh object from the session cache, None for other object types.
+        """
+        if bpy.data.objects[object_name].type != 'MESH':
+            return None
+        if evaluated:
+            self.evaluated_objects.add(object_name)
+        return self.mesh_cache.get_mesh_data(object_name, evaluated, depsgraph)
+
+    def evaluate_next_object(self, depsgraph):
+        """
+        Run one step of the evaluation of the first object of to_evaluate:
+        - If its evaluated mesh was never read, read it. The points are swapped on the next call.
+        - Otherwise swap its base mesh points with the evaluated ones: the base mesh points are invalidated and the new
+          points are queued for processing.
+        The object keeps its base mesh points if its evaluated mesh has too many vertices.
+        """
+        object_name, is_selected = self.to_evaluate[0]
+        if object_name not in bpy.data.objects or object_name not in self.objects_point_data or \
+                object_name not in self.base_mesh_objects:
+            self.to_evaluate.pop(0)
+            return
+        if object_name not in self.evaluated_objects:
+            self.get_mesh_data(object_name, True, depsgraph)
+            return
+        self.to_evaluate.pop(0)
+        if self.exceeds_vertex_limit(object_name, depsgraph):
+            logger.info(f"{object_name}: evaluated mesh above the vertex limit, modifiers are ignored")
+            return
+        base_points_data = self.objects_point_data[object_name]
+        for to_process in (self.to_process_selected, self.to_process_scene):
+            if object_name in to_process:
+                to_process.remove(object_name)
+        self.invalidate_points(base_points_data)
+        self.base_mesh_objects.discard(object_name)
+        if self.allowed_masks.pop(object_name, None) is not None:
+            self.allowed_masks_version += 1
+            self.allowed_mask_versions[object_name] = self.allowed_masks_version
+        self.objects_point_data[object_name] = self.create_point_data(object_name, base_points_data.object_id, True,
+                                                                      depsgraph, is_selected=is_selected)
+        self.processed.discard(object_name)
+        if is_selected:
+            self.to_process_selected.insert(0, object_name)
+        else:
+            self.to_process_scene.append(object_name)
+        self.keep_processing = True
+        logger.debug(f"{object_name}: evaluated mesh swapped in")
+
+    # Points arrays of the engine, read by the session and the draw callbacks.
+    @property
+    def world_space(self):
+        return self.engine.world_space
+
+    @property
+    def indices(self):
+        return self.engine.indices
+
+    @property
+    def spline_index(self):
+        return self.engine.spline_index
+
+    @property
+    def object_id(self):
+        return self.engine.object_id
+
+    @property
+    def invalid(self):
+        return self.engine.invalid
+
+    @property
+    def added_points_np(self):
+        return self.engine.added_points_np
+
+    @property
+    def origins_map(self):
+        return self.engine.origins_map
+
+    @property
+    def points_version(self):
+        return self.engine.points_version
+
+    def invalidate_points(self, points_data):
+        """
+        Flag the points of an object already copied into the points arrays as invalid: find_closest ignores them.
+        """
+        self.engine.invalidate(points_data)
 
     def add_scene_roots(self, context, selected_meshes, scene_meshes=None):
         """
@@ -413,10 +506,11 @@ class SnapData:
                 add_roots.extend(selected_meshes)
                 add_roots = set(add_roots)
             else:
-                selected_objs = [bpy.data.objects[obj_name] for obj_name in selected_meshes]
+                selected_names = set(selected_meshes)
+                selection_descendants = self.hierarchy.get_descendants(selected_names)
                 add_roots = [object_name for object_name in scene_meshes if
-                             object_name not in selected_meshes and
-                             not quicksnap_utils.has_parent(bpy.data.objects[object_name], selected_objs)]
+                             object_name not in selected_names and
+                             object_name not in selection_descendants]
             # logger.debug(f"add_scene_roots: {len(add_roots)}")
             for object_name in add_roots:
                 if object_name == current_camera:
@@ -427,22 +521,19 @@ class SnapData:
             # Add cursor location
             self.add_point(context, bpy.context.scene.cursor.location, mathutils.Matrix.Identity(4), object_index=-1)
 
-        self.kd.balance()
-        self.kd_origins.balance()
+        self.engine.balance_tree()
+        self.engine.balance_origins()
 
     def add_object_root(self, context, object_name):
         """
         Add single object origin to points list and to origins kdtree
         """
         logger.debug(f"[origin:{self.is_origin_snapdata}] - Add object root: {object_name}")
-        if not self.add_point(context, Vector((0, 0, 0)), bpy.data.objects[object_name].matrix_world,
-                              self.scene_meshes.index(object_name), add_to_kd=self.snap_origins == "ALWAYS"):
+        world_co = bpy.data.objects[object_name].matrix_world.translation
+        if not self.in_camera_view(context, world_co):
             return
-        insert_index = self.added_points_np - 1
+        insert_index = self.engine.add_origin(world_co, self.scene_meshes.index(object_name), object_name)
         logger.debug(f"[origin:{self.is_origin_snapdata}] - add_object_root: {object_name} - insert index={insert_index}")
-        self.origins_map[insert_index] = object_name
-        self.kd_origins.insert(Vector((self.region_2d[insert_index][0], self.region_2d[insert_index][1], 0)),
-                               insert_index)
 
     def add_point(self, context, vertex_co, world_space_matrix, object_index, add_to_kd=True):
         """
@@ -450,40 +541,24 @@ class SnapData:
         It is too slow to process large amount of points use ObjectPointData instead.
         """
         ws = world_space_matrix @ vertex_co
-        ws_2 = Vector((ws[0], ws[1], ws[2], 1))
-        view_space_projection = self.perspective_matrix @ ws_2
-
-        if view_space_projection.w <= 0:  # Skip behind camera
+        if not self.in_camera_view(context, ws):
             return False
+        return self.engine.add_point(ws, object_index, add_to_kd) >= 0
 
+    def in_camera_view(self, context, world_co):
+        """
+        Returns False if the point is behind an orthographic camera, the engine only filters the points behind the
+        view.
+        """
         region3d = context.space_data.region_3d
         if region3d.view_perspective == 'CAMERA' and not region3d.is_perspective:
             rotation = view3d_utils.region_2d_to_vector_3d(context.region, region3d, (0, 0)).normalized()
             view_location = context.space_data.camera.location
-            cam_to_point_vector = (ws - view_location).normalized()
+            cam_to_point_vector = (world_co - view_location).normalized()
             dot = cam_to_point_vector.dot(rotation)
             if dot < 0: #behing camera in ortho camera
                 print(f"dot: {dot} - behind camera")
                 return False
-
-
-        coord_2d = quicksnap_utils.transform_viewspace_coord2d(view_space_projection, self.width_half, self.height_half)
-
-        # Skip out of view
-        if coord_2d.x <= 0 or coord_2d.y <= 0 or coord_2d.x >= self.width or coord_2d.y >= self.height:
-            return False
-
-        # Point/Vert is in camera frustum, store world/view position.
-        current_index = self.added_points_np
-        # logger.debug(f"inserting point in tree at index: {current_index}")
-        self.world_space[current_index] = ws
-        self.region_2d[current_index] = (coord_2d[0], coord_2d[1], view_space_projection.w * 0.00000001)
-        self.indices[current_index] = -1
-        self.object_id[current_index] = object_index
-        if add_to_kd:
-            self.kd.insert(self.region_2d[current_index], current_index)
-        self.added_points_np += 1
-
         return True
 
     def process_points_data_batch(self, object_name, batch_size=500):
@@ -492,47 +567,68 @@ class SnapData:
         Updates snapdata completed status
         """
         points_data = self.objects_point_data[object_name]
-        # Get start/end indices of points we want to insert.
-        start_index = points_data.processed_point_count
-        end_index = min(start_index + batch_size - 1, len(points_data.screen_space_co) - 1) + 1
-        insert_count = end_index - start_index
-        # Get start/end indices in the array get are copying them into.
-        start_insert = self.added_points_np
-        end_insert = start_insert + insert_count
-        logger.debug(f"Process batch [{object_name}] - batch_size={batch_size} - insert_count={insert_count} - "
-                     f"start_index={start_index} - end_index={end_index} - start_insert={start_insert} - "
-                     f"end_insert={end_insert} - len world_space={len(self.world_space)} ")
-
-        # Copy points to target points arrays.
-        self.world_space[start_insert:end_insert] = points_data.world_space_co[start_index:end_index]
-        self.region_2d[start_insert:end_insert] = points_data.screen_space_co[start_index:end_index]
-        self.region_2d[start_insert:end_insert, 2] = points_data.screen_space_co[start_index:end_index, 2] * 0.00000001
-        self.depth[start_insert:end_insert] = points_data.screen_space_co[start_index:end_index, 2]
-        self.object_id[start_insert:end_insert] = np.full(insert_count, points_data.object_id, dtype=int)
-        self.indices[start_insert:end_insert] = points_data.indices[start_index:end_index]
-        if points_data.is_curve:
-            self.spline_index[start_insert:end_insert] = points_data.spline_index[start_index:end_index]
-        else:
-            self.spline_index[start_insert:end_insert] = -1
+        logger.debug(f"Process batch [{object_name}] - batch_size={batch_size} - "
+                     f"start_index={points_data.processed_point_count} - start_insert={self.added_points_np} - "
+                     f"len world_space={len(self.world_space)} ")
+        self.update_allowed_mask(object_name, self.engine.ingest(points_data, batch_size))
 
-        # Update count of processed points and check if we are done with the current object.
-        self.added_points_np += insert_count
-        points_data.processed_point_count = end_index
-        if points_data.processed_point_count == points_data.count:
-            points_data.completed = True
+    def update_allowed_mask(self, object_name, indices):
+        """
+        Flag the mesh element indices (vertex/edge/face) of the object added to the points arrays.
+        """
+        indices = indices[indices >= 0]
+        if len(indices) == 0:
+            return
+        mask = self.allowed_masks.get(object_name)
+        mask_size = indices.max() + 1
+        if mask is None or len(mask) < mask_size:
+            if mask is not None:
+                mask_size = max(mask_size, len(mask) * 2)
+            new_mask = np.zeros(mask_size, dtype=bool)
+            if mask is not None:
+                new_mask[:len(mask)] = mask
+            mask = new_mask
+            self.allowed_masks[object_name] = mask
+        mask[indices] = True
+        self.allowed_masks_version += 1
+        self.allowed_mask_versions[object_name] = self.allowed_masks_version
+
+    def get_allowed_mask(self, object_name):
+        """
+        Returns the mask of the mesh element indices of the object currently in the points arrays.
+        Test it with quicksnap_geometry.in_mask.
+        """
+        mask = self.allowed_masks.get(object_name)
+        if mask is None:
+            return np.zeros(0, dtype=bool)
+        return mask
+
+    def get_allowed_mask_version(self, object_name):
+        """
+        Returns a number that changes each time the allowed mask of the object changes.
+        """
+        return self.allowed_mask_versions.get(object_name, 0)
+
+    def memory_usage(self):
+        """
+        Returns the bytes held by the SnapData:
+            {'points': points arrays, 'allowed_masks': allowed masks,
+             'objects': {object name: points arrays of the objects not fully processed yet}}
+        """
+        return {
+            'points': self.engine.memory_usage(),
+            'allowed_masks': sum(mask.nbytes for mask in self.allowed_masks.values()),
+            'objects': {object_name: points_data.nbytes() for object_name, points_data in
+                        self.objects_point_data.items() if not points_data.completed},
+        }
 
     def balance_tree(self, start_index=None, end_index=None):
         """
-        Adds stored points from start_index to end_index into the kdtrees, then balance the trees
-        If is not set, only balance the trees.
+        Adds stored points from start_index to end_index into the kdtree, then balance it (see SnapEngine.balance_tree)
         """
-        logger.debug(f"balance_tree - Source:{self.is_origin_snapdata}")
-        if start_index is not None and end_index is not None:
-            logger.debug(f"balance_tree - start_index:{start_index} - end_index:{end_index}")
-            insert = self.kd.insert
-            for i in range(start_index, end_index):
-                insert(self.region_2d[i], i)
-        self.kd.balance()
+        logger.debug(f"balance_tree - Source:{self.is_origin_snapdata} - start_index:{start_index} - "
+                     f"end_index:{end_index}")
+        self.engine.balance_tree(start_index, end_index)
 
     def process_iteration(self, context, max_run_duration=0.01):
         """
@@ -569,7 +665,8 @@ class SnapData:
         # If origin snapdata, stop iterating if all src obj are processed, otherwise ignore scene objects and return
         if self.is_origin_snapdata and not (self.no_selection and self.object_mode):
             if len(self.to_process_selected) == 0:
-                self.keep_processing = False
+                self.process_pending_evaluation(context, start_time, max_run_duration)
+                self.keep_processing = len(self.to_process_selected) > 0 or len(self.to_evaluate) > 0
                 return False
             return False
 
@@ -602,69 +699,35 @@ class SnapData:
             for selected_object in self.meshes_selection:
                 bpy.data.objects[selected_object].hide_set(False)
                 bpy.data.objects[selected_object].select_set(True)
+
+        # Nothing left to process until new objects are added (see add_object_data)
+        if len(self.to_process_scene) == 0 and len(self.to_process_selected) == 0:
+            self.process_pending_evaluation(context, start_time, max_run_duration)
+            self.keep_processing = len(self.to_process_scene) > 0 or len(self.to_process_selected) > 0 or \
+                len(self.to_evaluate) > 0
         return False
 
+    def process_pending_evaluation(self, context, start_time, max_run_duration):
+        """
+        Run one evaluation step (see evaluate_next_object) if the iteration used less than half of its time.
+        Only done once all queued points are processed, so that the base mesh points are available first.
+        """
+        if len(self.to_evaluate) == 0 or time.perf_counter() - start_time > max_run_duration / 2:
+            return
+        self.evaluate_next_object(context.evaluated_depsgraph_get())
+
     def find_closest(self, mouse_coord_screen_flat, search_origins_only=False):
         """
         Returns the closest point to mouse cursor amongst SnapData's points
         returns tuple:
-         (Closest point ID, closest point distance to mouse, target object name, bool: is the point an object origin)
+         (Closest point ID, closest point distance to mouse, target object name, bool: is the point an object origin,
+          mesh element index)
         """
-
-        if not len(self.region_2d) > 0:
+        closest = self.engine.find_closest(mouse_coord_screen_flat, search_origins_only)
+        if closest is None:
             return None
-        closest_point_data = None
-        close_points = []
-
-        if search_origins_only:
-            points = self.kd_origins.find_n(mouse_coord_screen_flat, 1)
-            for (co, index, dist) in points:
-                if dist > 40:
-                    break
-                origin = self.world_space[index]
-                close_points.append((origin, index, dist, dist, -1))
-                break
-
-        else:
-            # Search all points
-            search_distance = 20  # Radius in pixels around the mouse position
-            points_found = self.kd.find_range(mouse_coord_screen_flat, search_distance)
-            if len(points_found) > 0:
-                points_array = np.array(points_found, dtype=object)
-
-                # normalize distance
-                dist = points_array[:, 2] / search_distance
-
-                # Convert <Vector> array into <float, float,float> array.
-                depth = np.array([x for x in points_array[:, 0]])
-                # Depth was multiplied by 10e-8 for depth to not affect kdtree closest search.
-                depth = depth[:, 2] * 100000000
-                depth = depth / np.amax(depth)  # Normalized depth
-                weight_depth = 3
-                weight_dist = 1
-
-                score = (depth * weight_depth + dist * weight_dist + dist * depth) / (weight_depth + weight_dist)
-
-                best_match_i = np.argmin(score)  # index of best score within the points found.
-                match_index = points_found[best_match_i][1]  # index of best score within all points arrays
-                origin = self.world_space[match_index]
-                mesh_index = self.indices[match_index]
-                close_points.append((origin, match_index, points_found[best_match_i][2], points_found[best_match_i][2],
-                                     mesh_index))
-
-        # sort possible closest points if more than one point
-        if len(close_points) == 1:
-            # logger.debug(f"Closest id: {close_points[0][1]} - is origin: {close_points[0][1] in self.origins_map}")
-            closest_point_data = (
-                close_points[0][1], close_points[0][3], self.scene_meshes[self.object_id[close_points[0][1]]],
-                close_points[0][1] in self.origins_map, close_points[0][4])
-        elif len(close_points) > 1:
-            # If multiple points, sort by distance to mouse
-            closest = sorted(close_points, key=lambda point: point[2])[0]
-            # logger.debug(f"Closest id: {close_points[0][1]} - is origin: {close_points[0][1] in self.origins_map}")
-            closest_point_data = (closest[1], closest[3], self.scene_meshes[self.object_id[close_points[0][1]]],
-                                  closest[0][1] in self.origins_map, close_points[0][4])
-        return closest_point_data
+        index, distance, object_id, is_origin, element_index = closest
+        return index, distance, self.scene_meshes[object_id], is_origin, element_index
 
     def get_max_vertex_count(self, context, selected_objects, scene_objects):
         """
@@ -677,17 +740,9 @@ class SnapData:
                 for obj_name in selected_objects:
                     obj = bpy.data.objects[obj_name]
                     if obj.type == 'MESH':
-                        if self.object_mode:
-                            data = obj.evaluated_get(depsgraph).data
-                        else:
-                            data = obj.data
-
-                        if self.snap_type == 'POINTS':
-                            max_vertex_count += len(data.vertices)
-                        elif self.snap_type == 'MIDPOINTS':
-                            max_vertex_count += len(data.edges)
-                        elif self.snap_type == 'FACES':
-                            max_vertex_count += len(data.polygons)
+                        evaluated, _ = self.choose_mesh(obj_name, self.object_mode, depsgraph)
+                        mesh_data = self.mesh_cache.get_mesh_data(obj_name, evaluated, depsgraph)
+                        max_vertex_count += mesh_data.get_element_count(self.snap_type)
 
                     elif obj.type == 'CURVE':
                         max_vertex_count += sum(
@@ -702,17 +757,9 @@ class SnapData:
                 for obj_name in all_meshes:
                     obj = bpy.data.objects[obj_name]
                     if obj.type == 'MESH':
-                        if self.settings.ignore_modifiers:
-                            data = obj.data
-                        else:
-                            data = obj.evaluated_get(depsgraph).data
-
-                        if self.snap_type == 'POINTS':
-                            max_vertex_count += len(data.vertices)
-                        elif self.snap_type == 'MIDPOINTS':
-                            max_vertex_count += len(data.edges)
-                        elif self.snap_type == 'FACES':
-                            max_vertex_count += len(data.polygons)
+                        evaluated, _ = self.choose_mesh(obj_name, not self.settings.ignore_modifiers, depsgraph)
+                        mesh_data = self.mesh_cache.get_mesh_data(obj_name, evaluated, depsgraph)
+                        max_vertex_count += mesh_data.get_element_count(self.snap_type)
 
                     elif obj.type == 'CURVE':
                         max_vertex_count += sum(
@@ -720,12 +767,8 @@ class SnapData:
                 for obj_name in selected_objects:
                     obj = bpy.data.objects[obj_name]
                     if obj.type == 'MESH':
-                        if self.snap_type == 'POINTS':
-                            max_vertex_count += len(obj.data.vertices)
-                        elif self.snap_type == 'MIDPOINTS':
-                            max_vertex_count += len(obj.data.edges)
-                        elif self.snap_type == 'FACES':
-                            max_vertex_count += len(obj.data.polygons)
+                        max_vertex_count += self.mesh_cache.get_mesh_data(obj_name, False).get_element_count(
+                            self.snap_type)
                     elif obj.type == 'CURVE':
                         max_vertex_count += sum(
                             [(len(spline.points) + len(spline.bezier_points)) for spline in obj.data.splines])
@@ -733,7 +776,12 @@ class SnapData:
         logger.info(f"Max vertex count: {max_vertex_count} - is_origin_snapdata={self.is_origin_snapdata}")
         return max_vertex_count
 
+    @quicksnap_profiling.timed('add_nearby_objects')
     def add_nearby_objects(self, context, region, depsgraph, mouse_position, selected_objs=[]):
+        """
+        selected_objs: names of the selected objects, their children are not added.
+        """
+        selection_descendants = self.hierarchy.get_descendants(selected_objs)
         # Now we will search for other objects to process around the mouse.
         for obj in self.processed:  # Hide already processed meshes
             if obj not in bpy.data.objects:
@@ -750,7 +798,7 @@ class SnapData:
 
         # Add the close objects to the to-process list
         for obj in close_objects:
-            if self.object_mode and quicksnap_utils.has_parent(obj, selected_objs):
+            if self.object_mode and obj.name in selection_descendants:
                 if obj.name not in self.processed:
                     self.processed.add(obj.name)
                 continue
@@ -771,7 +819,7 @@ class SnapData:
         # for obj in selected_objs:
         #     bpy.data.objects[obj].select_set(True)
         if direct_hit:
-            if self.object_mode and quicksnap_utils.has_parent(direct_hit_object, selected_objs):
+            if self.object_mode and direct_hit_object.name in selection_descendants:
                 if direct_hit_object.name not in self.processed:
                     self.processed.add(direct_hit_object.name)
                 else:
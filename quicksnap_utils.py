@@ -1,4 +1,5 @@
-﻿import bpy, mathutils, logging
+﻿import bpy, mathutils, logging, time, itertools, sys
+from collections import OrderedDict
 from mathutils import Vector
 from enum import Enum
 from bpy_extras import view3d_utils
@@ -14,6 +15,275 @@ class State(Enum):
     DESTINATION_PICKED = 3
 
 
+class MouseMoveCoalescer:
+    """
+    Coalesce MOUSEMOVE events of the modal loop: mouse positions are queued and only the latest one is processed,
+    at most once every {min_interval} seconds. Also keeps track of the last applied inputs to skip redundant apply.
+    Every decision is counted in self.stats.
+    """
+
+    def __init__(self, min_interval=1 / 60):
+        self.min_interval = min_interval
+        self.pending_position = None
+        self.last_process_time = 0
+        self.last_apply_key = None
+        self.stats = {
+            'mouse_events': 0,
+            'coalesced': 0,
+            'processed': 0,
+            'apply': 0,
+            'apply_skipped': 0,
+        }
+
+    @property
+    def has_pending(self):
+        return self.pending_position is not None
+
+    def push(self, mouse_position):
+        """
+        Store a new mouse position, replacing the previous one if it was not processed yet.
+        """
+        self.stats['mouse_events'] += 1
+        if self.pending_position is not None:
+            self.stats['coalesced'] += 1
+        self.pending_position = mouse_position
+
+    def should_process(self, force=False):
+        """
+        Returns True if the pending mouse position should be processed now.
+        force: process even if there is no pending mouse position or if the minimum interval is not reached.
+        """
+        if force:
+            return True
+        return self.pending_position is not None and time.perf_counter() - self.last_process_time >= self.min_interval
+
+    def pop(self):
+        """
+        Returns the latest pending mouse position (None if there is none), and mark it as processed.
+        """
+        mouse_position = self.pending_position
+        self.pending_position = None
+        self.last_process_time = time.perf_counter()
+        self.stats['processed'] += 1
+        return mouse_position
+
+    def need_apply(self, apply_key):
+        """
+        Returns False if apply_key is the same as the one of the last apply. A None apply_key is always applied.
+        """
+        if apply_key is not None and apply_key == self.last_apply_key:
+            self.stats['apply_skipped'] += 1
+            return False
+        self.last_apply_key = apply_key
+        self.stats['apply'] += 1
+        return True
+
+    def reset_apply(self):
+        """
+        Forget the last applied inputs, to be called when the snap data point ids are not valid anymore.
+        """
+        self.last_apply_key = None
+
+
+class FrameBudget:
+    """
+    Adaptive time budget for the SnapData processing done on each modal tick.
+    Measures the time between two timer ticks (frame time) and the time spent in the draw callbacks, then grows or
+    shrinks the budget to keep the frame time close to {target_frame_time}.
+    """
+
+    def __init__(self, budget=0.01, min_budget=0.002, max_budget=0.05, target_frame_time=1 / 30, smoothing=0.2):
+        self.budget = budget
+        self.min_budget = min_budget
+        self.max_budget = max_budget
+        self.target_frame_time = target_frame_time
+        self.smoothing = smoothing
+        self.frame_time = target_frame_time
+        self.draw_time = 0
+        self.current_draw_time = 0
+        self.last_tick_time = None
+        self.stats = {
+            'ticks': 0,
+            'grow': 0,
+            'shrink': 0,
+        }
+
+    def add_draw_time(self, duration):
+        """
+        Register the duration of a draw callback, accumulated until the next tick.
+        """
+        self.current_draw_time += duration
+
+    def tick(self):
+        """
+        To be called on every timer event. Measures the frame time and updates the budget, returns the new budget.
+        """
+        current_time = time.perf_counter()
+        if self.last_tick_time is not None:
+            self.frame_time += (current_time - self.last_tick_time - self.frame_time) * self.smoothing
+            self.draw_time += (self.current_draw_time - self.draw_time) * self.smoothing
+            # Time left in a frame once the viewport is redrawn.
+            available_time = max(self.target_frame_time - self.draw_time, self.min_budget)
+            if self.frame_time > self.target_frame_time or self.budget > available_time:
+                self.budget *= 0.8
+                self.stats['shrink'] += 1
+            elif self.frame_time < self.target_frame_time * 0.75:
+                self.budget *= 1.2
+                self.stats['grow'] += 1
+            self.budget = min(max(self.budget, self.min_budget), self.max_budget, available_time)
+        self.last_tick_time = current_time
+        self.current_draw_time = 0
+        self.stats['ticks'] += 1
+        return self.budget
+
+    def reset_tick(self):
+        """
+        Forget the last tick time, to be called when ticks are interrupted (timer removed).
+        """
+        self.last_tick_time = None
+        self.current_draw_time = 0
+
+
+class RedrawTracker:
+    """
+    Only request a viewport redraw when the state displayed by the overlays changed since the last redraw.
+    """
+
+    def __init__(self):
+        self.last_state = None
+        self.stats = {
+            'redraws': 0,
+            'skipped': 0,
+        }
+
+    def need_redraw(self, state, force=False):
+        """
+        Returns True if the overlay state is different from the state of the last redraw (or if force is True).
+        """
+        if force or state != self.last_state:
+            self.last_state = state
+            self.stats['redraws'] += 1
+            return True
+        self.stats['skipped'] += 1
+        return False
+
+
+def get_nbytes(value):
+    """
+    Returns an estimate of the bytes held by value: NumPy arrays are counted with their buffer, containers
+    (dict/list/tuple/set) with their content, objects with a nbytes() method with its result.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if callable(getattr(value, 'nbytes', None)):
+        return value.nbytes()
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(get_nbytes(key) + get_nbytes(item) for key, item in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(get_nbytes(item) for item in value)
+    return sys.getsizeof(value)
+
+
+def total_bytes(usage):
+    """
+    Returns the sum of a memory usage report (bytes counts in nested dictionaries).
+    """
+    if isinstance(usage, dict):
+        return sum(total_bytes(value) for value in usage.values())
+    return usage
+
+
+# Shared by all ObjectCache, to find the least recently used entry across caches.
+cache_access_counter = itertools.count()
+
+
+class ObjectCache(OrderedDict):
+    """
+    Per object cache of the draw callbacks (object name -> cached data), ordered from the least to the most recently
+    used object. Entry sizes are only measured again after the entry was accessed.
+    See trim_object_caches to evict the least recently used entries.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.last_access = {}
+        self.sizes = {}
+        self.dirty = set()
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.touch(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.touch(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.forget(key)
+
+    def touch(self, key):
+        self.move_to_end(key)
+        self.last_access[key] = next(cache_access_counter)
+        self.dirty.add(key)
+
+    def forget(self, key):
+        self.last_access.pop(key, None)
+        self.sizes.pop(key, None)
+        self.dirty.discard(key)
+
+    def clear(self):
+        super().clear()
+        self.last_access.clear()
+        self.sizes.clear()
+        self.dirty.clear()
+
+    def oldest_access(self):
+        """
+        Returns the access counter of the least recently used entry, None if the cache is empty.
+        """
+        if len(self) == 0:
+            return None
+        return self.last_access[next(iter(self))]
+
+    def evict_oldest(self):
+        """
+        Remove the least recently used entry, returns its size in bytes.
+        """
+        key, _ = self.popitem(last=False)
+        size = self.sizes.get(key, 0)
+        self.forget(key)
+        return size
+
+    def memory_usage(self):
+        """
+        Returns the bytes held per object: {object name: bytes}
+        """
+        for key in self.dirty:
+            if key in self:
+                self.sizes[key] = get_nbytes(super().__getitem__(key))
+        self.dirty.clear()
+        return dict(self.sizes)
+
+
+def trim_object_caches(caches, max_bytes):
+    """
+    Evict the least recently used objects of the caches until the caches hold less than {max_bytes} in total.
+    The most recently used entry is never evicted. Returns (total bytes, evicted entry count).
+    """
+    total = sum(sum(cache.memory_usage().values()) for cache in caches)
+    evicted = 0
+    while total > max_bytes:
+        candidates = [cache for cache in caches if len(cache) > 0]
+        if sum(len(cache) for cache in candidates) <= 1:
+            break
+        oldest_cache = min(candidates, key=lambda cache: cache.oldest_access())
+        total -= oldest_cache.evict_oldest()
+        evicted += 1
+    return total, evicted
+
+
 def transform_worldspace_viewspace(world_space_coord, perspective_matrix):
     return perspective_matrix @ Vector((world_space_coord[0], world_space_coord[1], world_space_coord[2], 1.0))
 
@@ -37,31 +307,67 @@ def get_selection_objects(context):
 
 
 def get_scene_objects(exclude_selection=False):
+    view_layer = bpy.context.view_layer
     if exclude_selection:
-        objects = [obj.name for obj in bpy.data.objects if
-                   obj not in bpy.context.selected_objects and obj.visible_get()]
+        objects = [obj.name for obj in view_layer.objects if
+                   obj.visible_get(view_layer=view_layer) and not obj.select_get(view_layer=view_layer)]
     else:
-        objects = [obj.name for obj in bpy.data.objects if
-                   obj.visible_get()]
+        objects = [obj.name for obj in view_layer.objects if
+                   obj.visible_get(view_layer=view_layer)]
     return objects
 
 
-def include_children(objects, recursive_call=False):
+class SceneObjects:
     """
-    Inputs a list of objects, outputs that list + children objects
+    Names of the visible objects of the view layer, enumerated once per tool invocation, and of the selected objects.
+    Visibility does not change while the tool is running: only the selection is updated when the snapdata are rebuilt
+    (see update_selection), instead of scanning all the objects again.
     """
 
+    def __init__(self, view_layer=None):
+        if view_layer is None:
+            view_layer = bpy.context.view_layer
+        self.visible = []
+        selection = set()
+        for obj in view_layer.objects:
+            if obj.visible_get(view_layer=view_layer):
+                self.visible.append(obj.name)
+                if obj.select_get(view_layer=view_layer):
+                    selection.add(obj.name)
+        self.selection = frozenset(selection)
+        self.unselected = [object_name for object_name in self.visible if object_name not in self.selection]
+
+    def update_selection(self, object_names):
+        """
+        Set the selected objects, excluded from get_scene_objects(exclude_selection=True).
+        """
+        selection = frozenset(object_names)
+        if selection == self.selection:
+            return
+        self.selection = selection
+        self.unselected = [object_name for object_name in self.visible if object_name not in selection]
+
+    def get_scene_objects(self, exclude_selection=False):
+        """
+        Returns a new list of the visible object names, without the selected objects if exclude_selection is True.
+        """
+        if exclude_selection:
+            return list(self.unselected)
+        return list(self.visible)
+
+
+def include_children(objects):
+    """
+    Inputs a list of objects, outputs that list + children objects
+    """
+    if not isinstance(objects, (list, set, tuple)):
+        objects = [objects]
     result = []
-    if type(objects) is list or type(objects) is set:
-        if not recursive_call:
-            objects = keep_only_parents(objects)
-        for obj in objects:
-            result.extend(include_children(obj, recursive_call=True))
-    else:
-        obj = objects
+    stack = list(keep_only_parents(objects))
+    while stack:
+        obj = stack.pop()
         result.append(obj)
-        for child in obj.children:
-            result.extend(include_children(child, recursive_call=True))
+        stack.extend(obj.children)
     return result
 
 
@@ -77,12 +383,69 @@ def has_parent(obj, parent_list):
     """
     Returns True of the object has a parent among a list of objects
     """
+    if not isinstance(parent_list, (set, frozenset)):
+        parent_list = set(parent_list)
     parent = obj.parent
-    if parent == None:
-        return False
-    if parent in parent_list:
-        return True
-    return has_parent(parent, parent_list)
+    while parent is not None:
+        if parent in parent_list:
+            return True
+        parent = parent.parent
+    return False
+
+
+class HierarchyIndex:
+    """
+    Parent/children links of the objects by name, built once per tool invocation.
+    The descendants of a set of objects are gathered once with an iterative traversal, then each "is a descendant of
+    these objects" query is a set lookup.
+    """
+
+    def __init__(self, objects=None):
+        if objects is None:
+            objects = bpy.data.objects
+        self.children = {}
+        for obj in objects:
+            if obj.parent is not None:
+                self.children.setdefault(obj.parent.name, []).append(obj.name)
+        self.descendants_cache = {}
+
+    def get_descendants(self, object_names):
+        """
+        Returns the set of the names of all the descendants of the objects (children, grandchildren...).
+        """
+        key = frozenset(object_names)
+        descendants = self.descendants_cache.get(key)
+        if descendants is None:
+            descendants = set()
+            stack = [child for object_name in key for child in self.children.get(object_name, ())]
+            while stack:
+                object_name = stack.pop()
+                if object_name in descendants:
+                    continue
+                descendants.add(object_name)
+                stack.extend(self.children.get(object_name, ()))
+            self.descendants_cache[key] = descendants
+        return descendants
+
+    def has_parent(self, object_name, parent_names):
+        """
+        Returns True if the object has a parent among parent_names (at any depth).
+        """
+        return object_name in self.get_descendants(parent_names)
+
+    def keep_only_parents(self, object_names):
+        """
+        Returns the object names minus the descendants of the other objects of the list.
+        """
+        descendants = self.get_descendants(object_names)
+        return [object_name for object_name in object_names if object_name not in descendants]
+
+    def include_children(self, object_names):
+        """
+        Returns the object names + the names of all their descendants.
+        """
+        parents = self.keep_only_parents(object_names)
+        return parents + list(self.get_descendants(parents))
 
 
 def set_object_mode_if_needed():
@@ -112,13 +475,81 @@ def translate_object_worldspace(obj, translation):
 def translate_vertices_worldspace(obj, bmesh, backup_vertices, translation):
     if hasattr(bmesh.verts, "ensure_lookup_table"):
         bmesh.verts.ensure_lookup_table()
-    world_matrix = obj.matrix_world
-    world_matrix_inverted = world_matrix.copy().inverted()
+    local_translation = get_local_translation_matrix(obj, translation)
     for (index, co, _, _, _, _) in backup_vertices:
-        bmesh.verts[index].co = world_matrix_inverted @ translation @ world_matrix @ co
+        bmesh.verts[index].co = local_translation @ co
     bmesh.to_mesh(obj.data)
 
 
+def get_local_translation_matrix(obj, translation):
+    """
+    Returns the object space matrix equivalent to a world space translation matrix applied to the object points.
+    """
+    world_matrix = obj.matrix_world
+    return world_matrix.inverted() @ translation @ world_matrix
+
+
+def get_vertices_co(mesh):
+    """
+    Returns the object space coordinates of all the mesh vertices as a (N, 3) array.
+    """
+    vertex_count = len(mesh.vertices)
+    vertices_co = np.empty(vertex_count * 3, dtype=np.float64)
+    mesh.vertices.foreach_get('co', vertices_co)
+    vertices_co.shape = (vertex_count, 3)
+    return vertices_co
+
+
+def get_vertices_select(mesh):
+    """
+    Returns the selection state of all the mesh vertices as a boolean array.
+    """
+    selected_mask = np.empty(len(mesh.vertices), dtype=bool)
+    mesh.vertices.foreach_get('select', selected_mask)
+    return selected_mask
+
+
+def transform_points_np(matrix, points):
+    """
+    Apply a 4x4 matrix to a (N, 3) array of points with a single matrix multiply.
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    return points @ matrix[:3, :3].T + matrix[:3, 3]
+
+
+def translate_vertices_worldspace_np(obj, base_co, vertex_indices, translation):
+    """
+    Array based alternative to translate_vertices_worldspace and bpy.ops.transform.translate, for large selections.
+    base_co: (N, 3) object space coordinates of all the mesh vertices before translation (see get_vertices_co)
+    vertex_indices: indices of the vertices to move.
+    The mesh data is written with foreach_set, the object must be in object mode.
+    """
+    local_translation = get_local_translation_matrix(obj, translation)
+    vertices_co = base_co.copy()
+    vertices_co[vertex_indices] = transform_points_np(local_translation, base_co[vertex_indices])
+    obj.data.vertices.foreach_set('co', vertices_co.ravel())
+    obj.data.update()
+
+
+def get_selection_wire_np(obj):
+    """
+    Returns (world space coordinates of the selected vertices as a (N, 3) float32 array, (M, 2) indices in that array of
+    the edges between selected vertices) of a mesh in edit mode.
+    """
+    obj.update_from_editmode()
+    mesh = obj.data
+    selected_mask = get_vertices_select(mesh)
+    vertex_indices = np.flatnonzero(selected_mask)
+    vertices_co = transform_points_np(obj.matrix_world, get_vertices_co(mesh)[vertex_indices])
+    edge_verts = np.empty(len(mesh.edges) * 2, dtype=int)
+    mesh.edges.foreach_get('vertices', edge_verts)
+    edge_verts.shape = (len(mesh.edges), 2)
+    edge_verts = edge_verts[selected_mask[edge_verts].all(axis=1)]
+    selected_index = np.full(len(mesh.vertices), -1, dtype=int)
+    selected_index[vertex_indices] = np.arange(len(vertex_indices))
+    return vertices_co.astype(np.float32), selected_index[edge_verts]
+
+
 def dump(obj):
     print(f"\n\n=============== Dump({obj}) ===============")
     for attr in dir(obj):
@@ -331,22 +762,22 @@ def flatten(nested_list):
 
 def translate_curvepoints_worldspace(obj, backup_data, translation):
     """
-    Apply translation to curve points
+    Apply world space translation to backed up curve points
     """
     curve_data = obj.data
+    local_translation = get_local_translation_matrix(obj, translation)
     for (curve_index, index, co, bezier, left, right) in backup_data:
         if bezier:
-            curve_data.splines[curve_index].bezier_points[index].co = translation @ co.copy()
-            curve_data.splines[curve_index].bezier_points[index].handle_left = translation @ left.copy()
-            curve_data.splines[curve_index].bezier_points[index].handle_right = translation @ right.copy()
+            curve_data.splines[curve_index].bezier_points[index].co = local_translation @ co
+            curve_data.splines[curve_index].bezier_points[index].handle_left = local_translation @ left
+            curve_data.splines[curve_index].bezier_points[index].handle_right = local_translation @ right
         else:
             original_point = Vector((co[0], co[1], co[2]))
-            target_position = translation @ original_point
+            target_position = local_translation @ original_point
             curve_data.splines[curve_index].points[index].co = (target_position[0],
                                                                 target_position[1],
                                                                 target_position[2],
-                                                                0)
-    pass
+                                                                co[3])
 
 
 def has_points_selected(selected_meshes):
@@ -0,0 +1,64 @@
+"""
+The tests only cover the addon modules that do not depend on bpy: they are imported without running the addon
+__init__ (registration needs Blender), see benchmarks/benchmark_snapdata.import_addon_module.
+The addon package is registered as soon as this file is loaded, so pytest finds it when collecting the tests.
+"""
+import importlib
+import math
+import sys
+import types
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+REGION_WIDTH = 1920
+REGION_HEIGHT = 1080
+
+
+PACKAGE_DIR = Path(__file__).resolve().parents[1]
+
+
+def register_addon_package():
+    package_name = PACKAGE_DIR.name
+    if package_name not in sys.modules:
+        package = types.ModuleType(package_name)
+        package.__path__ = [str(PACKAGE_DIR)]
+        package.__file__ = str(PACKAGE_DIR / '__init__.py')
+        sys.modules[package_name] = package
+    return package_name
+
+
+def import_addon_module(module_name):
+    return importlib.import_module(f"{register_addon_package()}.{module_name}")
+
+
+register_addon_package()
+
+
+def perspective_matrix(fov=math.radians(50), near=0.01, far=1000, width=REGION_WIDTH, height=REGION_HEIGHT):
+    """
+    Perspective matrix of a camera at the world origin looking down -Z.
+    """
+    focal = 1 / math.tan(fov / 2)
+    return np.array((
+        (focal * height / width, 0, 0, 0),
+        (0, focal, 0, 0),
+        (0, 0, (far + near) / (near - far), 2 * far * near / (near - far)),
+        (0, 0, -1, 0),
+    ))
+
+
+@pytest.fixture(scope='session')
+def quicksnap_engine():
+    return import_addon_module('quicksnap_engine')
+
+
+@pytest.fixture(scope='session')
+def quicksnap_geometry():
+    return import_addon_module('quicksnap_geometry')
+
+
+@pytest.fixture
+def viewport(quicksnap_engine):
+    return quicksnap_engine.Viewport(perspective_matrix(), REGION_WIDTH, REGION_HEIGHT)
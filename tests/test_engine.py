@@ -0,0 +1,166 @@
+import numpy as np
+import pytest
+
+from conftest import REGION_HEIGHT, REGION_WIDTH
+
+
+def random_points(seed, count, depth=(-50, -5)):
+    """
+    Returns (N, 3) world space points in front of the test camera, mostly inside the view.
+    """
+    rng = np.random.default_rng(seed)
+    z = rng.uniform(depth[0], depth[1], count)
+    return np.column_stack((rng.uniform(-1, 1, count) * -z, rng.uniform(-0.5, 0.5, count) * -z, z))
+
+
+def brute_force_closest(quicksnap_engine, engine, mouse, search_distance=20):
+    """
+    Reference find_closest: score every valid indexed point.
+    """
+    count = engine.added_points_np
+    region_2d = engine.region_2d[:count]
+    distances = np.linalg.norm(region_2d - np.asarray(mouse, dtype=np.float64), axis=1)
+    candidates = np.flatnonzero((distances <= search_distance) & ~engine.invalid[:count])
+    if len(candidates) == 0:
+        return None
+    best = quicksnap_engine.best_candidate(distances[candidates], engine.depth[candidates], search_distance)
+    return candidates[best]
+
+
+def ingest_all(engine, object_points, batch_size):
+    while not object_points.completed:
+        start = engine.added_points_np
+        engine.ingest(object_points, batch_size)
+        engine.balance_tree(start, engine.added_points_np)
+
+
+def test_project_points_filters_points_behind_the_camera_and_outside_the_view(quicksnap_engine, viewport):
+    points = np.array(((0, 0, -10), (0, 0, 10), (1000, 0, -10), (0.5, 0.25, -2)))
+    world_space_co, screen_space_co, visible = quicksnap_engine.project_points(points, np.identity(4), viewport)
+    assert visible.tolist() == [True, False, False, True]
+    assert np.allclose(world_space_co, points[visible])
+    assert np.allclose(screen_space_co[0], (REGION_WIDTH / 2, REGION_HEIGHT / 2, 10))
+    assert screen_space_co[1, 0] > REGION_WIDTH / 2 and screen_space_co[1, 1] > REGION_HEIGHT / 2
+
+
+def test_project_points_applies_the_object_matrix(quicksnap_engine, viewport):
+    matrix_world = np.identity(4)
+    matrix_world[:3, 3] = (1, 2, -20)
+    world_space_co, _, _ = quicksnap_engine.project_points(np.array(((0, 0, 0), (1, 0, 0))), matrix_world, viewport)
+    assert np.allclose(world_space_co, ((1, 2, -20), (2, 2, -20)))
+
+
+def test_best_candidate_prefers_the_points_closer_to_the_camera(quicksnap_engine):
+    assert quicksnap_engine.best_candidate([10, 2], [1, 10], 20) == 0
+    assert quicksnap_engine.best_candidate([10, 2], [5, 5], 20) == 1
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_screen_index_matches_brute_force(quicksnap_engine, seed):
+    rng = np.random.default_rng(seed)
+    co = np.column_stack((rng.uniform(0, 200, 500), rng.uniform(0, 200, 500), rng.uniform(0, 1e-6, 500)))
+    index = quicksnap_engine.ScreenIndex(len(co))
+    for i, point in enumerate(co):
+        index.insert(point, i)
+    index.balance()
+    for query in rng.uniform(0, 200, (20, 2)):
+        query = (query[0], query[1], 0)
+        distances = np.linalg.norm(co - query, axis=1)
+        found = index.find_range(query, 15)
+        assert sorted(i for (_, i, _) in found) == sorted(np.flatnonzero(distances <= 15).tolist())
+        assert [dist for (_, _, dist) in found] == sorted(dist for (_, _, dist) in found)
+        nearest = index.find_n(query, 3)
+        assert [i for (_, i, _) in nearest] == np.argsort(distances, kind='stable')[:3].tolist()
+
+
+def test_screen_index_only_finds_balanced_points(quicksnap_engine):
+    index = quicksnap_engine.ScreenIndex(2)
+    index.insert((10, 10, 0), 0)
+    index.balance()
+    index.insert((12, 10, 0), 1)
+    assert [i for (_, i, _) in index.find_range((12, 10, 0), 5)] == [0]
+    with pytest.raises(ValueError):
+        index.insert((0, 0, 0), 2)
+
+
+def test_ingest_copies_the_points_in_batches(quicksnap_engine, viewport):
+    points = random_points(0, 1000)
+    object_points = quicksnap_engine.ObjectPoints(points, np.identity(4), viewport, np.arange(len(points)), 3)
+    engine = quicksnap_engine.SnapEngine(viewport, 10, 1)
+    ingested = engine.ingest(object_points, 300)
+    assert ingested.tolist() == object_points.indices[:300].tolist()
+    assert not object_points.completed
+    world_space_co = object_points.world_space_co.copy()
+    ingest_all(engine, object_points, 300)
+    assert object_points.completed and object_points.world_space_co is None
+    assert engine.added_points_np == len(world_space_co)
+    assert object_points.insert_ranges == [(0, len(world_space_co))]
+    assert np.allclose(engine.world_space[:engine.added_points_np], world_space_co)
+    assert (engine.object_id[:engine.added_points_np] == 3).all()
+    assert (engine.spline_index[:engine.added_points_np] == -1).all()
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_find_closest_matches_brute_force(quicksnap_engine, viewport, seed):
+    engine = quicksnap_engine.SnapEngine(viewport, 100, 1)
+    for object_id in range(3):
+        points = random_points(seed * 10 + object_id, 3000)
+        ingest_all(engine, quicksnap_engine.ObjectPoints(points, np.identity(4), viewport, np.arange(len(points)),
+                                                         object_id), 700)
+    rng = np.random.default_rng(seed)
+    for mouse in rng.uniform((0, 0), (REGION_WIDTH, REGION_HEIGHT), (50, 2)):
+        mouse = (mouse[0], mouse[1], 0)
+        expected = brute_force_closest(quicksnap_engine, engine, mouse)
+        closest = engine.find_closest(mouse)
+        if expected is None:
+            assert closest is None
+            continue
+        index, distance, object_id, is_origin, element_index = closest
+        assert index == expected
+        assert object_id == engine.object_id[expected] and element_index == engine.indices[expected]
+        assert not is_origin
+
+
+def test_invalidated_points_are_not_found(quicksnap_engine, viewport):
+    engine = quicksnap_engine.SnapEngine(viewport, 10, 1)
+    points = np.array(((0, 0, -10),))
+    first = quicksnap_engine.ObjectPoints(points, np.identity(4), viewport, [0], 0)
+    ingest_all(engine, first, 10)
+    mouse = (REGION_WIDTH / 2, REGION_HEIGHT / 2, 0)
+    assert engine.find_closest(mouse)[0] == 0
+    version = engine.points_version
+    engine.invalidate(first)
+    assert engine.points_version != version
+    assert first.insert_ranges == []
+    assert engine.find_closest(mouse) is None
+    ingest_all(engine, quicksnap_engine.ObjectPoints(points, np.identity(4), viewport, [0], 1), 10)
+    closest = engine.find_closest(mouse)
+    assert (closest[0], closest[2]) == (1, 1)
+
+
+def test_growing_the_arrays_keeps_the_indexed_points(quicksnap_engine, viewport):
+    engine = quicksnap_engine.SnapEngine(viewport, 1, 1)
+    points = random_points(1, 200)
+    object_points = quicksnap_engine.ObjectPoints(points, np.identity(4), viewport, np.arange(len(points)), 0)
+    world_space_co = object_points.world_space_co.copy()
+    ingest_all(engine, object_points, 64)
+    assert len(engine.world_space) >= engine.added_points_np == len(world_space_co)
+    assert np.allclose(engine.world_space[:engine.added_points_np], world_space_co)
+    for index in range(0, engine.added_points_np, 17):
+        assert engine.find_closest(engine.region_2d[index] * (1, 1, 0))[0] == brute_force_closest(
+            quicksnap_engine, engine, engine.region_2d[index] * (1, 1, 0))
+
+
+def test_origins(quicksnap_engine, viewport):
+    engine = quicksnap_engine.SnapEngine(viewport, 4, 2, origins_in_kd=False)
+    assert engine.add_origin((0, 0, 10), 0, "Behind") == -1
+    index = engine.add_origin((0, 0, -10), 1, "Cube")
+    assert engine.add_point((0.01, 0, -10), -1) >= 0
+    engine.balance_tree()
+    engine.balance_origins()
+    assert engine.origins_map == {index: "Cube"}
+    center = (REGION_WIDTH / 2, REGION_HEIGHT / 2, 0)
+    assert engine.find_closest(center, search_origins_only=True) == (index, 0, 1, True, -1)
+    assert engine.find_closest((0, 0, 0), search_origins_only=True) is None
+    # The origin is not in the points index, the cursor is.
+    assert engine.find_closest(center)[0] != index
@@ -0,0 +1,54 @@
+import numpy as np
+
+
+def segment_points(segments):
+    return np.concatenate([coords for (_, coords) in segments])
+
+
+def test_point_segments_only_copy_the_added_points(quicksnap_geometry):
+    source = np.arange(300, dtype=np.float64).reshape(-1, 3)
+    segments = quicksnap_geometry.PointSegments()
+    assert segments.update(source, 10, 1)
+    assert not segments.update(source, 10, 1)
+    assert segments.update(source, 100, 1)
+    assert np.array_equal(segment_points(segments.segments), source)
+    assert segment_points(segments.segments).dtype == np.float32
+
+
+def test_point_segments_merge_by_size_tiers(quicksnap_geometry):
+    source = np.zeros((1000, 3))
+    segments = quicksnap_geometry.PointSegments(max_segment_size=64)
+    for count in range(1, len(source) + 1):
+        segments.update(source, count, 1)
+        sizes = [len(coords) for (_, coords) in segments.segments]
+        assert sum(sizes) == count
+        assert all(size <= 64 for size in sizes)
+        # Below the max size, segments are strictly decreasing: O(log(N)) draw calls.
+        small_sizes = [size for size in sizes if size < 64]
+        assert small_sizes == sorted(set(small_sizes), reverse=True)
+
+
+def test_point_segments_keys_are_unique(quicksnap_geometry):
+    source = np.zeros((100, 3))
+    segments = quicksnap_geometry.PointSegments()
+    keys = set()
+    for count in range(1, len(source) + 1):
+        segments.update(source, count, 1)
+        key = segments.segments[-1][0]
+        assert key not in keys
+        keys.add(key)
+
+
+def test_point_segments_reset_on_new_version(quicksnap_geometry):
+    source = np.arange(30, dtype=np.float64).reshape(-1, 3)
+    invalid = np.zeros(len(source), dtype=bool)
+    invalid[2:5] = True
+    segments = quicksnap_geometry.PointSegments()
+    segments.update(source, 10, 1)
+    assert segments.update(source, 10, 2, invalid)
+    assert np.array_equal(segment_points(segments.segments), source[~invalid])
+    assert segments.update(source, 4, 2)
+    assert np.array_equal(segment_points(segments.segments), source[:4])
+    invalid[:] = True
+    assert segments.update(source, 10, 3, invalid)
+    assert segments.segments == []